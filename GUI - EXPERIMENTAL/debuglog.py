@@ -0,0 +1,175 @@
+import os
+import json
+import gzip
+import time
+import queue
+import atexit
+import shutil
+import threading
+from datetime import datetime
+
+# Debug log shared by rewind.py and manager.py. Records are JSON lines
+# ({"time": ..., "source": ..., "message": ..., plus any extra fields}) so
+# they can be filtered with jq or loaded back for bug reports.
+
+MAX_BYTES = 5 * 1024 * 1024
+MAX_AGE = 24 * 60 * 60
+BACKUPS = 10
+FLUSH_INTERVAL = 0.5
+BATCH = 1000
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+class DebugLog:
+    """A log file written in batches by a background thread.
+
+    write() only puts the record on a queue, so it is cheap enough to call
+    for every line SteamCMD prints. The writer thread collects records for
+    up to FLUSH_INTERVAL seconds (or BATCH records) and writes them with a
+    single write and flush. The file, <name>.jsonl in folder, is created on
+    the first write and rotated once it grows past max_bytes or its first
+    record is older than max_age; rotated files are gzipped by the writer
+    thread and only the newest `backups` of them are kept.
+
+    flush() waits until everything written so far is on disk; close() does
+    the same and stops the thread. Logs from open_log() are closed at exit,
+    which also covers typer.Exit and Ctrl+C.
+    """
+
+    def __init__(self, folder: str, name: str, max_bytes: int = MAX_BYTES,
+                 max_age: float = MAX_AGE, backups: int = BACKUPS):
+        self.folder = folder
+        self.name = name
+        self.path = os.path.join(folder, f"{name}.jsonl")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.closed = False
+        self.file = None
+        self.started = 0.0
+
+    def write(self, message: str, **fields):
+        record = {"time": datetime.now().isoformat(timespec="milliseconds"), "source": self.name,
+                  "message": message}
+        record.update(fields)
+        with self.lock:
+            if self.closed:
+                return
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=f"debuglog-{self.name}", daemon=True)
+                self.thread.start()
+        self.queue.put(record)
+
+    def flush(self, timeout: float = 5.0):
+        if self.thread is None or self.closed:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            thread = self.thread
+        if thread is not None:
+            self.queue.put(None)
+            thread.join(timeout)
+
+    def _run(self):
+        pending = []
+        waiters = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            stop = False
+            try:
+                item = self.queue.get(timeout=timeout)
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    pending.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + FLUSH_INTERVAL
+            except queue.Empty:
+                pass
+
+            if stop or waiters or len(pending) >= BATCH or (deadline and time.monotonic() >= deadline):
+                if pending:
+                    self._write(pending)
+                    pending = []
+                deadline = None
+                for waiter in waiters:
+                    waiter.set()
+                waiters = []
+            if stop:
+                if self.file:
+                    self.file.close()
+                return
+
+    def _write(self, records: list):
+        data = "".join(json.dumps(record, default=str, ensure_ascii=False) + "\n" for record in records)
+        # The log must never take the program down with it
+        try:
+            if self.file is None:
+                self._open()
+            elif self.file.tell() >= self.max_bytes or time.time() - self.started >= self.max_age:
+                self._rotate()
+            self.file.write(data)
+            self.file.flush()
+        except OSError:
+            pass
+
+    def _open(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self.started = time.time()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.started = datetime.fromisoformat(json.loads(f.readline())["time"]).timestamp()
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        self.file = open(self.path, "a", encoding="utf-8")
+        if self.file.tell() >= self.max_bytes or time.time() - self.started >= self.max_age:
+            self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+        # Microseconds keep the names unique and in order
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        rotated = os.path.join(self.folder, f"{self.name}-{stamp}.jsonl")
+        os.replace(self.path, rotated)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.started = time.time()
+
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        old = sorted(name for name in os.listdir(self.folder)
+                     if name.startswith(f"{self.name}-") and name.endswith(".jsonl.gz"))
+        for name in old[:max(0, len(old) - self.backups)]:
+            os.remove(os.path.join(self.folder, name))
+
+
+def open_log(folder: str, name: str, **options) -> DebugLog:
+    """The DebugLog for folder/name, shared by everyone who asks for it."""
+    key = os.path.join(folder, name)
+    with _logs_lock:
+        if key not in _logs:
+            _logs[key] = DebugLog(folder, name, **options)
+        return _logs[key]
+
+
+@atexit.register
+def close_all():
+    with _logs_lock:
+        logs = list(_logs.values())
+    for log in logs:
+        log.close()
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import shutil
+import threading
+from typing import Optional
+
+# State of download jobs that haven't finished yet, so an interrupted or
+# failed run can pick up where it stopped. Partly downloaded depots are parked
+# in PARTIAL_DIR and put back in front of SteamCMD when the job runs again;
+# SteamCMD keeps the files that are already complete.
+
+STATE_PATH = os.path.join("storage", "downloads.json")
+PARTIAL_DIR = os.path.join("storage", "staging", "partial")
+# Failure kinds worth another try later
+RESUMABLE = ("network", "timeout", "cancelled")
+
+_lock = threading.Lock()
+
+
+def _key(job: tuple) -> str:
+    return "/".join(job[:2])
+
+
+def load() -> dict:
+    try:
+        with open(STATE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(state: dict):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    tmp = STATE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp, STATE_PATH)
+
+
+def get(job: tuple) -> dict:
+    return load().get(_key(job), {})
+
+
+def update(job: tuple, **fields):
+    with _lock:
+        state = load()
+        entry = state.setdefault(_key(job), {})
+        entry.update(fields, updated=time.time())
+        _save(state)
+
+
+def forget(job: tuple):
+    """Drop a job and whatever it had parked."""
+    with _lock:
+        state = load()
+        entry = state.pop(_key(job), None)
+        _save(state)
+    partial = (entry or {}).get("partial")
+    if partial and os.path.abspath(partial).startswith(os.path.abspath(PARTIAL_DIR)):
+        shutil.rmtree(partial, ignore_errors=True)
+
+
+def unfinished() -> list:
+    """Jobs that were queued, running when the program stopped, or failed in a way that may go away.
+
+    Returned as (platform, manifest_id, profile), profile being None for full downloads.
+    """
+    jobs = []
+    for key, entry in load().items():
+        status = entry.get("status")
+        if status in ("queued", "running") or (status == "failed" and entry.get("kind") in RESUMABLE):
+            jobs.append((*key.split("/", 1), entry.get("profile")))
+    return jobs
+
+
+def park(job: tuple, depot_dir: str) -> Optional[str]:
+    """Move a partly downloaded depot out of SteamCMD's way. Returns where it went."""
+    if not os.path.isdir(depot_dir):
+        return None
+    target = os.path.join(PARTIAL_DIR, "-".join(job[:2]))
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    shutil.move(depot_dir, target)
+    return target
+
+
+def claim(job: tuple, depot_dir: str) -> list:
+    """Park what other jobs left in depot_dir before job downloads there. Returns those jobs.
+
+    A job that was running when the program was killed still points at the
+    session's depot folder, which a new job would otherwise seed over or
+    download into.
+    """
+    owners = [key for key, entry in load().items()
+              if key != _key(job) and entry.get("partial")
+              and os.path.abspath(entry["partial"]) == os.path.abspath(depot_dir)]
+    for key in owners:
+        other = tuple(key.split("/", 1))
+        update(other, partial=park(other, depot_dir))
+    return [tuple(key.split("/", 1)) for key in owners]
+
+
+def unpark(job: tuple, depot_dir: str) -> bool:
+    """Put a job's partial depot back where SteamCMD will download it to. True if depot_dir now has it."""
+    partial = get(job).get("partial")
+    if not partial or not os.path.isdir(partial):
+        return False
+    if os.path.abspath(partial) == os.path.abspath(depot_dir):
+        # Killed mid-download: the files are still where SteamCMD left them
+        return bool(os.listdir(depot_dir))
+    if os.path.exists(depot_dir):
+        shutil.rmtree(depot_dir)
+    os.makedirs(os.path.dirname(depot_dir), exist_ok=True)
+    shutil.move(partial, depot_dir)
+    return True
@@ -0,0 +1,97 @@
+import time
+import threading
+from typing import Callable
+
+import catalog
+
+# Version and backup lists of the GUIs. Rows are read from the catalog on a
+# background thread (refresh_stale() may have to walk the folders on a slow
+# disk), and the GUIs only touch the widgets of the rows that were added,
+# removed or changed since the last scan. Filtering works on these plain
+# rows rather than on the widgets, so it stays quick with thousands of
+# entries; size and dates are only formatted for rows that are shown.
+
+# Rows the GTK lists make widgets for at a time, more as they are scrolled down
+PAGE = 200
+
+
+def _row(entry: dict, label: str) -> dict:
+    profile = entry["profile"]
+    return {
+        "key": (entry["kind"], entry["name"]),
+        "kind": entry["kind"],
+        "name": entry["name"],
+        "label": label,
+        "platform": entry["platform"],
+        "profile": profile,
+        "pinned": bool(entry["pinned"]),
+        "bytes": entry["bytes"],
+        "files": entry["files"],
+        "date": entry["manifest_date"],
+        "created": entry["created"],
+        "text": " ".join(str(part) for part in (entry["name"], profile, entry["manifest_date"]) if part).lower(),
+    }
+
+
+def scan() -> dict:
+    """{"backups": rows, "versions": rows} in the order the GUIs list them (versions by platform, newest first)."""
+    catalog.refresh_stale()
+    backups = [_row(entry, entry["name"]) for entry in catalog.entries("backups")]
+    versions = [_row(entry, entry["manifest_id"]) for platform in catalog.platforms()
+                for entry in catalog.entries("versions", platform, order="-date")]
+    return {"backups": backups, "versions": versions}
+
+
+def filter_rows(rows: list, query: str) -> list:
+    """Rows whose name, profile or release date contain every word of query."""
+    words = query.lower().split()
+    if not words:
+        return rows
+    return [row for row in rows if all(word in row["text"] for word in words)]
+
+
+def details(row: dict) -> str:
+    """Size, file count and dates of a row, e.g. for a tooltip or a dim label."""
+    parts = [f"{row['bytes'] / (1024 * 1024):.1f} MB", f"{row['files']} files"]
+    if row["date"]:
+        parts.append(f"released {row['date']}")
+    parts.append(f"stored {time.strftime('%Y-%m-%d %H:%M', time.localtime(row['created']))}")
+    return ", ".join(parts)
+
+
+class Scanner:
+    """Runs scan() on a background thread and hands the rows to deliver(rows) there.
+
+    request() can be called as often as needed: while a scan runs, further
+    requests add up to one more scan after it, so the last one always sees
+    the latest state of the catalog.
+    """
+
+    def __init__(self, deliver: Callable[[dict], None]):
+        self.deliver = deliver
+        self.lock = threading.Lock()
+        self.running = False
+        self.again = False
+
+    def request(self):
+        with self.lock:
+            if self.running:
+                self.again = True
+                return
+            self.running = True
+        threading.Thread(target=self._run, name="listing-scan", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                rows = scan()
+            except Exception:
+                # Catalog busy or unreadable; the lists keep what they show until the next request
+                rows = None
+            if rows is not None:
+                self.deliver(rows)
+            with self.lock:
+                if not self.again:
+                    self.running = False
+                    return
+                self.again = False
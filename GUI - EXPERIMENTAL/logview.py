@@ -0,0 +1,53 @@
+import threading
+from typing import Optional
+
+import debuglog
+
+# Log panel plumbing shared by both GUIs. SteamCMD prints thousands of lines
+# during a big download; putting each of them in the text widget on its own
+# keeps the UI thread busy and the widget grows without end. LogSink collects
+# lines from any thread, the GUI takes them all at most once per frame and
+# inserts them in one go, and only the newest max_lines stay in the widget.
+# Every line also goes to steamdb_debug/<name>.jsonl, so nothing is lost when
+# it scrolls out of the panel.
+
+MAX_LINES = 2000
+FRAME_MS = 33
+LOG_DIR = "steamdb_debug"
+
+
+class LogSink:
+    """Lines waiting for the log panel, plus how many the panel shows.
+
+    write() can be called from any thread and returns True when it queued
+    the first line since the last take(), i.e. when the GUI has to schedule
+    a redraw; take() runs on the UI thread and returns (text, trim): the
+    lines to append in one insert and how many lines to delete from the top
+    of the widget first so it keeps at most max_lines.
+    """
+
+    def __init__(self, name: str, max_lines: int = MAX_LINES, folder: Optional[str] = LOG_DIR):
+        self.max_lines = max_lines
+        self.log = debuglog.open_log(folder, name) if folder else None
+        self.lock = threading.Lock()
+        self.pending = []
+        self.shown = 0
+
+    def write(self, message: str) -> bool:
+        if self.log:
+            self.log.write(message)
+        with self.lock:
+            first = not self.pending
+            self.pending.extend(message.split("\n"))
+        return first
+
+    def take(self) -> tuple:
+        with self.lock:
+            lines, self.pending = self.pending, []
+        if not lines:
+            return "", 0
+        # Lines that would be trimmed right away aren't inserted at all
+        lines = lines[-self.max_lines:]
+        trim = max(0, self.shown + len(lines) - self.max_lines)
+        self.shown += len(lines) - trim
+        return "".join(line + "\n" for line in lines), trim
@@ -0,0 +1,189 @@
+import os
+import mmap
+import stat
+import hashlib
+import threading
+from typing import Callable, Optional
+
+import store
+import catalog
+import transfer
+
+# Integrity check of stored versions and backups against the file list saved
+# with their tree. Files are hashed with the tree's own algorithm (the object
+# store's SHA-1), since that is what the recorded digests are. Digests are
+# cached in the catalog by (device, inode, size, mtime), so a file is only
+# read again once it changed; files shared between versions are hardlinks to
+# the same object and are hashed once for all of them.
+
+MMAP_THRESHOLD = 16 * 1024 * 1024
+# Work sent to a worker process at a time: one big file or many small ones
+BATCH_FILES = 256
+BATCH_BYTES = 64 * 1024 * 1024
+# Less than this to hash isn't worth starting processes for
+POOL_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_PROCESSES = max(1, min(8, os.cpu_count() or 1))
+
+
+def hash_file(path: str, algo: str = store.HASH_ALGO) -> str:
+    """Digest of a file; big files are memory-mapped instead of read in chunks."""
+    h = hashlib.new(algo)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                h.update(mapped)
+        else:
+            while True:
+                chunk = f.read(store.CHUNK_SIZE)
+                if not chunk:
+                    break
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def _hash_batch(paths: list, algo: str) -> list:
+    # Runs in a worker process; an unreadable file gets None
+    digests = []
+    for path in paths:
+        try:
+            digests.append(hash_file(path, algo))
+        except OSError:
+            digests.append(None)
+    return digests
+
+
+def _batches(todo: list) -> list:
+    batches = []
+    batch, size = [], 0
+    for item in todo:
+        if batch and (len(batch) >= BATCH_FILES or size + item[2].st_size > BATCH_BYTES):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(item)
+        size += item[2].st_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _hash_all(todo: list, algo: str, processes: int, progress: Optional[Callable[[int], None]]):
+    """Yield (rel, stat, digest) for (rel, path, stat) items, using a process pool for big jobs."""
+    batches = _batches(todo)
+    if processes > 1 and len(batches) > 1 and sum(item[2].st_size for item in todo) >= POOL_THRESHOLD:
+        # Only loaded when there is enough to hash; it's slow to import
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        from concurrent.futures.process import BrokenProcessPool
+        done = set()
+        try:
+            # Forking would copy a process that has other threads running
+            # (the GUIs, the debug log writer, SteamCMD sessions)
+            with ProcessPoolExecutor(max_workers=min(processes, len(batches)),
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = {pool.submit(_hash_batch, [item[1] for item in batch], algo): i
+                           for i, batch in enumerate(batches)}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    batch = batches[i]
+                    for item, digest in zip(batch, future.result()):
+                        yield item[0], item[2], digest
+                    done.add(i)
+                    if progress:
+                        progress(sum(item[2].st_size for item in batch))
+        except (OSError, BrokenProcessPool, NotImplementedError):
+            # No usable multiprocessing here (frozen build, sandbox...); finish in this process
+            batches = [batch for i, batch in enumerate(batches) if i not in done]
+        else:
+            return
+    for batch in batches:
+        for item, digest in zip(batch, _hash_batch([item[1] for item in batch], algo)):
+            yield item[0], item[2], digest
+        if progress:
+            progress(sum(item[2].st_size for item in batch))
+
+
+def verify_tree(kind: str, name: str, processes: int = DEFAULT_PROCESSES,
+                progress: Optional[Callable[[int], None]] = None,
+                on_total: Optional[Callable[[int], None]] = None,
+                cancel: Optional[threading.Event] = None) -> dict:
+    """Check a stored version/backup folder against its tree.
+
+    Returns {"kind", "name", "path", "files", "missing", "extra", "corrupted",
+    "hashed", "cached", "bytes", "ok"}: missing are files of the tree that
+    aren't in the folder, extra files in the folder that aren't in the tree,
+    corrupted files whose size, content or link target differ (or that can't
+    be read). progress and on_total count the bytes that need hashing, like
+    in store.ingest_tree(). Raises ValueError for folders without a tree, and
+    transfer.Cancelled once cancel is set.
+    """
+    tree = store.load_tree(kind, name)
+    if tree is None:
+        raise ValueError(f"{name} isn't in the object store, there is no file list to check it against")
+    algo = tree.get("algo", store.HASH_ALGO)
+    expected = tree["files"]
+    report = {"kind": kind, "name": name, "path": tree["path"], "files": len(expected),
+              "missing": [], "extra": [], "corrupted": [], "hashed": 0, "cached": 0, "bytes": 0}
+
+    on_disk = dict(store.walk_files(tree["path"])) if os.path.isdir(tree["path"]) else {}
+    report["extra"] = sorted(set(on_disk) - set(expected))
+    cache = catalog.cached_digests(algo)
+    todo = []
+    for rel, entry in sorted(expected.items()):
+        path = on_disk.get(rel)
+        if path is None:
+            report["missing"].append(rel)
+            continue
+        try:
+            st = os.lstat(path)
+        except OSError:
+            report["missing"].append(rel)
+            continue
+        if "link" in entry:
+            if not stat.S_ISLNK(st.st_mode) or os.readlink(path) != entry["link"]:
+                report["corrupted"].append(rel)
+            continue
+        if not stat.S_ISREG(st.st_mode) or st.st_size != entry["size"]:
+            report["corrupted"].append(rel)
+            continue
+        cached = cache.get((st.st_dev, st.st_ino))
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            report["cached"] += 1
+            if cached[2] != entry["digest"]:
+                report["corrupted"].append(rel)
+            continue
+        todo.append((rel, path, st))
+
+    if on_total:
+        on_total(sum(item[2].st_size for item in todo))
+    fresh = []
+    for rel, st, digest in _hash_all(todo, algo, processes, progress):
+        if cancel is not None and cancel.is_set():
+            # What was hashed so far is still worth caching
+            if fresh:
+                catalog.save_digests(algo, fresh)
+            raise transfer.Cancelled()
+        report["hashed"] += 1
+        report["bytes"] += st.st_size
+        if digest is None or digest != expected[rel]["digest"]:
+            report["corrupted"].append(rel)
+        if digest is not None:
+            fresh.append((st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, digest))
+    if fresh:
+        catalog.save_digests(algo, fresh)
+
+    report["corrupted"].sort()
+    report["ok"] = not (report["missing"] or report["extra"] or report["corrupted"])
+    return report
+
+
+def summary(report: dict, limit: int = 5) -> str:
+    """One line about a verify_tree() report, naming up to limit files per problem."""
+    if report["ok"]:
+        return f"{report['files']} files OK"
+    parts = []
+    for key in ("missing", "extra", "corrupted"):
+        files = report[key]
+        if files:
+            names = ", ".join(files[:limit]) + (f" and {len(files) - limit} more" if len(files) > limit else "")
+            parts.append(f"{len(files)} {key} ({names})")
+    return "; ".join(parts)
@@ -1,92 +1,183 @@
 import os
-import shutil
 import time
 import json
 import gi  # type: ignore
 
 import threading
-import subprocess
-import re
+from concurrent.futures import ThreadPoolExecutor
+import store
+import steam
+import catalog
+import verify
+import quota
+import downloads
+import transfer
+import logview
+import listing
 
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk, Gdk, Pango, GLib # type: ignore
-
-def steamcmd_gui(username, password, manifest_id, depot_id, callback):
-
-    APP_ID = "1206560"
-    VERSIONS_DIR = "versions"
-    DEBUG_FOLDER = "steamdb_debug"
-    os.makedirs(DEBUG_FOLDER, exist_ok=True)
-    platform_folder = {"1206561": "Windows", "1206562": "Linux", "1206563": "Mac"}.get(depot_id, "Unknown")
-    version_path = os.path.join(VERSIONS_DIR, platform_folder, manifest_id)
-    os.makedirs(version_path, exist_ok=True)
-
-    command = ["steamcmd", "+login", username]
-    if password:
-        command.append(password)
-    command.extend([
-        "+download_depot", APP_ID, depot_id, manifest_id,
-        "+quit"
-    ])
-
-    callback(f"Running SteamCMD for manifest {manifest_id} (depot {depot_id})...")
-
-    depot_download_path = None
-
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE, text=True, bufsize=1, universal_newlines=True)
-
-    while True:
-        if process.stdout is None:
-            break
-        output = process.stdout.readline()
-        if output == '' and process.poll() is not None:
-            break
-        if output:
-            line = output.strip()
-            if "Steam Guard code" in line or "Steam Guard" in line:
-                callback("Steam Guard code required. Please enter it in the terminal.")
-            elif "Depot download complete" in line:
-                match = re.search(r'Depot download complete : "([^"]+)"', line)
-                if match:
-                    depot_download_path = re.sub(r'\\', '/', match.group(1))
-                    callback(f"Download path: {depot_download_path}")
-            else:
-                callback(line)
+from gi.repository import Gtk, Gdk, GLib # type: ignore
+
+def steam_event_message(event):
+    """Log line for a SteamWorker event, or None for events that aren't worth showing"""
+    kind = event["type"]
+    if kind == "line":
+        return event["line"]
+    if kind == "guard":
+        return "Steam Guard code required. Please approve the login on your Steam Guard app."
+    if kind == "login":
+        return "Logged in to Steam."
+    if kind == "started":
+        platform, manifest_id = event["job"]
+        return f"Running SteamCMD for manifest {manifest_id} ({platform})..."
+    if kind == "downloaded":
+        return "Download complete, storing files..."
+    if kind == "done":
+        mb = 1024 * 1024
+        rate = event["downloaded_bytes"] / max(event["seconds"], 0.001) / mb
+        return (f"Saved version to: {event['path']} ({event['bytes'] / mb:.1f} MB, {event['downloaded_bytes'] / mb:.1f} MB "
+                f"downloaded in {event['seconds']:.0f}s, {rate:.1f} MB/s)")
+    if kind == "resumed":
+        platform, manifest_id = event["job"]
+        return f"Resuming manifest {manifest_id} ({platform}) from the files already downloaded."
+    if kind == "seeded":
+        return f"Starting from stored version {event['seed']} ({event['files']} files), only changed files will be downloaded."
+    if kind == "unseeded":
+        return (f"SteamCMD left no depot manifest, validating the download without the stored version's files "
+                f"({event['files']} removed)...")
+    if kind == "retry":
+        return f"SteamCMD {event['kind']} error: {event['error']}. Retrying in {event['delay']}s (attempt {event['attempt']})..."
+    if kind == "failed":
+        return f"SteamCMD failed: {event['error']}"
+    if kind == "evicted":
+        return f"Storage quota: removed {', '.join(event['names'])}."
+    if kind == "idle":
+        return "SteamCMD session was idle, logged out."
+    if kind == "reconnect":
+        return "Reconnecting to Steam..."
+    return None
+
+class DownloadTracker:
+    """Combined progress of every running download, for the one progress bar"""
 
-    return_code = process.poll()
-    if return_code != 0:
-        callback("SteamCMD failed.")
-        return False
+    def __init__(self):
+        self.jobs = {}
+
+    def update(self, event):
+        """(fraction, text) after a SteamWorker event, or None if the event doesn't move the bar"""
+        kind = event["type"]
+        job = event.get("job")
+        if kind == "started":
+            self.jobs[job] = (0, 0)
+        elif kind == "progress":
+            self.jobs[job] = (event["current"], event["total"])
+        elif kind == "downloaded":
+            total = self.jobs.get(job, (0, 0))[1] or 1
+            self.jobs[job] = (total, total)
+        elif kind in ("done", "failed"):
+            self.jobs.pop(job, None)
+            if not self.jobs:
+                return (1.0, "Saved") if kind == "done" else (0.0, "Failed")
+        else:
+            return None
+        current = sum(c for c, _ in self.jobs.values())
+        total = sum(t for _, t in self.jobs.values())
+        fraction = current / total if total else 0.0
+        if len(self.jobs) == 1:
+            platform, manifest_id = next(iter(self.jobs))
+            return fraction, f"{platform} {manifest_id}: {fraction * 100:.1f}%"
+        return fraction, f"{len(self.jobs)} downloads: {fraction * 100:.1f}%"
+
+class LazyListBox:
+    """Keeps a Gtk.ListBox in step with listing rows without rebuilding it
+
+    Widgets are only made for the rows that are shown: the first listing.PAGE
+    that match the filter, and a page more each time the list is scrolled to
+    its end. They are kept until their row changes, so a rescan or a new
+    filter only adds, removes or replaces the rows that differ.
+    """
+
+    def __init__(self, listbox, scrolled, make_row, empty_text, headers=False):
+        self.listbox = listbox
+        self.make_row = make_row
+        self.rows = []
+        self.query = ""
+        self.limit = listing.PAGE
+        self.more = False
+        self.widgets = {}
+        self.order = {}
+        listbox.set_sort_func(self._sort)
+        if headers:
+            listbox.set_header_func(self._header)
+        placeholder = Gtk.Label(label=empty_text)
+        placeholder.show()
+        listbox.set_placeholder(placeholder)
+        scrolled.connect("edge-reached", self._on_edge_reached)
+
+    def set_rows(self, rows):
+        current = {row["key"]: row for row in rows}
+        for key, (row, widget) in list(self.widgets.items()):
+            # Gone, or changed (pinned, stored again...) and made again once it's shown
+            if current.get(key) != row:
+                if widget.get_parent():
+                    self.listbox.remove(widget)
+                del self.widgets[key]
+        self.rows = rows
+        self._update()
+
+    def set_query(self, query):
+        self.query = query
+        self.limit = listing.PAGE
+        self._update()
+
+    def _update(self):
+        matching = listing.filter_rows(self.rows, self.query)
+        shown = matching[:self.limit]
+        self.more = len(matching) > len(shown)
+        self.order = {row["key"]: i for i, row in enumerate(shown)}
+        for key, (row, widget) in self.widgets.items():
+            if key not in self.order and widget.get_parent():
+                self.listbox.remove(widget)
+        for row in shown:
+            if row["key"] not in self.widgets:
+                widget = self.make_row(row)
+                widget.key = row["key"]
+                self.widgets[row["key"]] = (row, widget)
+            widget = self.widgets[row["key"]][1]
+            if widget.get_parent() is None:
+                self.listbox.add(widget)
+                widget.show_all()
+        self.listbox.invalidate_sort()
+        self.listbox.invalidate_headers()
+
+    def _sort(self, a, b):
+        return self.order.get(a.key, 0) - self.order.get(b.key, 0)
+
+    def _title(self, widget):
+        row = self.widgets[widget.key][0]
+        return "Backups" if row["kind"] == "backups" else f"{row['platform']} Versions"
+
+    def _header(self, widget, before):
+        title = self._title(widget)
+        if before is not None and self._title(before) == title:
+            widget.set_header(None)
+            return
+        header = widget.get_header()
+        if header is None or header.get_text() != title:
+            header = Gtk.Label(label=f"<b>{title}</b>", use_markup=True, xalign=0)
+            header.show()
+            widget.set_header(header)
 
-    if depot_download_path and os.path.exists(depot_download_path):
-        callback(f"Moving files to {version_path}...")
-        try:
-            for item in os.listdir(depot_download_path):
-                shutil.move(os.path.join(depot_download_path, item), os.path.join(version_path, item))
-            callback(f"Saved version to: {version_path}")
-            try:
-                shutil.rmtree(os.path.dirname(depot_download_path))
-                callback(f"Cleaned up: {os.path.dirname(depot_download_path)}")
-            except Exception as e:
-                callback(f"Cleanup failed: {e}")
-            return True
-        except Exception as e:
-            callback(f"Failed to move files: {e}")
-            return False
-    else:
-        callback(f"Download path not found: {depot_download_path}")
-        return False
+    def _on_edge_reached(self, scrolled, position):
+        if position == Gtk.PositionType.BOTTOM and self.more:
+            self.limit += listing.PAGE
+            self._update()
 
 CONFIG_PATH = os.path.join("storage", "config.json")
 BACKUPS_DIR = "backups"
 VERSIONS_DIR = "versions"
+FULL_VERSION = "Full version"
 
-os.makedirs("storage", exist_ok=True)
-os.makedirs("versions", exist_ok=True)
-os.makedirs("versions/Linux", exist_ok=True)
-os.makedirs("versions/Mac", exist_ok=True)
-os.makedirs("versions/Windows", exist_ok=True)
-os.makedirs(BACKUPS_DIR, exist_ok=True)
 
 def load_config():
     if os.path.exists(CONFIG_PATH):
@@ -95,6 +186,7 @@ def load_config():
     return {}
 
 def save_config(config):
+    os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
     with open(CONFIG_PATH, "w") as f:
         json.dump(config, f, indent=4)
 
@@ -147,6 +239,7 @@ class WorldboxManager(Gtk.Window):
             ("view-list-symbolic", "List Versions", self.list_versions),
             ("document-revert-symbolic", "Restore Backup", self.restore_backup),
             ("go-down-symbolic", "Downgrade Version", self.downgrade_version),
+            ("emblem-ok-symbolic", "Verify Versions", self.verify_all),
             ("system-software-install-symbolic", "Download Version", self._on_download_clicked),
         ]
         
@@ -189,10 +282,17 @@ class WorldboxManager(Gtk.Window):
         self.backups_view.set_margin_start(10)
         self.backups_view.set_margin_end(10)
         
+        self.backups_search = Gtk.SearchEntry()
+        self.backups_search.set_placeholder_text("Filter backups")
+        self.backups_search.connect("search-changed", lambda entry: self.backups_rows.set_query(entry.get_text()))
+        self.backups_view.pack_start(self.backups_search, False, False, 0)
+
         self.backups_scrolled = Gtk.ScrolledWindow()
         self.backups_list = Gtk.ListBox()
         self.backups_scrolled.add(self.backups_list)
         self.backups_view.pack_start(self.backups_scrolled, True, True, 0)
+        self.backups_rows = LazyListBox(self.backups_list, self.backups_scrolled, self._create_backup_row,
+                                        "No backups available")
         
         # Versions view
         self.versions_view = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
@@ -201,10 +301,17 @@ class WorldboxManager(Gtk.Window):
         self.versions_view.set_margin_start(10)
         self.versions_view.set_margin_end(10)
         
+        self.versions_search = Gtk.SearchEntry()
+        self.versions_search.set_placeholder_text("Filter by manifest, profile or date")
+        self.versions_search.connect("search-changed", lambda entry: self.versions_rows.set_query(entry.get_text()))
+        self.versions_view.pack_start(self.versions_search, False, False, 0)
+
         self.versions_scrolled = Gtk.ScrolledWindow()
         self.versions_list = Gtk.ListBox()
         self.versions_scrolled.add(self.versions_list)
         self.versions_view.pack_start(self.versions_scrolled, True, True, 0)
+        self.versions_rows = LazyListBox(self.versions_list, self.versions_scrolled, self._make_versions_row,
+                                         "No versions or backups stored yet", headers=True)
         
         # Download version view
         self.download_view = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
@@ -240,6 +347,17 @@ class WorldboxManager(Gtk.Window):
         platform_box.pack_start(self.platform_combo, True, True, 0)
         self.download_view.pack_start(platform_box, False, False, 0)
 
+        # File profile: the whole depot or only part of it (a partial version)
+        profile_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        profile_label = Gtk.Label(label="Files:", xalign=0)
+        self.profile_combo = Gtk.ComboBoxText()
+        for profile in [FULL_VERSION, *steam.FILE_PROFILES]:
+            self.profile_combo.append_text(profile)
+        self.profile_combo.set_active(0)
+        profile_box.pack_start(profile_label, False, False, 0)
+        profile_box.pack_start(self.profile_combo, True, True, 0)
+        self.download_view.pack_start(profile_box, False, False, 0)
+
         # Manifest ID entry
         manifest_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         manifest_label = Gtk.Label(label="Manifest ID:", xalign=0)
@@ -275,6 +393,10 @@ class WorldboxManager(Gtk.Window):
         download_btn.connect("clicked", self._on_download_clicked)
         self.download_view.pack_start(download_btn, False, False, 0)
 
+        self.download_progress = Gtk.ProgressBar(show_text=True)
+        self.download_progress.set_text("")
+        self.download_view.pack_start(self.download_progress, False, False, 0)
+
         info_label = Gtk.Label(label="Enter your Steam username, password, select platform, and manifest ID to download a version.", xalign=0)
         self.download_view.pack_start(info_label, False, False, 10)
 
@@ -285,6 +407,20 @@ class WorldboxManager(Gtk.Window):
 
         content_box.pack2(self.main_content, resize=True, shrink=False)
         
+        # Progress of the backup/restore/downgrade running in the background
+        self.job_bar = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        self.job_bar.set_margin_start(10)
+        self.job_bar.set_margin_end(10)
+        self.job_progress = Gtk.ProgressBar(show_text=True)
+        self.job_cancel_btn = Gtk.Button(label="Cancel")
+        self.job_cancel_btn.connect("clicked", self._on_job_cancel_clicked)
+        self.job_bar.pack_start(self.job_progress, True, True, 0)
+        self.job_bar.pack_start(self.job_cancel_btn, False, False, 0)
+        self.job_revealer = Gtk.Revealer()
+        self.job_revealer.add(self.job_bar)
+        self.job_revealer.set_reveal_child(False)
+        main_box.pack_start(self.job_revealer, False, False, 0)
+
         # Status bar, kinda broken rn
         self.status_bar = Gtk.Statusbar()
         self.status_bar_context_id = self.status_bar.get_context_id("status")
@@ -296,6 +432,9 @@ class WorldboxManager(Gtk.Window):
         self.log_view.set_editable(False)
         self.log_view.set_cursor_visible(False)
         self.log_view.set_wrap_mode(Gtk.WrapMode.WORD_CHAR)
+        # Inserts always go to the end; the view scrolls to this one mark
+        self.log_end = self.log_buffer.create_mark("log-end", self.log_buffer.get_end_iter(), False)
+        self.log_sink = logview.LogSink("gui-linux")
         log_scrolled = Gtk.ScrolledWindow()
         log_scrolled.set_min_content_height(50)
         log_scrolled.set_max_content_height(50)
@@ -312,6 +451,17 @@ class WorldboxManager(Gtk.Window):
 
         # Initialize config
         self.config = load_config()
+        self.steam_worker = None
+        self.download_tracker = DownloadTracker()
+        self.download_state = None
+        self.download_state_queued = False
+        # Backups, restores and downgrades run one at a time on their own thread
+        self.job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-job")
+        self.job = None
+        self.job_lock = threading.Lock()
+        self.job_state_queued = False
+        # The lists are read from the catalog (and the catalog checked against the folders) in the background
+        self.scanner = listing.Scanner(lambda rows: GLib.idle_add(self._apply_listing, rows))
         self.update_status()
         self.list_versions(None)
         self.restore_backup(None)
@@ -358,12 +508,243 @@ class WorldboxManager(Gtk.Window):
         return btn
 
     def append_log(self, message: str):
-        def _append():
-            end_iter = self.log_buffer.get_end_iter()
-            self.log_buffer.insert(end_iter, message + "\n")
-            mark = self.log_buffer.create_mark(None, self.log_buffer.get_end_iter(), False)
-            self.log_view.scroll_to_mark(mark, 0.0, True, 0.0, 1.0)
-        GLib.idle_add(_append)
+        # Safe from any thread; lines arriving within a frame are drawn together
+        if self.log_sink.write(message):
+            GLib.timeout_add(logview.FRAME_MS, self._flush_log)
+
+    def _flush_log(self):
+        text, trim = self.log_sink.take()
+        if trim:
+            self.log_buffer.delete(self.log_buffer.get_start_iter(), self.log_buffer.get_iter_at_line(trim))
+        if text:
+            self.log_buffer.insert(self.log_buffer.get_end_iter(), text)
+            self.log_view.scroll_to_mark(self.log_end, 0.0, True, 0.0, 1.0)
+        return False
+
+    def _on_steam_event(self, event):
+        message = steam_event_message(event)
+        if message:
+            self.append_log(message)
+        state = self.download_tracker.update(event)
+        if state:
+            # Only the latest state is drawn, however many events arrive in between
+            self.download_state = state
+            if not self.download_state_queued:
+                self.download_state_queued = True
+                GLib.idle_add(self._apply_download_state)
+
+    def _apply_download_state(self):
+        self.download_state_queued = False
+        fraction, text = self.download_state
+        self.download_progress.set_fraction(fraction)
+        self.download_progress.set_text(text)
+        return False
+
+    def get_steam_worker(self, username, password, job=None):
+        """Reuse the logged-in SteamCMD sessions as long as the credentials stay the same
+
+        New sessions first pick up the downloads an earlier run didn't finish
+        (other than job, which the caller is about to submit).
+        """
+        password = password or None
+        worker = self.steam_worker
+        if worker and (worker.username, worker.password) == (username, password):
+            return worker
+        if worker:
+            threading.Thread(target=worker.close, daemon=True).start()
+        # The confirmation dialog already asked to approve the login in the Steam app
+        concurrency = self.config.get("download_concurrency", steam.DEFAULT_CONCURRENCY)
+        self.steam_worker = steam.SteamPool(username, password, lambda: "", self._on_steam_event, concurrency)
+        for unfinished in downloads.unfinished():
+            if unfinished[:2] != job:
+                self.append_log(f"Resuming unfinished download of manifest {unfinished[1]} ({unfinished[0]})...")
+                self.steam_worker.submit(*unfinished)
+        return self.steam_worker
+
+    def _apply_listing(self, rows):
+        self.versions_rows.set_rows(rows["backups"] + rows["versions"])
+        self.backups_rows.set_rows(rows["backups"])
+        self.update_status()
+        return False
+
+    def run_job(self, label, work, on_done, targets=()):
+        """Run work(progress, on_total, cancel) on the job thread, with the progress bar and Cancel button
+
+        progress(bytes, files=1) and on_total(bytes) can be called from any
+        thread; the bar is redrawn by at most one pending GLib.idle_add,
+        however many files finish in between. on_done(result, error) runs on
+        the UI thread, error is transfer.Cancelled after a cancel. targets
+        are the (kind, name) entries the job reads or removes. Returns False
+        if another job is still running.
+        """
+        if self.job is not None:
+            shared = set(targets) & self.job["targets"]
+            if shared:
+                message = f"Please wait, {self.job['label']} is still using {sorted(shared)[0][1]}"
+            else:
+                message = f"Please wait, {self.job['label']} is still running"
+            self.status_bar.push(self.status_bar_context_id, message)
+            return False
+        job = {"label": label, "targets": set(targets), "cancel": threading.Event(), "files": 0, "done": 0,
+               "total": 0}
+        self.job = job
+        self.job_progress.set_fraction(0.0)
+        self.job_progress.set_text(f"{label}...")
+        self.job_cancel_btn.set_sensitive(True)
+        self.job_revealer.set_reveal_child(True)
+
+        def progress(size, files=1):
+            with self.job_lock:
+                job["files"] += files
+                job["done"] += size
+            self._queue_job_state()
+
+        def on_total(total):
+            with self.job_lock:
+                job["total"] = total
+            self._queue_job_state()
+
+        def run():
+            try:
+                result, error = work(progress, on_total, job["cancel"]), None
+            except Exception as e:
+                result, error = None, e
+            GLib.idle_add(self._finish_job, on_done, result, error)
+
+        self.job_executor.submit(run)
+        return True
+
+    def _queue_job_state(self):
+        with self.job_lock:
+            if self.job_state_queued:
+                return
+            self.job_state_queued = True
+        GLib.idle_add(self._apply_job_state)
+
+    def _apply_job_state(self):
+        with self.job_lock:
+            self.job_state_queued = False
+            job = self.job
+            if job is None or job["cancel"].is_set():
+                return False
+            files, done, total = job["files"], job["done"], job["total"]
+        mb = 1024 * 1024
+        self.job_progress.set_fraction(min(done / total, 1.0) if total else 0.0)
+        counted = f"{files} files, " if files else ""
+        self.job_progress.set_text(f"{job['label']}: {counted}{done / mb:.1f} / {total / mb:.1f} MB")
+        return False
+
+    def _on_job_cancel_clicked(self, button):
+        if self.job is not None:
+            self.job["cancel"].set()
+            button.set_sensitive(False)
+            self.job_progress.set_text(f"Cancelling {self.job['label']}...")
+
+    def _finish_job(self, on_done, result, error):
+        self.job = None
+        on_done(result, error)
+        # on_done may have started the next step already
+        if self.job is None:
+            self.job_revealer.set_reveal_child(False)
+        return False
+
+    def _check_before_copy(self, kind, name, then):
+        """Verify a backup/version on the job thread, then call then() unless it's damaged and the user backs out"""
+        def work(progress, on_total, cancel):
+            # Progress comes per batch of files here, not per file
+            return verify.verify_tree(kind, name, progress=lambda size: progress(size, 0), on_total=on_total,
+                                      cancel=cancel)
+
+        def done(report, error):
+            if isinstance(error, transfer.Cancelled):
+                self.status_bar.push(self.status_bar_context_id, "Cancelled")
+                return
+            if isinstance(error, ValueError):
+                # Not in the object store, nothing to check against
+                then()
+                return
+            if error:
+                self.status_bar.push(self.status_bar_context_id, f"Could not check {name}: {error}")
+                return
+            if report["ok"]:
+                then()
+                return
+            self.append_log(f"{name} is damaged: {verify.summary(report)}")
+            dialog = Gtk.MessageDialog(
+                parent=self,
+                flags=0,
+                message_type=Gtk.MessageType.WARNING,
+                buttons=Gtk.ButtonsType.YES_NO,
+                text=f"{name} is damaged"
+            )
+            dialog.format_secondary_text(f"{verify.summary(report)}\n\nCopy it over your installation anyway?")
+            response = dialog.run()
+            dialog.destroy()
+            if response == Gtk.ResponseType.YES:
+                then()
+
+        self.run_job(f"Checking {name}", work, done, [(kind, name)])
+
+    def _sync_to_install(self, label, kind, name, source_path, installation_path, delete):
+        """Copy a backup/version over the install on the job thread; a cancel or error leaves the install as it was"""
+        def work(progress, on_total, cancel):
+            stats = transfer.sync_tree(source_path, installation_path, mode=self.config.get("link_mode", "auto"),
+                                       delete=delete, workers=self.config.get("copy_workers") or transfer.DEFAULT_WORKERS,
+                                       backend=self.config.get("copy_backend", "auto"), progress=progress,
+                                       on_total=on_total, cancel=cancel, transactional=True)
+            quota.mark_used(kind, name, installation_path)
+            return stats
+
+        def done(stats, error):
+            if isinstance(error, transfer.Cancelled):
+                self.status_bar.push(self.status_bar_context_id, f"{label} cancelled, your installation was left as it was")
+            elif error:
+                self.status_bar.push(self.status_bar_context_id,
+                                     f"{label} failed: {error}. Your installation was left as it was")
+            else:
+                self.status_bar.push(self.status_bar_context_id, f"{label} done: {stats['written']} files written, "
+                                                                 f"{stats['deleted']} removed")
+
+        self.run_job(label, work, done, [(kind, name)])
+
+    def verify_all(self, widget):
+        entries = catalog.entries("backups", order="created") + catalog.entries("versions")
+        if not entries:
+            self.status_bar.push(self.status_bar_context_id, "No backups or versions stored yet")
+            return
+
+        def work(progress, on_total, cancel):
+            damaged = []
+            # One bar for all of them: each total is added to those already checked
+            checked = 0
+            for entry in entries:
+                if cancel.is_set():
+                    raise transfer.Cancelled()
+                try:
+                    report = verify.verify_tree(entry["kind"], entry["name"], progress=lambda size: progress(size, 0),
+                                                on_total=lambda total: on_total(checked + total), cancel=cancel)
+                except ValueError:
+                    self.append_log(f"Verify {entry['name']}: not in the object store, nothing to check against")
+                    continue
+                checked += report["bytes"]
+                self.append_log(f"Verify {entry['name']}: {verify.summary(report)}")
+                if not report["ok"]:
+                    damaged.append(entry["name"])
+            return damaged
+
+        def done(damaged, error):
+            if isinstance(error, transfer.Cancelled):
+                self.status_bar.push(self.status_bar_context_id, "Verify cancelled")
+            elif error:
+                self.status_bar.push(self.status_bar_context_id, f"Verify failed: {error}")
+            elif damaged:
+                self.status_bar.push(self.status_bar_context_id, f"{len(damaged)} damaged: {', '.join(damaged)}")
+            else:
+                self.status_bar.push(self.status_bar_context_id, f"All {len(entries)} backups and versions are intact")
+
+        if self.run_job(f"Verifying {len(entries)} backups and versions", work, done,
+                        [(entry["kind"], entry["name"]) for entry in entries]):
+            self.log_revealer.set_reveal_child(True)
 
     def _on_toggle_debug_clicked(self, widget):
         visible = self.log_revealer.get_reveal_child()
@@ -373,8 +754,8 @@ class WorldboxManager(Gtk.Window):
         path = self.config.get("installation_path", "Not set")
         self.path_label.set_text(f"Installation Path: {path}")
         
-        backups = sorted(os.listdir(BACKUPS_DIR)) if os.path.exists(BACKUPS_DIR) else []
-        last_backup = backups[-1] if backups else "None"
+        backups = catalog.entries("backups", order="created")
+        last_backup = backups[-1]["name"] if backups else "None"
         self.last_backup_label.set_text(f"Last Backup: {last_backup}")
         
         self.status_bar.push(self.status_bar_context_id, f"Ready | Installation: {path}")
@@ -389,6 +770,8 @@ class WorldboxManager(Gtk.Window):
         password = self.password_entry.get_text()
         platform = self.platform_combo.get_active_text()
         manifest_id = self.manifest_entry.get_text().strip()
+        profile = self.profile_combo.get_active_text()
+        profile = None if profile == FULL_VERSION else profile
 
         if not username:
             self.status_bar.push(self.status_bar_context_id, "Error: Steam username is required")
@@ -400,9 +783,7 @@ class WorldboxManager(Gtk.Window):
             self.status_bar.push(self.status_bar_context_id, "Error: Manifest ID is required")
             return
 
-        depot_id_map = {"Windows": "1206561", "Linux": "1206562", "Mac": "1206563"}
-        depot_id = depot_id_map.get(platform)
-        if not depot_id:
+        if platform not in steam.PLATFORM_DEPOTS:
             self.status_bar.push(self.status_bar_context_id, "Error: Invalid platform selected")
             return
 
@@ -425,15 +806,14 @@ class WorldboxManager(Gtk.Window):
 
         self.status_bar.push(self.status_bar_context_id, "Starting download...")
 
-        def callback(message):
-            self.append_log(message)
+        worker = self.get_steam_worker(username, password, (platform, manifest_id))
 
         def run_steamcmd():
-            success = steamcmd_gui(username, password, manifest_id, depot_id, callback)
-            if success:
+            result = worker.submit(platform, manifest_id, profile).result()
+            if result["status"] == "done":
                 self.append_log(f"Download completed successfully for manifest {manifest_id}")
-                self.list_versions(None)
-                self.main_content.set_visible_child_name("versions")
+                # This runs on the download thread
+                GLib.idle_add(self.list_versions, None)
             else:
                 self.append_log("Download failed. See messages above.")
 
@@ -466,55 +846,45 @@ class WorldboxManager(Gtk.Window):
             return
 
         timestamp = time.strftime("%Y%m%d-%H%M%S")
-        backup_path = os.path.join(BACKUPS_DIR, f"backup-{timestamp}")
-        
-        try:
-            shutil.copytree(installation_path, backup_path)
-            self.status_bar.push(self.status_bar_context_id, f"Successfully created backup: {backup_path}")
-            self.update_status()
-            self.restore_backup(None)
-        except Exception as e:
-            self.status_bar.push(self.status_bar_context_id, f"Backup failed: {str(e)}")
+        name = f"backup-{timestamp}"
+        backup_path = os.path.join(BACKUPS_DIR, name)
+
+        def work(progress, on_total, cancel):
+            try:
+                tree = store.ingest_tree(installation_path, backup_path, "backups", name,
+                                         previous=store.latest_tree("backups", installation_path),
+                                         progress=progress, on_total=on_total, cancel=cancel)
+            except transfer.Cancelled:
+                # Drop what the cancelled backup already stored
+                store.gc()
+                raise
+            self._evict(("backups", name))
+            return tree
+
+        def done(tree, error):
+            if isinstance(error, transfer.Cancelled):
+                self.status_bar.push(self.status_bar_context_id, "Backup cancelled")
+            elif error:
+                self.status_bar.push(self.status_bar_context_id, f"Backup failed: {str(error)}")
+            else:
+                self.status_bar.push(self.status_bar_context_id, f"Successfully created backup: {backup_path}")
+                self.update_status()
+                self.restore_backup(None)
+
+        self.run_job("Backing up", work, done)
 
     def list_versions(self, widget):
-        for child in self.versions_list.get_children():
-            self.versions_list.remove(child)
-        
-        if os.path.exists(BACKUPS_DIR):
-            backups = sorted(os.listdir(BACKUPS_DIR))
-            if backups:
-                section = Gtk.ListBoxRow()
-                box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
-                label = Gtk.Label(label="<b>Backups</b>", use_markup=True, xalign=0)
-                box.pack_start(label, True, True, 0)
-                section.add(box)
-                self.versions_list.add(section)
-                
-                for backup in backups:
-                    row = self._create_version_row(backup, "document-save-symbolic")
-                    self.versions_list.add(row)
-        
-        if os.path.exists(VERSIONS_DIR):
-            platforms = sorted(os.listdir(VERSIONS_DIR))
-            for platform in platforms:
-                section = Gtk.ListBoxRow()
-                box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
-                label = Gtk.Label(label=f"<b>{platform} Versions</b>", use_markup=True, xalign=0)
-                box.pack_start(label, True, True, 0)
-                section.add(box)
-                self.versions_list.add(section)
-                
-                versions_path = os.path.join(VERSIONS_DIR, platform)
-                versions = sorted(os.listdir(versions_path)) if os.path.exists(versions_path) else []
-                
-                for version in versions:
-                    row = self._create_version_row(version, "system-software-install-symbolic", platform)
-                    self.versions_list.add(row)
-        
-        self.versions_list.show_all()
+        # Rows only change once the scan is in; until then the list shows what it had
+        self.scanner.request()
         self.main_content.set_visible_child_name("versions")
 
-    def _create_version_row(self, name, icon_name, platform=None):
+    def _make_versions_row(self, row):
+        if row["kind"] == "backups":
+            return self._create_version_row(row["name"], "document-save-symbolic", details=listing.details(row))
+        return self._create_version_row(row["label"], "system-software-install-symbolic", row["platform"],
+                                        row["profile"], row["pinned"], listing.details(row))
+
+    def _create_version_row(self, name, icon_name, platform=None, profile=None, pinned=False, details=None):
         row = Gtk.ListBoxRow()
         box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
         icon = Gtk.Image.new_from_icon_name(icon_name, Gtk.IconSize.BUTTON)
@@ -522,8 +892,19 @@ class WorldboxManager(Gtk.Window):
         
         box.pack_start(icon, False, False, 0)
         box.pack_start(lbl, True, True, 0)
+
+        if details:
+            info = Gtk.Label(label=details, xalign=1)
+            info.get_style_context().add_class("dim-label")
+            box.pack_start(info, False, False, 0)
+
+        if profile:
+            tag = Gtk.Label(label=f"partial: {profile}", xalign=1)
+            tag.get_style_context().add_class("dim-label")
+            box.pack_start(tag, False, False, 0)
         
         if platform:
+            box.pack_start(self._create_pin_button("versions", f"{platform}/{name}", pinned), False, False, 0)
             delete_btn = Gtk.Button.new_from_icon_name("edit-delete-symbolic", Gtk.IconSize.BUTTON)
             delete_btn.set_tooltip_text("Delete this version")
             delete_btn.connect("clicked", self._on_delete_version_clicked, platform, name)
@@ -532,46 +913,64 @@ class WorldboxManager(Gtk.Window):
         row.add(box)
         return row
 
-    def restore_backup(self, widget):
-        for child in self.backups_list.get_children():
-            self.backups_list.remove(child)
-        
-        backups = sorted(os.listdir(BACKUPS_DIR)) if os.path.exists(BACKUPS_DIR) else []
-        if not backups:
-            row = Gtk.ListBoxRow()
-            label = Gtk.Label(label="No backups available")
-            row.add(label)
-            self.backups_list.add(row)
-            self.backups_list.show_all()
+    def _create_pin_button(self, kind, name, pinned):
+        pin_btn = Gtk.ToggleButton()
+        pin_btn.set_image(Gtk.Image.new_from_icon_name("view-pin-symbolic", Gtk.IconSize.BUTTON))
+        pin_btn.set_tooltip_text("Pinned: never removed by the storage quota")
+        pin_btn.set_active(bool(pinned))
+        pin_btn.connect("toggled", self._on_pin_toggled, kind, name)
+        return pin_btn
+
+    def _on_pin_toggled(self, button, kind, name):
+        pinned = button.get_active()
+        if quota.set_pinned(kind, name, pinned):
+            self.status_bar.push(self.status_bar_context_id, f"{'Pinned' if pinned else 'Unpinned'} {name}")
+        elif pinned:
+            self.status_bar.push(self.status_bar_context_id, f"{name} isn't in the object store and can't be pinned")
+            button.set_active(False)
+
+    def _evict(self, keep):
+        try:
+            evicted = quota.enforce(keep=keep)
+        except Exception as e:
+            self.append_log(f"Storage quota not enforced: {e}")
             return
-        
-        for backup in backups:
-            row = Gtk.ListBoxRow()
-            box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
-            icon = Gtk.Image.new_from_icon_name("document-save-symbolic", Gtk.IconSize.BUTTON)
-            lbl = Gtk.Label(label=backup, xalign=0)
-            
-            btn_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
-            restore_btn = Gtk.Button.new_from_icon_name("document-revert-symbolic", Gtk.IconSize.BUTTON)
-            restore_btn.set_tooltip_text("Restore this backup")
-            restore_btn.connect("clicked", self._on_restore_backup_clicked, backup)
-            
-            delete_btn = Gtk.Button.new_from_icon_name("edit-delete-symbolic", Gtk.IconSize.BUTTON)
-            delete_btn.set_tooltip_text("Delete this backup")
-            delete_btn.connect("clicked", self._on_delete_backup_clicked, backup)
-            
-            btn_box.pack_start(restore_btn, False, False, 0)
-            btn_box.pack_start(delete_btn, False, False, 0)
-            
-            box.pack_start(icon, False, False, 0)
-            box.pack_start(lbl, True, True, 0)
-            box.pack_start(btn_box, False, False, 0)
-            row.add(box)
-            self.backups_list.add(row)
-        
-        self.backups_list.show_all()
+        if evicted:
+            self.append_log(f"Storage quota: removed {', '.join(entry['name'] for entry in evicted)}.")
+
+    def restore_backup(self, widget):
+        self.scanner.request()
         self.main_content.set_visible_child_name("backups")
 
+    def _create_backup_row(self, entry):
+        backup = entry["name"]
+        row = Gtk.ListBoxRow()
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
+        icon = Gtk.Image.new_from_icon_name("document-save-symbolic", Gtk.IconSize.BUTTON)
+        lbl = Gtk.Label(label=backup, xalign=0)
+        info = Gtk.Label(label=listing.details(entry), xalign=1)
+        info.get_style_context().add_class("dim-label")
+
+        btn_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
+        restore_btn = Gtk.Button.new_from_icon_name("document-revert-symbolic", Gtk.IconSize.BUTTON)
+        restore_btn.set_tooltip_text("Restore this backup")
+        restore_btn.connect("clicked", self._on_restore_backup_clicked, backup)
+
+        delete_btn = Gtk.Button.new_from_icon_name("edit-delete-symbolic", Gtk.IconSize.BUTTON)
+        delete_btn.set_tooltip_text("Delete this backup")
+        delete_btn.connect("clicked", self._on_delete_backup_clicked, backup)
+
+        btn_box.pack_start(restore_btn, False, False, 0)
+        btn_box.pack_start(self._create_pin_button("backups", backup, entry["pinned"]), False, False, 0)
+        btn_box.pack_start(delete_btn, False, False, 0)
+
+        box.pack_start(icon, False, False, 0)
+        box.pack_start(lbl, True, True, 0)
+        box.pack_start(info, False, False, 0)
+        box.pack_start(btn_box, False, False, 0)
+        row.add(box)
+        return row
+
     def _on_restore_backup_clicked(self, button, backup_name):
         installation_path = self.config.get("installation_path")
         if not installation_path:
@@ -592,32 +991,11 @@ class WorldboxManager(Gtk.Window):
         
         if response == Gtk.ResponseType.YES:
             source_path = os.path.join(BACKUPS_DIR, backup_name)
-            try:
-                for item in os.listdir(installation_path):
-                    item_path = os.path.join(installation_path, item)
-                    if os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
-                    else:
-                        os.remove(item_path)
-                
-                for item in os.listdir(source_path):
-                    s = os.path.join(source_path, item)
-                    d = os.path.join(installation_path, item)
-                    if os.path.isdir(s):
-                        shutil.copytree(s, d)
-                    else:
-                        shutil.copy2(s, d)
-                
-                self.status_bar.push(self.status_bar_context_id, f"Successfully restored backup: {backup_name}")
-            except Exception as e:
-                self.status_bar.push(self.status_bar_context_id, f"Failed to restore backup: {str(e)}")
+            self._check_before_copy("backups", backup_name, lambda: self._sync_to_install(
+                f"Restoring {backup_name}", "backups", backup_name, source_path, installation_path, delete=True))
 
     def downgrade_version(self, widget):
-        if not os.path.exists(VERSIONS_DIR):
-            self.status_bar.push(self.status_bar_context_id, "Error: Versions directory not found")
-            return
-
-        platforms = sorted(os.listdir(VERSIONS_DIR))
+        platforms = catalog.platforms()
         if not platforms:
             self.status_bar.push(self.status_bar_context_id, "Error: No platforms available")
             return
@@ -683,31 +1061,17 @@ class WorldboxManager(Gtk.Window):
                 else:
                     version = None
                 
-                if version:
+                installation_path = self.config.get("installation_path")
+                if version and not installation_path:
+                    self.status_bar.push(self.status_bar_context_id, "Failed to downgrade: Installation path not set")
+                elif version:
                     source_path = os.path.join(VERSIONS_DIR, platform, version)
-                    try:
-                        installation_path = self.config.get("installation_path")
-                        if not installation_path:
-                            raise ValueError("Installation path not set")
-                        
-                        for item in os.listdir(installation_path):
-                            item_path = os.path.join(installation_path, item)
-                            if os.path.isdir(item_path):
-                                shutil.rmtree(item_path)
-                            else:
-                                os.remove(item_path)
-                        
-                        for item in os.listdir(source_path):
-                            s = os.path.join(source_path, item)
-                            d = os.path.join(installation_path, item)
-                            if os.path.isdir(s):
-                                shutil.copytree(s, d)
-                            else:
-                                shutil.copy2(s, d)
-                        
-                        self.status_bar.push(self.status_bar_context_id, f"Successfully downgraded to version {version} for {platform}")
-                    except Exception as e:
-                        self.status_bar.push(self.status_bar_context_id, f"Failed to downgrade: {str(e)}")
+                    # A partial version is laid over the install instead of replacing it
+                    partial = steam.version_profile(platform, version) is not None
+                    name = f"{platform}/{version}"
+                    self._check_before_copy("versions", name, lambda: self._sync_to_install(
+                        f"Downgrading to {version} ({platform})", "versions", name, source_path, installation_path,
+                        delete=not partial))
         
         dialog.destroy()
 
@@ -719,12 +1083,8 @@ class WorldboxManager(Gtk.Window):
         if not platform:
             return
         
-        versions_path = os.path.join(VERSIONS_DIR, platform)
-        if not os.path.exists(versions_path):
-            return
-        
-        versions = sorted(os.listdir(versions_path), reverse=True)
-        for version in versions:
+        for entry in catalog.entries("versions", platform, order="-date"):
+            version = entry["manifest_id"]
             row = Gtk.ListBoxRow()
             box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
             icon = Gtk.Image.new_from_icon_name("system-software-install-symbolic", Gtk.IconSize.BUTTON)
@@ -732,6 +1092,8 @@ class WorldboxManager(Gtk.Window):
             
             box.pack_start(icon, False, False, 0)
             box.pack_start(label, True, True, 0)
+            if entry["profile"]:
+                box.pack_start(Gtk.Label(label=f"partial: {entry['profile']}"), False, False, 0)
             row.add(box)
             self.version_list_dlg.add(row)
         
@@ -749,17 +1111,21 @@ class WorldboxManager(Gtk.Window):
         response = dialog.run()
         dialog.destroy()
 
-        if response == Gtk.ResponseType.YES:
-            backup_path = os.path.join(BACKUPS_DIR, backup_name)
-            try:
-                if os.path.isdir(backup_path):
-                    shutil.rmtree(backup_path)
-                else:
-                    os.remove(backup_path)
+        if response != Gtk.ResponseType.YES:
+            return
+        backup_path = os.path.join(BACKUPS_DIR, backup_name)
+
+        def work(progress, on_total, cancel):
+            store.remove_tree("backups", backup_name, backup_path, progress=progress, on_total=on_total)
+
+        def done(result, error):
+            if error:
+                self.status_bar.push(self.status_bar_context_id, f"Failed to delete backup: {str(error)}")
+            else:
                 self.status_bar.push(self.status_bar_context_id, f"Deleted backup: {backup_name}")
-                self.restore_backup(None)
-            except Exception as e:
-                self.status_bar.push(self.status_bar_context_id, f"Failed to delete backup: {str(e)}")
+            self.restore_backup(None)
+
+        self.run_job(f"Deleting {backup_name}", work, done, [("backups", backup_name)])
 
     def _on_delete_version_clicked(self, button, platform, version):
         dialog = Gtk.MessageDialog(
@@ -773,23 +1139,41 @@ class WorldboxManager(Gtk.Window):
         response = dialog.run()
         dialog.destroy()
 
-        if response == Gtk.ResponseType.YES:
-            version_path = os.path.join(VERSIONS_DIR, platform, version)
-            try:
-                if os.path.isdir(version_path):
-                    shutil.rmtree(version_path)
-                else:
-                    os.remove(version_path)
+        if response != Gtk.ResponseType.YES:
+            return
+        name = f"{platform}/{version}"
+        version_path = os.path.join(VERSIONS_DIR, platform, version)
+
+        def work(progress, on_total, cancel):
+            store.remove_tree("versions", name, version_path, progress=progress, on_total=on_total)
+
+        def done(result, error):
+            if error:
+                self.status_bar.push(self.status_bar_context_id, f"Failed to delete version: {str(error)}")
+            else:
                 self.status_bar.push(self.status_bar_context_id, f"Deleted version: {version} for platform {platform}")
-                self.list_versions(None)
-            except Exception as e:
-                self.status_bar.push(self.status_bar_context_id, f"Failed to delete version: {str(e)}")
+            self.list_versions(None)
+
+        self.run_job(f"Deleting {version} ({platform})", work, done, [("versions", name)])
 
 def main():
     win = WorldboxManager()
-    win.connect("destroy", Gtk.main_quit)
+
+    def on_destroy(window):
+        if window.steam_worker:
+            window.steam_worker.cancel()
+        # A restore that is cut short puts the install back before the process exits
+        if window.job:
+            window.job["cancel"].set()
+        Gtk.main_quit()
+
+    win.connect("destroy", on_destroy)
     win.show_all()
     Gtk.main()
+    win.job_executor.shutdown(wait=True)
 
 if __name__ == "__main__":
+    # Verification hashes in worker processes, which a frozen build has to hand off here
+    from multiprocessing import freeze_support
+    freeze_support()
     main()
\ No newline at end of file
@@ -1,10 +1,19 @@
 import os
-import shutil
 import time
 import json
+import difflib
+import queue
 import threading
-import subprocess
-import re
+from concurrent.futures import ThreadPoolExecutor
+import store
+import steam
+import catalog
+import verify
+import quota
+import downloads
+import transfer
+import logview
+import listing
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, scrolledtext
 from PIL import Image, ImageTk # type: ignore
@@ -19,81 +28,160 @@ TEXT_COLOR = "#333333"
 LIGHT_TEXT = "#000000"
 DARK_BG = "#000000"  
 
-def steamcmd_gui(username, password, manifest_id, depot_id, callback):
-    APP_ID = "1206560"
-    VERSIONS_DIR = "versions"
-    DEBUG_FOLDER = "steamdb_debug"
-    os.makedirs(DEBUG_FOLDER, exist_ok=True)
-    platform_folder = {"1206561": "Windows", "1206562": "Linux", "1206563": "Mac"}.get(depot_id, "Unknown")
-    version_path = os.path.join(VERSIONS_DIR, platform_folder, manifest_id)
-    os.makedirs(version_path, exist_ok=True)
-
-    command = ["steamcmd", "+login", username]
-    if password:
-        command.append(password)
-    command.extend([
-        "+download_depot", APP_ID, depot_id, manifest_id,
-        "+quit"
-    ])
-
-    callback(f"Running SteamCMD for manifest {manifest_id} (depot {depot_id})...")
-
-    depot_download_path = None
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
-                             stdin=subprocess.PIPE, text=True, bufsize=1, universal_newlines=True)
-
-    while True:
-        if process.stdout is None:
-            break
-        output = process.stdout.readline()
-        if output == '' and process.poll() is not None:
-            break
-        if output:
-            line = output.strip()
-            if "Steam Guard code" in line or "Steam Guard" in line:
-                callback("Steam Guard code required. Please enter it in the terminal.")
-            elif "Depot download complete" in line:
-                match = re.search(r'Depot download complete : "([^"]+)"', line)
-                if match:
-                    depot_download_path = re.sub(r'\\', '/', match.group(1))
-                    callback(f"Download path: {depot_download_path}")
-            else:
-                callback(line)
+def steam_event_message(event):
+    """Log line for a SteamWorker event, or None for events that aren't worth showing"""
+    kind = event["type"]
+    if kind == "line":
+        return event["line"]
+    if kind == "guard":
+        return "Steam Guard code required. Please approve the login on your Steam Guard app."
+    if kind == "login":
+        return "Logged in to Steam."
+    if kind == "started":
+        platform, manifest_id = event["job"]
+        return f"Running SteamCMD for manifest {manifest_id} ({platform})..."
+    if kind == "downloaded":
+        return "Download complete, storing files..."
+    if kind == "done":
+        mb = 1024 * 1024
+        rate = event["downloaded_bytes"] / max(event["seconds"], 0.001) / mb
+        return (f"Saved version to: {event['path']} ({event['bytes'] / mb:.1f} MB, {event['downloaded_bytes'] / mb:.1f} MB "
+                f"downloaded in {event['seconds']:.0f}s, {rate:.1f} MB/s)")
+    if kind == "resumed":
+        platform, manifest_id = event["job"]
+        return f"Resuming manifest {manifest_id} ({platform}) from the files already downloaded."
+    if kind == "seeded":
+        return f"Starting from stored version {event['seed']} ({event['files']} files), only changed files will be downloaded."
+    if kind == "unseeded":
+        return (f"SteamCMD left no depot manifest, validating the download without the stored version's files "
+                f"({event['files']} removed)...")
+    if kind == "retry":
+        return f"SteamCMD {event['kind']} error: {event['error']}. Retrying in {event['delay']}s (attempt {event['attempt']})..."
+    if kind == "failed":
+        return f"SteamCMD failed: {event['error']}"
+    if kind == "evicted":
+        return f"Storage quota: removed {', '.join(event['names'])}."
+    if kind == "idle":
+        return "SteamCMD session was idle, logged out."
+    if kind == "reconnect":
+        return "Reconnecting to Steam..."
+    return None
 
-    return_code = process.poll()
-    if return_code != 0:
-        callback("SteamCMD failed.")
-        return False
+class DownloadTracker:
+    """Combined progress of every running download, for the one progress bar"""
 
-    if depot_download_path and os.path.exists(depot_download_path):
-        callback(f"Moving files to {version_path}...")
-        try:
-            for item in os.listdir(depot_download_path):
-                shutil.move(os.path.join(depot_download_path, item), os.path.join(version_path, item))
-            callback(f"Saved version to: {version_path}")
+    def __init__(self):
+        self.jobs = {}
+
+    def update(self, event):
+        """(fraction, text) after a SteamWorker event, or None if the event doesn't move the bar"""
+        kind = event["type"]
+        job = event.get("job")
+        if kind == "started":
+            self.jobs[job] = (0, 0)
+        elif kind == "progress":
+            self.jobs[job] = (event["current"], event["total"])
+        elif kind == "downloaded":
+            total = self.jobs.get(job, (0, 0))[1] or 1
+            self.jobs[job] = (total, total)
+        elif kind in ("done", "failed"):
+            self.jobs.pop(job, None)
+            if not self.jobs:
+                return (1.0, "Saved") if kind == "done" else (0.0, "Failed")
+        else:
+            return None
+        current = sum(c for c, _ in self.jobs.values())
+        total = sum(t for _, t in self.jobs.values())
+        fraction = current / total if total else 0.0
+        if len(self.jobs) == 1:
+            platform, manifest_id = next(iter(self.jobs))
+            return fraction, f"{platform} {manifest_id}: {fraction * 100:.1f}%"
+        return fraction, f"{len(self.jobs)} downloads: {fraction * 100:.1f}%"
+
+class FileJob:
+    """A backup, restore, downgrade or delete waiting for or running on the job thread
+
+    work(job) runs on the job thread and on_done(result, error) on the Tk
+    thread, error being transfer.Cancelled after a cancel. The methods below
+    are called from the job thread and the copy workers under it; they never
+    touch Tk but put events on the queue the window polls. targets are the
+    (kind, name) entries the job reads or removes.
+    """
+
+    def __init__(self, label, targets, work, on_done, events, deletes=False):
+        self.label = label
+        self.targets = set(targets)
+        self.work = work
+        self.on_done = on_done
+        self.events = events
+        self.deletes = deletes
+        self.cancel = threading.Event()
+        self.started = False
+        self.lock = threading.Lock()
+        self.step_label = label
+        self.files = self.done = self.total = 0
+
+    def conflicts(self, other):
+        """True if one of the jobs removes an entry the other one uses"""
+        return (self.deletes or other.deletes) and bool(self.targets & other.targets)
+
+    def step(self, label):
+        with self.lock:
+            self.step_label = label
+            self.files = self.done = self.total = 0
+        self.events.put(("progress", self))
+
+    def progress(self, size, files=1):
+        with self.lock:
+            self.files += files
+            self.done += size
+        self.events.put(("progress", self))
+
+    def on_total(self, total):
+        with self.lock:
+            self.total = total
+        self.events.put(("progress", self))
+
+    def state(self):
+        """(fraction, text) for the progress bar"""
+        with self.lock:
+            label, files, done, total = self.step_label, self.files, self.done, self.total
+        if not self.started:
+            return 0.0, f"{label}: waiting"
+        mb = 1024 * 1024
+        counted = f"{files} files, " if files else ""
+        return (min(done / total, 1.0) if total else 0.0), f"{label}: {counted}{done / mb:.1f} / {total / mb:.1f} MB"
+
+    def ask(self, title, message):
+        """Ask a yes/no question on the Tk thread and wait for the answer"""
+        answer = []
+        reply = threading.Event()
+        self.events.put(("ask", self, title, message, answer, reply))
+        while not reply.wait(0.1):
+            # The window may be closing and never answer
+            if self.cancel.is_set():
+                raise transfer.Cancelled()
+        return answer[0]
+
+    def run(self):
+        if self.cancel.is_set():
+            result, error = None, transfer.Cancelled()
+        else:
+            self.started = True
+            self.events.put(("progress", self))
             try:
-                shutil.rmtree(os.path.dirname(depot_download_path))
-                callback(f"Cleaned up: {os.path.dirname(depot_download_path)}")
+                result, error = self.work(self), None
             except Exception as e:
-                callback(f"Cleanup failed: {e}")
-            return True
-        except Exception as e:
-            callback(f"Failed to move files: {e}")
-            return False
-    else:
-        callback(f"Download path not found: {depot_download_path}")
-        return False
+                result, error = None, e
+        self.events.put(("done", self, result, error))
 
 CONFIG_PATH = os.path.join("storage", "config.json")
 BACKUPS_DIR = "backups"
 VERSIONS_DIR = "versions"
+# Shown after pinned entries in the lists
+PIN_MARK = "  (pinned)"
+FULL_VERSION = "Full version"
 
-os.makedirs("storage", exist_ok=True)
-os.makedirs("versions", exist_ok=True)
-os.makedirs("versions/Linux", exist_ok=True)
-os.makedirs("versions/Mac", exist_ok=True)
-os.makedirs("versions/Windows", exist_ok=True)
-os.makedirs(BACKUPS_DIR, exist_ok=True)
 
 def load_config():
     if os.path.exists(CONFIG_PATH):
@@ -102,6 +190,7 @@ def load_config():
     return {}
 
 def save_config(config):
+    os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
     with open(CONFIG_PATH, "w") as f:
         json.dump(config, f, indent=4)
 
@@ -130,6 +219,21 @@ class WorldboxManager:
         
         # Load config
         self.config = load_config()
+        self.steam_worker = None
+        self.download_tracker = DownloadTracker()
+        self.download_state = None
+        self.shown_download_state = None
+        # Backups, restores, downgrades and deletes run one after the other on their own thread
+        self.job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-job")
+        self.job_events = queue.SimpleQueue()
+        self.jobs = []
+        # Lists are read from the catalog in the background; the latest scan waits here for poll_listing()
+        self.scanner = listing.Scanner(self._on_listing)
+        self.scanned_rows = None
+        self.listed_rows = None
+        self.backup_rows = []
+        self.version_rows = []
+        self.filter_after = None
         
         # Configure styles
         self.configure_styles()
@@ -158,6 +262,15 @@ class WorldboxManager:
         
         self.main_content_frame = ttk.Frame(self.content_frame, style='Content.TFrame')
         self.main_content_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=(10, 0))
+
+        # Progress of the running job, only shown while there is one
+        self.job_frame = ttk.Frame(self.main_frame)
+        self.job_label = ttk.Label(self.job_frame, text="")
+        self.job_label.pack(anchor=tk.W, padx=5)
+        self.job_progress = ttk.Progressbar(self.job_frame, mode="determinate", maximum=1.0)
+        self.job_progress.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.job_cancel_btn = ModernButton(self.job_frame, text="Cancel", command=self.cancel_job)
+        self.job_cancel_btn.pack(side=tk.RIGHT, padx=5)
         
         # Create views
         self.create_sidebar()
@@ -173,6 +286,10 @@ class WorldboxManager:
         self.list_backups()
         
         self.show_home()
+        self.poll_listing()
+        self.poll_download_state()
+        self.poll_log()
+        self.poll_jobs()
     
     def configure_styles(self):
         """Configure custom styles for the application"""
@@ -250,6 +367,7 @@ class WorldboxManager:
             ("📋 Versions", self.list_versions),
             ("🔄 Restore", self.list_backups),
             ("⏪ Downgrade", self.downgrade_version),
+            ("🔍 Verify", self.verify_all),
             ("⬇️ Download", self.show_download_view),
         ]
         
@@ -310,6 +428,10 @@ class WorldboxManager:
         
         # Title
         ttk.Label(self.backups_frame, text="Backups", style='SectionTitle.TLabel').pack(anchor=tk.W, pady=5)
+
+        self.backups_filter = tk.StringVar()
+        self.backups_filter.trace("w", self.queue_filter)
+        ModernEntry(self.backups_frame, textvariable=self.backups_filter).pack(fill=tk.X, pady=(0, 5))
         
         # List with scrollbar
         list_frame = ttk.Frame(self.backups_frame)
@@ -332,10 +454,15 @@ class WorldboxManager:
         )
         self.backups_list.pack(fill=tk.BOTH, expand=True)
         self.backups_scroll.config(command=self.backups_list.yview)
+        self.backups_list.bind("<<ListboxSelect>>", lambda event: self.show_details(self.backup_details,
+                                                                                   self.selected_backup()))
+        self.backup_details = ttk.Label(self.backups_frame, text="")
+        self.backup_details.pack(anchor=tk.W, pady=3)
         
         # Context menu
         self.backup_menu = tk.Menu(self.root, tearoff=0, bg='white', fg=TEXT_COLOR)
         self.backup_menu.add_command(label="Restore", command=self.restore_selected_backup)
+        self.backup_menu.add_command(label="Pin / Unpin", command=self.toggle_pin_selected_backup)
         self.backup_menu.add_command(label="Delete", command=self.delete_selected_backup)
         self.backups_list.bind("<Button-3>", self.show_backup_menu)
     
@@ -344,6 +471,10 @@ class WorldboxManager:
         
         # Title
         ttk.Label(self.versions_frame, text="Available Versions", style='SectionTitle.TLabel').pack(anchor=tk.W, pady=5)
+
+        self.versions_filter = tk.StringVar()
+        self.versions_filter.trace("w", self.queue_filter)
+        ModernEntry(self.versions_frame, textvariable=self.versions_filter).pack(fill=tk.X, pady=(0, 5))
         
         # List with scrollbar
         list_frame = ttk.Frame(self.versions_frame)
@@ -366,10 +497,15 @@ class WorldboxManager:
         )
         self.versions_list.pack(fill=tk.BOTH, expand=True)
         self.versions_scroll.config(command=self.versions_list.yview)
+        self.versions_list.bind("<<ListboxSelect>>", lambda event: self.show_details(self.version_details,
+                                                                                    self.selected_version()))
+        self.version_details = ttk.Label(self.versions_frame, text="")
+        self.version_details.pack(anchor=tk.W, pady=3)
         
         # Context menu
         self.version_menu = tk.Menu(self.root, tearoff=0, bg='white', fg=TEXT_COLOR)
         self.version_menu.add_command(label="Downgrade", command=self.downgrade_selected_version)
+        self.version_menu.add_command(label="Pin / Unpin", command=self.toggle_pin_selected_version)
         self.version_menu.add_command(label="Delete", command=self.delete_selected_version)
         self.versions_list.bind("<Button-3>", self.show_version_menu)
     
@@ -403,6 +539,12 @@ class WorldboxManager:
         ttk.Label(form_frame, text="Manifest ID:").grid(row=3, column=0, sticky=tk.W, padx=5, pady=3)
         self.manifest_entry = ModernEntry(form_frame)
         self.manifest_entry.grid(row=3, column=1, sticky=tk.EW, padx=5, pady=3)
+
+        # File profile: the whole depot or only part of it (a partial version)
+        ttk.Label(form_frame, text="Files:").grid(row=4, column=0, sticky=tk.W, padx=5, pady=3)
+        self.profile_combo = ModernCombobox(form_frame, values=[FULL_VERSION, *steam.FILE_PROFILES], state="readonly")
+        self.profile_combo.grid(row=4, column=1, sticky=tk.EW, padx=5, pady=3)
+        self.profile_combo.current(0)
         
         # Tutorial
         tutorial_frame = ttk.Frame(self.download_frame, style='Card.TFrame')
@@ -440,6 +582,12 @@ class WorldboxManager:
             text="Download Version",
             command=self.download_version
         ).pack(pady=10)
+
+        # Download progress
+        self.download_progress = ttk.Progressbar(self.download_frame, mode="determinate", maximum=1.0)
+        self.download_progress.pack(fill=tk.X, padx=5)
+        self.download_status = ttk.Label(self.download_frame, text="")
+        self.download_status.pack(anchor=tk.W, padx=5, pady=3)
         
         # Configure grid weights
         form_frame.grid_columnconfigure(1, weight=1)
@@ -476,6 +624,7 @@ class WorldboxManager:
             borderwidth=0
         )
         self.log_text.pack(fill=tk.BOTH, expand=True)
+        self.log_sink = logview.LogSink("gui-win64")
         
         # Start with log hidden
         self.log_visible = False
@@ -489,17 +638,26 @@ class WorldboxManager:
             self.log_frame.pack_forget()
     
     def append_log(self, message):
-        self.log_text.config(state='normal')
-        self.log_text.insert(tk.END, message + "\n")
-        self.log_text.see(tk.END)
-        self.log_text.config(state='disabled')
+        # Safe from any thread; poll_log() draws what arrived since the last frame
+        self.log_sink.write(message)
+
+    def poll_log(self):
+        text, trim = self.log_sink.take()
+        if text:
+            self.log_text.config(state='normal')
+            if trim:
+                self.log_text.delete("1.0", f"{trim + 1}.0")
+            self.log_text.insert(tk.END, text)
+            self.log_text.see(tk.END)
+            self.log_text.config(state='disabled')
+        self.root.after(logview.FRAME_MS, self.poll_log)
     
     def update_status(self):
         path = self.config.get("installation_path", "Not set")
         self.path_label.config(text=path)
         
-        backups = sorted(os.listdir(BACKUPS_DIR)) if os.path.exists(BACKUPS_DIR) else []
-        last_backup = backups[-1] if backups else "None"
+        backups = catalog.entries("backups", order="created")
+        last_backup = backups[-1]["name"] if backups else "None"
         self.last_backup_label.config(text=last_backup)
     
     def show_home(self):
@@ -541,40 +699,114 @@ class WorldboxManager:
             return
 
         timestamp = time.strftime("%Y%m%d-%H%M%S")
-        backup_path = os.path.join(BACKUPS_DIR, f"backup-{timestamp}")
-        
-        try:
-            shutil.copytree(installation_path, backup_path)
-            messagebox.showinfo("Success", f"Successfully created backup: {backup_path}")
-            self.update_status()
-            self.list_backups()
-        except Exception as e:
-            messagebox.showerror("Error", f"Backup failed: {str(e)}")
+        name = f"backup-{timestamp}"
+        backup_path = os.path.join(BACKUPS_DIR, name)
+
+        def work(job):
+            try:
+                store.ingest_tree(installation_path, backup_path, "backups", name,
+                                  previous=store.latest_tree("backups", installation_path),
+                                  progress=job.progress, on_total=job.on_total, cancel=job.cancel)
+            except transfer.Cancelled:
+                # Drop what the cancelled backup already stored
+                store.gc()
+                raise
+            self.evict(("backups", name))
+
+        def done(result, error):
+            if isinstance(error, transfer.Cancelled):
+                messagebox.showinfo("Cancelled", "Backup cancelled")
+            elif error:
+                messagebox.showerror("Error", f"Backup failed: {str(error)}")
+            else:
+                self.update_status()
+                self.list_backups()
+                messagebox.showinfo("Success", f"Successfully created backup: {backup_path}")
+
+        self.queue_job("Backup", [("backups", name)], work, done)
     
-    def list_backups(self):
-        self.backups_list.delete(0, tk.END)
-        
-        if os.path.exists(BACKUPS_DIR):
-            backups = sorted(os.listdir(BACKUPS_DIR))
-            if backups:
-                for backup in backups:
-                    self.backups_list.insert(tk.END, backup)
-        
-        self.show_backups_view()
+    def list_backups(self, show=True):
+        # The list changes once the scan is in; until then it shows what it had
+        self.scanner.request()
+        if show:
+            self.show_backups_view()
     
-    def list_versions(self):
-        self.versions_list.delete(0, tk.END)
-        
-        if os.path.exists(VERSIONS_DIR):
-            platforms = sorted(os.listdir(VERSIONS_DIR))
-            for platform in platforms:
-                self.versions_list.insert(tk.END, f"--- {platform} ---")
-                versions_path = os.path.join(VERSIONS_DIR, platform)
-                versions = sorted(os.listdir(versions_path)) if os.path.exists(versions_path) else []
-                for version in versions:
-                    self.versions_list.insert(tk.END, f"  {version}")
-        
-        self.show_versions_view()
+    def list_versions(self, show=True):
+        self.scanner.request()
+        if show:
+            self.show_versions_view()
+
+    def _on_listing(self, rows):
+        # Runs on the scan thread; Tk may only be touched from its own, so poll_listing() picks it up
+        self.scanned_rows = rows
+
+    def poll_listing(self):
+        rows = self.scanned_rows
+        if rows is not self.listed_rows:
+            self.listed_rows = rows
+            self.show_rows()
+            self.update_status()
+        self.root.after(200, self.poll_listing)
+
+    def queue_filter(self, *args):
+        # Filter once typing pauses, not on every key
+        if self.filter_after:
+            self.root.after_cancel(self.filter_after)
+        self.filter_after = self.root.after(150, self.show_rows)
+
+    def show_rows(self):
+        self.filter_after = None
+        if self.listed_rows is None:
+            return
+        backups = listing.filter_rows(self.listed_rows["backups"], self.backups_filter.get())
+        self.backup_rows = self.update_listbox(self.backups_list, self.backup_rows, backups,
+                                               lambda row: row["name"] + (PIN_MARK if row["pinned"] else ""))
+
+        versions = []
+        platform = None
+        for row in listing.filter_rows(self.listed_rows["versions"], self.versions_filter.get()):
+            if row["platform"] != platform:
+                platform = row["platform"]
+                versions.append({"heading": platform})
+            versions.append(row)
+
+        def version_line(row):
+            if "heading" in row:
+                return f"--- {row['heading']} ---"
+            return (f"  {row['label']}" + (f"  (partial: {row['profile']})" if row["profile"] else "")
+                    + (PIN_MARK if row["pinned"] else ""))
+
+        self.version_rows = self.update_listbox(self.versions_list, self.version_rows, versions, version_line)
+        self.show_details(self.backup_details, self.selected_backup())
+        self.show_details(self.version_details, self.selected_version())
+
+    def update_listbox(self, listbox, old_rows, new_rows, line):
+        """Turn listbox from old_rows into new_rows, only inserting and deleting the lines that differ"""
+        old_lines = [line(row) for row in old_rows]
+        new_lines = [line(row) for row in new_rows]
+        opcodes = difflib.SequenceMatcher(None, old_lines, new_lines).get_opcodes()
+        # From the end, so the indexes of the edits still to make stay valid
+        for tag, i1, i2, j1, j2 in reversed(opcodes):
+            if tag in ("replace", "delete"):
+                listbox.delete(i1, i2 - 1)
+            if tag in ("replace", "insert"):
+                listbox.insert(i1, *new_lines[j1:j2])
+        return new_rows
+
+    def selected_backup(self):
+        selection = self.backups_list.curselection()
+        return self.backup_rows[selection[0]] if selection and selection[0] < len(self.backup_rows) else None
+
+    def selected_version(self):
+        selection = self.versions_list.curselection()
+        if not selection or selection[0] >= len(self.version_rows):
+            return None
+        row = self.version_rows[selection[0]]
+        return None if "heading" in row else row
+
+    def show_details(self, label, row):
+        # Size and dates are only formatted for the row that is selected
+        label.config(text=listing.details(row) if row else "")
     
     def show_backup_menu(self, event):
         try:
@@ -586,19 +818,15 @@ class WorldboxManager:
     
     def show_version_menu(self, event):
         try:
-            selection = self.versions_list.curselection()
-            if selection and not self.versions_list.get(selection).startswith("---"):
+            if self.selected_version():
                 self.version_menu.tk_popup(event.x_root, event.y_root)
         except:
             pass
     
     def restore_selected_backup(self):
-        selection = self.backups_list.curselection()
-        if not selection:
-            return
-        
-        backup_name = self.backups_list.get(selection)
-        self.restore_backup(backup_name)
+        row = self.selected_backup()
+        if row:
+            self.restore_backup(row["name"])
     
     def restore_backup(self, backup_name):
         installation_path = self.config.get("installation_path")
@@ -613,35 +841,184 @@ class WorldboxManager:
             return
 
         source_path = os.path.join(BACKUPS_DIR, backup_name)
+
+        def work(job):
+            if not self.check_before_copy(job, "backups", backup_name):
+                return None
+            job.step(f"Restoring {backup_name}")
+            stats = self.sync_to_install(job, source_path, installation_path, delete=True)
+            quota.mark_used("backups", backup_name, installation_path)
+            return stats
+
+        def done(stats, error):
+            if isinstance(error, transfer.Cancelled):
+                messagebox.showinfo("Cancelled", f"Restore of {backup_name} cancelled, your installation was left as it was")
+            elif error:
+                messagebox.showerror("Error", f"Failed to restore backup: {str(error)}\n"
+                                              "Your installation was left as it was.")
+            elif stats:
+                messagebox.showinfo("Success", f"Successfully restored backup: {backup_name}")
+
+        self.queue_job(f"Restore {backup_name}", [("backups", backup_name)], work, done)
+    
+    def check_before_copy(self, job, kind, name):
+        """Verify a backup/version on the job thread before it overwrites the install; False if the user backs out"""
+        job.step(f"Checking {name}")
         try:
-            # Clear destination
-            for item in os.listdir(installation_path):
-                item_path = os.path.join(installation_path, item)
-                if os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
-                else:
-                    os.remove(item_path)
-            
-            # Copy from backup
-            for item in os.listdir(source_path):
-                s = os.path.join(source_path, item)
-                d = os.path.join(installation_path, item)
-                if os.path.isdir(s):
-                    shutil.copytree(s, d)
-                else:
-                    shutil.copy2(s, d)
-            
-            messagebox.showinfo("Success", f"Successfully restored backup: {backup_name}")
+            # Progress comes per batch of files here, not per file
+            report = verify.verify_tree(kind, name, progress=lambda size: job.progress(size, 0),
+                                        on_total=job.on_total, cancel=job.cancel)
+        except ValueError:
+            return True
+        if report["ok"]:
+            return True
+        self.append_log(f"{name} is damaged: {verify.summary(report)}")
+        return job.ask(
+            "Damaged",
+            f"{name} is damaged: {verify.summary(report)}\n\nCopy it over your installation anyway?"
+        )
+
+    def sync_to_install(self, job, source_path, installation_path, delete):
+        """Copy a backup/version over the install; a cancel or error leaves the install as it was"""
+        if not os.path.isdir(source_path):
+            # Deleted while the job was waiting, e.g. by the storage quota
+            raise FileNotFoundError(f"{source_path} no longer exists")
+        return transfer.sync_tree(source_path, installation_path, mode=self.config.get("link_mode", "auto"),
+                                  delete=delete, workers=self.config.get("copy_workers") or transfer.DEFAULT_WORKERS,
+                                  backend=self.config.get("copy_backend", "auto"), progress=job.progress,
+                                  on_total=job.on_total, cancel=job.cancel, transactional=True)
+
+    def queue_job(self, label, targets, work, on_done, deletes=False):
+        """Run work after the jobs already queued; refused if it would remove something they use or vice versa"""
+        job = FileJob(label, targets, work, on_done, self.job_events, deletes)
+        for other in self.jobs:
+            if job.conflicts(other):
+                messagebox.showerror("Busy", f"Please wait until \"{other.label}\" is done")
+                return None
+        self.jobs.append(job)
+        self.job_executor.submit(job.run)
+        self.show_job_state()
+        return job
+
+    def poll_jobs(self):
+        # Runs on the Tk thread; events come from FileJob on the job thread
+        changed = False
+        while True:
+            try:
+                event = self.job_events.get_nowait()
+            except queue.Empty:
+                break
+            changed = True
+            kind, job = event[0], event[1]
+            if kind == "ask":
+                _, _, title, message, answer, reply = event
+                answer.append(messagebox.askyesno(title, message))
+                reply.set()
+            elif kind == "done":
+                self.jobs.remove(job)
+                job.on_done(event[2], event[3])
+        if changed:
+            self.show_job_state()
+        self.root.after(100, self.poll_jobs)
+
+    def show_job_state(self):
+        if not self.jobs:
+            self.job_frame.pack_forget()
+            return
+        # The first job is the one running (or about to)
+        job = self.jobs[0]
+        fraction, text = job.state()
+        if len(self.jobs) > 1:
+            text += f" ({len(self.jobs) - 1} more queued)"
+        if job.cancel.is_set():
+            text = f"Cancelling {job.label}..."
+        self.job_label.config(text=text)
+        self.job_progress["value"] = fraction
+        # A delete that has started can't be put back together
+        stoppable = not job.cancel.is_set() and not (job.deletes and job.started)
+        self.job_cancel_btn.config(state="normal" if stoppable else "disabled")
+        if not self.job_frame.winfo_ismapped():
+            self.job_frame.pack(fill=tk.X, pady=(10, 0))
+
+    def cancel_job(self):
+        if self.jobs:
+            self.jobs[0].cancel.set()
+            self.show_job_state()
+
+    def verify_all(self):
+        entries = catalog.entries("backups", order="created") + catalog.entries("versions")
+        if not entries:
+            messagebox.showinfo("Verify", "No backups or versions stored yet")
+            return
+
+        def work(job):
+            results = []
+            for entry in entries:
+                if job.cancel.is_set():
+                    raise transfer.Cancelled()
+                job.step(f"Verifying {entry['name']}")
+                try:
+                    # Progress comes per batch of files here, not per file
+                    report = verify.verify_tree(entry["kind"], entry["name"],
+                                                progress=lambda size: job.progress(size, 0),
+                                                on_total=job.on_total, cancel=job.cancel)
+                except ValueError:
+                    report = None
+                result = verify.summary(report) if report else "not in the object store, nothing to check against"
+                self.append_log(f"Verify {entry['name']}: {result}")
+                results.append((entry, report))
+            return results
+
+        def done(results, error):
+            if isinstance(error, transfer.Cancelled):
+                self.append_log("Verify cancelled")
+                return
+            if error:
+                messagebox.showerror("Verify", f"Verify failed: {error}")
+                return
+            damaged = [entry["name"] for entry, report in results if report and not report["ok"]]
+            if damaged:
+                messagebox.showwarning("Verify", f"{len(damaged)} damaged: {', '.join(damaged)}\nSee the log for details.")
+            else:
+                messagebox.showinfo("Verify", f"All {len(results)} backups and versions are intact")
+
+        if self.queue_job(f"Verify {len(entries)} backups and versions",
+                          [(entry["kind"], entry["name"]) for entry in entries], work, done):
+            self.append_log(f"Verifying {len(entries)} backups and versions...")
+
+    def evict(self, keep):
+        try:
+            evicted = quota.enforce(keep=keep)
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to restore backup: {str(e)}")
-    
-    def delete_selected_backup(self):
-        selection = self.backups_list.curselection()
-        if not selection:
+            self.append_log(f"Storage quota not enforced: {e}")
             return
-        
-        backup_name = self.backups_list.get(selection)
-        self.delete_backup(backup_name)
+        if evicted:
+            self.append_log(f"Storage quota: removed {', '.join(entry['name'] for entry in evicted)}.")
+
+    def toggle_pin(self, kind, name):
+        entry = catalog.get(kind, name)
+        if entry is None:
+            return
+        if not quota.set_pinned(kind, name, not entry["pinned"]):
+            messagebox.showerror("Error", f"{name} isn't in the object store and can't be pinned")
+            return
+        self.list_backups(show=False)
+        self.list_versions(show=False)
+
+    def toggle_pin_selected_backup(self):
+        row = self.selected_backup()
+        if row:
+            self.toggle_pin("backups", row["name"])
+
+    def toggle_pin_selected_version(self):
+        row = self.selected_version()
+        if row:
+            self.toggle_pin("versions", row["name"])
+
+    def delete_selected_backup(self):
+        row = self.selected_backup()
+        if row:
+            self.delete_backup(row["name"])
     
     def delete_backup(self, backup_name):
         if not messagebox.askyesno(
@@ -651,45 +1028,28 @@ class WorldboxManager:
             return
 
         backup_path = os.path.join(BACKUPS_DIR, backup_name)
-        try:
-            if os.path.isdir(backup_path):
-                shutil.rmtree(backup_path)
-            else:
-                os.remove(backup_path)
+
+        def work(job):
+            store.remove_tree("backups", backup_name, backup_path, progress=job.progress, on_total=job.on_total)
+
+        def done(result, error):
+            if isinstance(error, transfer.Cancelled):
+                return
             self.list_backups()
-            messagebox.showinfo("Success", f"Deleted backup: {backup_name}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to delete backup: {str(e)}")
+            if error:
+                messagebox.showerror("Error", f"Failed to delete backup: {str(error)}")
+            else:
+                messagebox.showinfo("Success", f"Deleted backup: {backup_name}")
+
+        self.queue_job(f"Delete {backup_name}", [("backups", backup_name)], work, done, deletes=True)
     
     def downgrade_selected_version(self):
-        selection = self.versions_list.curselection()
-        if not selection:
-            return
-        
-        version_line = self.versions_list.get(selection)
-        if version_line.startswith("---"):
-            return
-        
-        platform = None
-        for i in range(selection[0], -1, -1):
-            line = self.versions_list.get(i)
-            if line.startswith("---"):
-                platform = line.replace("---", "").replace("---", "").strip()
-                break
-        
-        if not platform:
-            messagebox.showerror("Error", "Could not determine platform for this version")
-            return
-        
-        version = version_line.strip()
-        self.downgrade_to_version(platform, version)
+        row = self.selected_version()
+        if row:
+            self.downgrade_to_version(row["platform"], row["label"])
     
     def downgrade_version(self):
-        if not os.path.exists(VERSIONS_DIR):
-            messagebox.showerror("Error", "Versions directory not found")
-            return
-
-        platforms = sorted(os.listdir(VERSIONS_DIR))
+        platforms = catalog.platforms()
         if not platforms:
             messagebox.showerror("Error", "No platforms available")
             return
@@ -731,11 +1091,8 @@ class WorldboxManager:
         def update_versions(*args):
             versions_list.delete(0, tk.END)
             platform = platform_var.get()
-            versions_path = os.path.join(VERSIONS_DIR, platform)
-            if os.path.exists(versions_path):
-                versions = sorted(os.listdir(versions_path), reverse=True)
-                for version in versions:
-                    versions_list.insert(tk.END, version)
+            for entry in catalog.entries("versions", platform, order="-date"):
+                versions_list.insert(tk.END, entry["manifest_id"])
         
         platform_var.trace("w", update_versions)
         update_versions()
@@ -779,57 +1136,41 @@ class WorldboxManager:
             messagebox.showerror("Error", "Installation path not set")
             return
 
+        # A partial version is laid over the install instead of replacing it
+        profile = steam.version_profile(platform, version)
+        overwritten = f"the {profile} files of your installation" if profile else "your current installation"
         if not messagebox.askyesno(
             "Confirm", 
-            f"Downgrade to version {version} for {platform}?\nThis will overwrite your current installation."
+            f"Downgrade to version {version} for {platform}?\nThis will overwrite {overwritten}."
         ):
             return
 
+        name = f"{platform}/{version}"
         source_path = os.path.join(VERSIONS_DIR, platform, version)
-        try:
-            for item in os.listdir(installation_path):
-                item_path = os.path.join(installation_path, item)
-                if os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
-                else:
-                    os.remove(item_path)
-            
-            # Copy from version
-            for item in os.listdir(source_path):
-                s = os.path.join(source_path, item)
-                d = os.path.join(installation_path, item)
-                if os.path.isdir(s):
-                    shutil.copytree(s, d)
-                else:
-                    shutil.copy2(s, d)
-            
-            messagebox.showinfo("Success", f"Successfully downgraded to version {version} for {platform}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to downgrade: {str(e)}")
+
+        def work(job):
+            if not self.check_before_copy(job, "versions", name):
+                return None
+            job.step(f"Downgrading to {version}")
+            stats = self.sync_to_install(job, source_path, installation_path, delete=profile is None)
+            quota.mark_used("versions", name, installation_path)
+            return stats
+
+        def done(stats, error):
+            if isinstance(error, transfer.Cancelled):
+                messagebox.showinfo("Cancelled", f"Downgrade to {version} cancelled, your installation was left as it was")
+            elif error:
+                messagebox.showerror("Error", f"Failed to downgrade: {str(error)}\nYour installation was left as it was.")
+            elif stats:
+                messagebox.showinfo("Success", f"Successfully downgraded to version {version} for {platform}")
+
+        self.queue_job(f"Downgrade to {version} ({platform})", [("versions", name)], work, done)
     
     def delete_selected_version(self):
         """Delete the selected version"""
-        selection = self.versions_list.curselection()
-        if not selection:
-            return
-        
-        version_line = self.versions_list.get(selection)
-        if version_line.startswith("---"):
-            return
-        
-        platform = None
-        for i in range(selection[0], -1, -1):
-            line = self.versions_list.get(i)
-            if line.startswith("---"):
-                platform = line.replace("---", "").replace("---", "").strip()
-                break
-        
-        if not platform:
-            messagebox.showerror("Error", "Could not determine platform for this version")
-            return
-        
-        version = version_line.strip()
-        self.delete_version(platform, version)
+        row = self.selected_version()
+        if row:
+            self.delete_version(row["platform"], row["label"])
     
     def delete_version(self, platform, version):
         if not messagebox.askyesno(
@@ -838,22 +1179,77 @@ class WorldboxManager:
         ):
             return
 
+        name = f"{platform}/{version}"
         version_path = os.path.join(VERSIONS_DIR, platform, version)
-        try:
-            if os.path.isdir(version_path):
-                shutil.rmtree(version_path)
-            else:
-                os.remove(version_path)
+
+        def work(job):
+            store.remove_tree("versions", name, version_path, progress=job.progress, on_total=job.on_total)
+
+        def done(result, error):
+            if isinstance(error, transfer.Cancelled):
+                return
             self.list_versions()
-            messagebox.showinfo("Success", f"Deleted version: {version} for platform {platform}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to delete version: {str(e)}")
+            if error:
+                messagebox.showerror("Error", f"Failed to delete version: {str(error)}")
+            else:
+                messagebox.showinfo("Success", f"Deleted version: {version} for platform {platform}")
+
+        self.queue_job(f"Delete {version} ({platform})", [("versions", name)], work, done, deletes=True)
     
+    def _on_steam_event(self, event):
+        message = steam_event_message(event)
+        if message:
+            self.append_log(message)
+        state = self.download_tracker.update(event)
+        if state:
+            self.download_state = state
+
+    def poll_download_state(self):
+        # Runs on the Tk thread and only draws the latest state the worker left behind
+        state = self.download_state
+        if state != self.shown_download_state:
+            self.shown_download_state = state
+            fraction, text = state
+            self.download_progress["value"] = fraction
+            self.download_status.config(text=text)
+        self.root.after(100, self.poll_download_state)
+
+    def get_steam_worker(self, username, password, job=None):
+        """Reuse the logged-in SteamCMD sessions as long as the credentials stay the same
+
+        New sessions first pick up the downloads an earlier run didn't finish
+        (other than job, which the caller is about to submit).
+        """
+        password = password or None
+        worker = self.steam_worker
+        if worker and (worker.username, worker.password) == (username, password):
+            return worker
+        if worker:
+            threading.Thread(target=worker.close, daemon=True).start()
+        # The confirmation dialog already asked to approve the login in the Steam app
+        concurrency = self.config.get("download_concurrency", steam.DEFAULT_CONCURRENCY)
+        self.steam_worker = steam.SteamPool(username, password, lambda: "", self._on_steam_event, concurrency)
+        for unfinished in downloads.unfinished():
+            if unfinished[:2] != job:
+                self.append_log(f"Resuming unfinished download of manifest {unfinished[1]} ({unfinished[0]})...")
+                self.steam_worker.submit(*unfinished)
+        return self.steam_worker
+
+    def on_close(self):
+        if self.steam_worker:
+            self.steam_worker.cancel()
+        # Queued jobs are dropped, a running restore puts the install back
+        for job in self.jobs:
+            job.cancel.set()
+        self.root.destroy()
+
     def download_version(self):
         username = self.username_entry.get().strip()
         password = self.password_entry.get()
         platform = self.platform_combo.get()
         manifest_id = self.manifest_entry.get().strip()
+        profile = self.profile_combo.get()
+        profile = None if profile == FULL_VERSION else profile
 
         if not username:
             messagebox.showerror("Error", "Steam username is required")
@@ -865,9 +1261,7 @@ class WorldboxManager:
             messagebox.showerror("Error", "Manifest ID is required")
             return
 
-        depot_id_map = {"Windows": "1206561", "Linux": "1206562", "Mac": "1206563"}
-        depot_id = depot_id_map.get(platform)
-        if not depot_id:
+        if platform not in steam.PLATFORM_DEPOTS:
             messagebox.showerror("Error", "Invalid platform selected")
             return
 
@@ -882,12 +1276,11 @@ class WorldboxManager:
 
         self.append_log(f"Starting download for manifest {manifest_id}...")
 
-        def callback(message):
-            self.append_log(message)
+        worker = self.get_steam_worker(username, password, (platform, manifest_id))
 
         def run_steamcmd():
-            success = steamcmd_gui(username, password, manifest_id, depot_id, callback)
-            if success:
+            result = worker.submit(platform, manifest_id, profile).result()
+            if result["status"] == "done":
                 self.append_log(f"Download completed successfully for manifest {manifest_id}")
                 messagebox.showinfo("Download Complete", f"Version {manifest_id} downloaded successfully!")
                 self.list_versions()
@@ -916,7 +1309,12 @@ def main():
         pass
     
     app = WorldboxManager(root)
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
     root.mainloop()
+    app.job_executor.shutdown(wait=True)
 
 if __name__ == "__main__":
+    # Verification hashes in worker processes, which a frozen build has to hand off here
+    from multiprocessing import freeze_support
+    freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""Compare copy backends on a synthetic WorldBox-shaped installation.
+
+    python benchmarks/bench_copy.py [--scale 0.1] [--workers 1 8] [--dir /path/on/target/fs]
+
+The tree mimics a Unity build: a few big .assets/.resource files, a hundred
+or so managed DLLs and lots of small StreamingAssets files. Pass --dir on the
+filesystem your versions/ folder lives on to see reflink/server-side copies.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src",
+                                "Windows" if os.name == "nt" else "Linux"))
+import transfer  # noqa: E402
+
+
+MB = 1024 * 1024
+
+
+def write_file(path: str, size: int, rng: random.Random):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    block = rng.randbytes(min(size, MB)) if size else b""
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def make_tree(root: str, scale: float, seed: int = 1206560) -> tuple:
+    rng = random.Random(seed)
+    files = []
+    files.append(("worldbox", 700 * 1024))
+    files.append(("UnityPlayer.so", 30 * MB))
+    files.append(("worldbox_Data/resources.assets", 110 * MB))
+    for i in range(40):
+        files.append((f"worldbox_Data/sharedassets{i}.assets", rng.randint(100 * 1024, 60 * MB)))
+        files.append((f"worldbox_Data/sharedassets{i}.assets.resS", rng.randint(10 * 1024, 20 * MB)))
+    for i in range(120):
+        files.append((f"worldbox_Data/Managed/Lib{i}.dll", rng.randint(5 * 1024, 3 * MB)))
+    files.append(("worldbox_Data/Managed/Assembly-CSharp.dll", 6 * MB))
+    for i in range(600):
+        files.append((f"worldbox_Data/StreamingAssets/data/{i % 12}/entry{i}.json", rng.randint(500, 50 * 1024)))
+    for i in range(8):
+        files.append((f"worldbox_Data/Plugins/lib{i}.so", rng.randint(200 * 1024, 4 * MB)))
+
+    total = 0
+    for rel, size in files:
+        size = max(1, int(size * scale)) if size > 64 * 1024 else size
+        write_file(os.path.join(root, rel), size, rng)
+        total += size
+    return len(files), total
+
+
+def run(src: str, dst: str, mode: str, backend: str, workers: int) -> tuple:
+    if os.path.exists(dst):
+        shutil.rmtree(dst)
+    start = time.perf_counter()
+    stats = transfer.sync_tree(src, dst, mode=mode, backend=backend, workers=workers)
+    return time.perf_counter() - start, stats["methods"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=0.1, help="Size factor for large files (1.0 ~ 1.4 GB)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, transfer.DEFAULT_WORKERS])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dir", default=None, help="Where to build the test trees")
+    args = parser.parse_args()
+
+    cases = [("copy", backend) for backend in transfer.COPY_BACKENDS if backend != "auto"]
+    cases += [("auto", "auto"), ("hardlink", "auto")]
+
+    with tempfile.TemporaryDirectory(prefix="wb-bench-", dir=args.dir) as tmp:
+        src = os.path.join(tmp, "src")
+        count, total = make_tree(src, args.scale)
+        print(f"Test tree: {count} files, {total / MB:.1f} MB in {tmp}\n")
+        print(f"{'mode':<10}{'backend':<18}{'workers':>8}{'best s':>10}{'MB/s':>10}  methods")
+        for mode, backend in cases:
+            for workers in args.workers:
+                best, methods = None, {}
+                for _ in range(args.repeat):
+                    elapsed, methods = run(src, os.path.join(tmp, "dst"), mode, backend, workers)
+                    best = elapsed if best is None else min(best, elapsed)
+                print(f"{mode:<10}{backend:<18}{workers:>8}{best:>10.3f}{total / MB / best:>10.1f}  {methods}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Time to first byte of a download with and without a persistent SteamCMD session.
+
+    python benchmarks/bench_session.py USERNAME PLATFORM MANIFEST [MANIFEST ...] [--password PW]
+
+Run it from the folder you use Rewind in (versions/ and storage/ are written
+there). "per process" starts SteamCMD and logs in for every download, like
+Rewind used to; "session" keeps one SteamWorker logged in, so only the first
+download pays for the login. Time to first byte is measured from submitting a
+download to the first progress line SteamCMD prints for it.
+"""
+import os
+import sys
+import time
+import getpass
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src",
+                                "Windows" if os.name == "nt" else "Linux"))
+import steam  # noqa: E402
+
+
+def measure(worker: steam.SteamWorker, marks: dict, platform: str, manifest_id: str) -> tuple:
+    job = (platform, manifest_id)
+    marks.pop(job, None)
+    start = time.perf_counter()
+    result = worker.submit(platform, manifest_id).result()
+    total = time.perf_counter() - start
+    if result["status"] != "done":
+        raise SystemExit(f"{platform} {manifest_id} failed: {result['error']}")
+    return marks.get(job, time.perf_counter()) - start, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("username")
+    parser.add_argument("platform", choices=sorted(steam.PLATFORM_DEPOTS))
+    parser.add_argument("manifests", nargs="+")
+    parser.add_argument("--password", default=None)
+    args = parser.parse_args()
+    password = args.password if args.password is not None else getpass.getpass("Steam password: ") or None
+
+    marks = {}
+
+    def on_event(event):
+        if event["type"] in ("progress", "done") and "job" in event:
+            marks.setdefault(event["job"], time.perf_counter())
+
+    def ask_guard():
+        return input("Steam Guard code (Enter if approved in the app): ")
+
+    print(f"{'mode':<14}{'download':>10}{'manifest':>22}{'first byte s':>14}{'total s':>10}")
+    for mode in ("per process", "session"):
+        worker = None
+        for i, manifest_id in enumerate(args.manifests, start=1):
+            if worker is None or mode == "per process":
+                if worker:
+                    worker.close()
+                worker = steam.SteamWorker(args.username, password, ask_guard, on_event)
+            first_byte, total = measure(worker, marks, args.platform, manifest_id)
+            print(f"{mode:<14}{i:>10}{manifest_id:>22}{first_byte:>14.2f}{total:>10.2f}")
+        worker.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Check the import time of rewind.py and manager.py against a budget.
+
+    python benchmarks/bench_startup.py [--runs 5] [--budget-ms 150] [--top 8]
+
+Each module is imported with `python -X importtime` in an empty temporary
+folder, a few times, and the fastest cumulative time is compared with the
+budget. The check also fails if importing created any files or folders, or
+pulled in a module that should only be loaded once it's needed (the
+SteamCMD session code, requests, rich's progress bars). Exits with status 1
+if anything is over budget, so it can run in CI.
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src",
+                   "Windows" if os.name == "nt" else "Linux")
+MODULES = ("rewind", "manager")
+# Loaded lazily by the code paths that use them
+DEFERRED = ("asyncio", "steam", "requests", "rich.progress")
+
+
+def import_times(module: str) -> tuple:
+    """{name: (self us, cumulative us, depth)} for one fresh import, and what it left in the cwd"""
+    with tempfile.TemporaryDirectory() as cwd:
+        env = dict(os.environ, PYTHONPATH=os.path.abspath(SRC))
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                cwd=cwd, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise SystemExit(f"import {module} failed:\n{result.stderr}")
+        left = sorted(os.listdir(cwd))
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(own), int(cumulative), depth))
+
+    # Children are listed before their parent, so the module's own imports are
+    # the lines between it and the previous top-level entry (site and friends)
+    end = max(i for i, entry in enumerate(entries) if entry[0] == module and entry[3] == 0)
+    start = end
+    while start > 0 and entries[start - 1][3] > 0:
+        start -= 1
+    return {name: (own, cumulative, depth) for name, own, cumulative, depth in entries[start:end + 1]}, left
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="per module, fastest of the runs")
+    parser.add_argument("--top", type=int, default=8, help="show the slowest direct imports")
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        runs = [import_times(module) for _ in range(max(1, args.runs))]
+        times, left = min(runs, key=lambda run: run[0][module][1])
+        total = times[module][1] / 1000
+        over = total > args.budget_ms
+        print(f"{module}: {total:.1f} ms (budget {args.budget_ms:.0f} ms){'  OVER BUDGET' if over else ''}")
+
+        direct = sorted(((cumulative, name) for name, (_, cumulative, depth) in times.items() if depth == 1),
+                        reverse=True)
+        for cumulative, name in direct[:args.top]:
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+        deferred = [name for name in DEFERRED if name in times]
+        if deferred:
+            print(f"    imported at startup: {', '.join(deferred)}")
+        created = [name for run in runs for name in run[1]]
+        if created:
+            print(f"    created on import: {', '.join(sorted(set(created)))}")
+        failed = failed or over or bool(deferred) or bool(created)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+import shutil
+import struct
+import zipfile
+from io import BytesIO
+from typing import Optional
+
+# Reader for the binary depot manifests SteamCMD leaves in depotcache/ after
+# download_depot (<depot>_<manifest>.manifest). They list every file of the
+# depot with its size and the SHA-1 of its content, the same digest the object
+# store uses, so a fresh download can be stored without reading it twice.
+#
+# The file is a sequence of sections: a little-endian uint32 magic, a uint32
+# length and that many bytes of protobuf (the payload with the file list, the
+# metadata, the signature), ending with the end magic.
+
+PAYLOAD_MAGIC = 0x71F617D0
+METADATA_MAGIC = 0x1F4812BE
+SIGNATURE_MAGIC = 0x1B81B817
+END_MAGIC = 0x32C415AB
+
+# ContentManifestPayload.FileMapping fields
+FILE_NAME, FILE_SIZE, FILE_FLAGS, FILE_SHA_FILENAME, FILE_SHA_CONTENT, FILE_CHUNKS, FILE_LINK = 1, 2, 3, 4, 5, 6, 7
+# ContentManifestMetadata fields
+META_DEPOT, META_MANIFEST, META_CREATED, META_ENCRYPTED, META_SIZE = 1, 2, 3, 4, 5
+FLAG_DIRECTORY = 64
+FLAG_SYMLINK = 512
+
+
+def _varint(data: bytes, pos: int) -> tuple:
+    value = shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _fields(data: bytes):
+    """Yield (field number, value) of a protobuf message; length-delimited values stay bytes."""
+    pos = 0
+    while pos < len(data):
+        key, pos = _varint(data, pos)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(data, pos)
+        elif wire == 1:
+            value, pos = int.from_bytes(data[pos:pos + 8], "little"), pos + 8
+        elif wire == 2:
+            length, pos = _varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire == 5:
+            value, pos = int.from_bytes(data[pos:pos + 4], "little"), pos + 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire}")
+        if pos > len(data):
+            raise ValueError("Truncated field")
+        yield number, value
+
+
+def _file_mapping(data: bytes) -> tuple:
+    name, entry = "", {"size": 0, "flags": 0}
+    for number, value in _fields(data):
+        if number == FILE_NAME:
+            name = value.decode("utf-8", "replace").rstrip("\0")
+        elif number == FILE_SIZE:
+            entry["size"] = value
+        elif number == FILE_FLAGS:
+            entry["flags"] = value
+        elif number == FILE_SHA_CONTENT:
+            entry["sha"] = value.hex()
+        elif number == FILE_LINK:
+            entry["link"] = value.decode("utf-8", "replace").rstrip("\0")
+    # The Windows depot lists its paths with backslashes
+    return name.replace("\\", "/"), entry
+
+
+def parse(data: bytes) -> dict:
+    """{"depot_id", "manifest_id", "created", "encrypted", "size", "files"} of a depot manifest.
+
+    files maps the depot path of every entry to {"size", "flags", "sha", "link"}
+    (sha and link only where the manifest has them). Raises ValueError if data
+    isn't a manifest.
+    """
+    if data[:4] == b"PK\x03\x04":
+        # Manifests straight from the CDN are zipped
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            data = archive.read(archive.namelist()[0])
+    manifest = {"depot_id": None, "manifest_id": None, "created": None, "encrypted": False, "size": None,
+                "files": {}}
+    pos, seen = 0, False
+    while pos + 4 <= len(data):
+        magic, = struct.unpack_from("<I", data, pos)
+        pos += 4
+        if magic == END_MAGIC:
+            break
+        if pos + 4 > len(data):
+            raise ValueError("Truncated section")
+        length, = struct.unpack_from("<I", data, pos)
+        section = data[pos + 4:pos + 4 + length]
+        pos += 4 + length
+        if len(section) != length:
+            raise ValueError("Truncated section")
+        if magic == PAYLOAD_MAGIC:
+            seen = True
+            for number, value in _fields(section):
+                if number == 1:
+                    name, entry = _file_mapping(value)
+                    manifest["files"][name] = entry
+        elif magic == METADATA_MAGIC:
+            seen = True
+            for number, value in _fields(section):
+                if number == META_DEPOT:
+                    manifest["depot_id"] = str(value)
+                elif number == META_MANIFEST:
+                    manifest["manifest_id"] = str(value)
+                elif number == META_CREATED:
+                    manifest["created"] = value
+                elif number == META_ENCRYPTED:
+                    manifest["encrypted"] = bool(value)
+                elif number == META_SIZE:
+                    manifest["size"] = value
+        elif magic != SIGNATURE_MAGIC:
+            raise ValueError(f"Unknown section magic {magic:#010x}")
+    if not seen:
+        raise ValueError("Not a depot manifest")
+    return manifest
+
+
+def load(path: str) -> dict:
+    with open(path, "rb") as f:
+        return parse(f.read())
+
+
+def digests(manifest: dict) -> dict:
+    """{depot path: (size, SHA-1)} of the regular files of a parsed manifest.
+
+    Empty if the file names are encrypted (the depot key would be needed to
+    read them). Empty files are left out, hashing them costs nothing.
+    """
+    if manifest["encrypted"]:
+        return {}
+    return {name: (entry["size"], entry["sha"]) for name, entry in manifest["files"].items()
+            if entry.get("sha") and entry["size"] and not entry["flags"] & (FLAG_DIRECTORY | FLAG_SYMLINK)}
+
+
+def search_dirs(install_dir: Optional[str] = None, executable: Optional[str] = None) -> list:
+    """Folders a depotcache/ may be in: the session's install dir, SteamCMD's own folder, Steam's usual homes."""
+    dirs = [install_dir] if install_dir else []
+    found = shutil.which(executable) if executable else None
+    if found:
+        dirs.append(os.path.dirname(os.path.realpath(found)))
+    home = os.path.expanduser("~")
+    dirs += [os.path.join(home, ".steam", "steamcmd"), os.path.join(home, ".steam", "steam"),
+             os.path.join(home, ".local", "share", "Steam"), os.path.join(home, "Steam"),
+             os.path.join(home, "Library", "Application Support", "Steam")]
+    return dirs
+
+
+def find(depot_id: str, manifest_id: str, dirs: list) -> Optional[str]:
+    """Path of the cached manifest of a download, None if SteamCMD didn't leave one behind."""
+    filename = f"{depot_id}_{manifest_id}.manifest"
+    for folder in dirs:
+        path = os.path.join(folder, "depotcache", filename)
+        if os.path.isfile(path):
+            return path
+    return None
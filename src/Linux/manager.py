@@ -1,5 +1,4 @@
 import os
-import shutil
 import time
 import json
 import typer
@@ -8,7 +7,12 @@ from rich.prompt import Prompt, IntPrompt
 from rich.panel import Panel
 from rich.table import Table
 from rich.theme import Theme
-from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn, TimeElapsedColumn
+import store
+import catalog
+import verify
+import quota
+import debuglog
+import transfer
 
 # Paths
 CONFIG_PATH = os.path.join("storage", "config.json")
@@ -28,19 +32,18 @@ console = Console(theme=Theme({
     "debug": "dim grey50"
 }))
 
-os.makedirs("storage", exist_ok=True)
-os.makedirs(BACKUPS_DIR, exist_ok=True)
-os.makedirs(DEBUG_FOLDER, exist_ok=True)
-
 DEBUG_MODE = False
+LINK_MODE = None
+HASH_COMPARE = False
+WORKERS = None
+COPY_BACKEND = None
 
 # === Utility Functions ===
 
-def debug_log(msg: str):
+def debug_log(msg: str, **fields):
     if DEBUG_MODE:
         console.print(f"[debug]{msg}[/debug]")
-        with open(os.path.join(DEBUG_FOLDER, "debug_log.txt"), "a") as f:
-            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {msg}\n")
+        debuglog.open_log(DEBUG_FOLDER, "manager").write(msg, **fields)
 
 
 def clear_terminal():
@@ -52,6 +55,7 @@ def load_config():
 
 
 def save_config(config: dict):
+    os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
     json.dump(config, open(CONFIG_PATH, "w"), indent=4)
 
 
@@ -60,39 +64,96 @@ def confirm_action(warning: str):
     return Prompt.ask("Are you sure you want to continue? (yes/no)", choices=["yes", "no"]) == "yes"
 
 
-def list_directory(path: str):
-    return sorted([item for item in os.listdir(path) if os.path.isdir(os.path.join(path, item))])
-
-
-def count_files(path: str):
-    total = 0
-    for _, _, files in os.walk(path):
-        total += len(files)
-    return total
-
-
-def copy_with_progress(src, dst, action="Copying"):
-    total_files = count_files(src)
-    with Progress(
+def transfer_progress():
+    from rich.progress import Progress, SpinnerColumn, BarColumn, TimeElapsedColumn, DownloadColumn, TransferSpeedColumn
+    return Progress(
         SpinnerColumn(),
         "[progress.description]{task.description}",
         BarColumn(),
         "[progress.percentage]{task.percentage:>3.0f}%",
+        DownloadColumn(),
+        TransferSpeedColumn(),
         TimeElapsedColumn(),
         console=console
-    ) as progress:
-        task = progress.add_task(f"{action}...", total=total_files)
-
-        for foldername, subfolders, filenames in os.walk(src):
-            relative_path = os.path.relpath(foldername, src)
-            target_folder = os.path.join(dst, relative_path)
-            os.makedirs(target_folder, exist_ok=True)
-
-            for filename in filenames:
-                src_file = os.path.join(foldername, filename)
-                dst_file = os.path.join(target_folder, filename)
-                shutil.copy2(src_file, dst_file)
-                progress.update(task, advance=1)
+    )
+
+
+def copy_with_progress(src, dst, action="Copying", mode="copy", delete=False):
+    """Make dst match src, only writing files that differ. Progress is counted in bytes written."""
+    with transfer_progress() as progress:
+        task = progress.add_task(f"{action}...", total=None)
+        stats = transfer.sync_tree(
+            src, dst, mode=mode, delete=delete, compare_content=HASH_COMPARE, workers=get_workers(),
+            backend=get_copy_backend(),
+            progress=lambda n: progress.update(task, advance=n),
+            on_total=lambda total: progress.update(task, total=total)
+        )
+        progress.update(task, total=stats["bytes"], completed=stats["bytes"])
+    debug_log(f"{action}: {stats}")
+    console.print(f"[info]{stats['written']} files written, {stats['unchanged']} unchanged, "
+                  f"{stats['deleted']} removed[/info]")
+    return stats
+
+
+def get_link_mode() -> str:
+    mode = LINK_MODE or load_config().get("link_mode", "auto")
+    return mode if mode in transfer.LINK_MODES else "auto"
+
+
+def get_workers() -> int:
+    return WORKERS or load_config().get("copy_workers") or transfer.DEFAULT_WORKERS
+
+
+def get_copy_backend() -> str:
+    backend = COPY_BACKEND or load_config().get("copy_backend", "auto")
+    return backend if backend in transfer.COPY_BACKENDS else "auto"
+
+
+def ingest_with_progress(src, dst, kind, name, action="Storing", previous=None):
+    with transfer_progress() as progress:
+        task = progress.add_task(f"{action}...", total=None)
+        tree = store.ingest_tree(
+            src, dst, kind, name, workers=get_workers(), previous=previous,
+            progress=lambda n: progress.update(task, advance=n),
+            on_total=lambda total: progress.update(task, total=total)
+        )
+    return tree
+
+
+def verify_with_progress(kind: str, name: str, action: str = "Verifying") -> dict:
+    """verify.verify_tree() with a progress bar. None if there is nothing to check against."""
+    with transfer_progress() as progress:
+        task = progress.add_task(f"{action} {name}...", total=None)
+        try:
+            report = verify.verify_tree(
+                kind, name,
+                progress=lambda n: progress.update(task, advance=n),
+                on_total=lambda total: progress.update(task, total=total)
+            )
+        except ValueError as e:
+            debug_log(f"Not verified: {e}")
+            return None
+        # Everything may have come from the digest cache
+        progress.update(task, total=report["bytes"] or 1, completed=report["bytes"] or 1)
+    debug_log(f"Verified {kind} {name}: {report['hashed']} hashed, {report['cached']} cached", report=report)
+    return report
+
+
+def check_before_copy(kind: str, name: str) -> bool:
+    """Verify a backup/version before it is copied over the install; False if the user backs out."""
+    report = verify_with_progress(kind, name, action="Checking")
+    if report is None or report["ok"]:
+        return True
+    console.print(f"[error]{name} is damaged: {verify.summary(report)}[/error]")
+    return confirm_action("Copy it over your installation anyway?")
+
+
+def format_size(num_bytes: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
 
 
 # === Main Functions ===
@@ -108,7 +169,9 @@ def show_menu():
     table.add_row("3", "List Backups and Versions")
     table.add_row("4", "Restore Backup")
     table.add_row("5", "Downgrade to Version")
-    table.add_row("6", "Exit")
+    table.add_row("6", "Verify Backups and Versions")
+    table.add_row("7", "Pin or Unpin a Backup or Version")
+    table.add_row("8", "Exit")
     console.print(table)
 
 
@@ -139,9 +202,18 @@ def backup():
     backup_path = os.path.join(BACKUPS_DIR, f"backup-{timestamp}")
 
 
+    previous = store.latest_tree("backups", path)
+    if previous:
+        debug_log(f"Incremental backup on top of {previous['name']}")
+
     try:
-        copy_with_progress(path, backup_path, action="Backing up")
+        tree = ingest_with_progress(path, backup_path, "backups", f"backup-{timestamp}",
+                                    action="Backing up", previous=previous)
+        if previous:
+            console.print(f"[info]{tree['stats']['reused']} unchanged files taken from {previous['name']}, "
+                          f"{tree['stats']['stored']} files stored[/info]")
         console.print(f"[success]Backup created at: {backup_path}[/success]")
+        evict(("backups", f"backup-{timestamp}"))
         input("\nPress Enter to continue...")
     except Exception as e:
         console.print(f"[error]Backup failed: {e}[/error]")
@@ -149,33 +221,67 @@ def backup():
 
 
 
+def evict(keep: tuple):
+    """Enforce the storage quota after storing keep, and say what it removed."""
+    try:
+        evicted = quota.enforce(keep=keep)
+    except Exception as e:
+        console.print(f"[warning]Storage quota not enforced: {e}[/warning]")
+        return
+    if evicted:
+        debug_log("Evicted", names=[entry["name"] for entry in evicted])
+        console.print(f"[info]Storage quota: removed {', '.join(entry['name'] for entry in evicted)}[/info]")
+
+
+def catalog_table(entries: list, first_column: str, dated: bool = False) -> Table:
+    table = Table(show_header=True, header_style="bold magenta", box=None, pad_edge=False)
+    table.add_column(first_column)
+    if dated:
+        table.add_column("Released")
+    table.add_column("Files", justify="right")
+    table.add_column("Size", justify="right")
+    table.add_column("Stored")
+    for entry in entries:
+        name = entry["manifest_id"] or entry["name"]
+        if entry["profile"]:
+            name += f" [info](partial: {entry['profile']})[/info]"
+        if entry["pinned"]:
+            name += " [highlight](pinned)[/highlight]"
+        row = [name] + ([entry["manifest_date"] or "?"] if dated else [])
+        table.add_row(*row, str(entry["files"]), format_size(entry["bytes"]),
+                      time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["created"])))
+    return table
+
+
 def list_versions():
     clear_terminal()
     console.print(Panel.fit("[title]Available Backups and Versions[/title]", border_style="blue"))
+    # Everything below comes from the catalog; the folders are only looked at
+    # when it hasn't been checked against them for a while
+    catalog.refresh_stale()
 
     # Backups
-    backups = list_directory(BACKUPS_DIR)
+    backups = catalog.entries("backups", order="created")
     console.print("\n[bold underline]Backups:[/bold underline]")
     if backups:
-        for b in backups:
-            console.print(f"• {b}")
+        console.print(catalog_table(backups, "Backup"))
     else:
         console.print("[info]No backups found.[/info]")
 
     # Versions
     console.print("\n[bold underline]Versions:[/bold underline]")
-    if not os.path.exists(VERSIONS_DIR):
-        console.print("[warning]Versions directory not found.[/warning]")
-    else:
-        for platform in list_directory(VERSIONS_DIR):
-            console.print(f"[highlight]{platform}[/highlight]")
-            versions = list_directory(os.path.join(VERSIONS_DIR, platform))
-            if versions:
-                for v in versions:
-                    console.print(f"  • {v}")
-            else:
-                console.print("  [info]No versions found.[/info]")
-        input("\nPress Enter to continue...")
+    platforms = catalog.platforms()
+    if not platforms:
+        console.print("[info]No versions found.[/info]")
+    for platform in platforms:
+        console.print(f"[highlight]{platform}[/highlight]")
+        console.print(catalog_table(catalog.entries("versions", platform, order="-date"), "Manifest", dated=True))
+
+    usage = catalog.usage()
+    if usage["logical"]:
+        console.print(f"\n[info]Stored: {format_size(usage['logical'])} in versions and backups, "
+                      f"{format_size(usage['stored'])} on disk[/info]")
+    input("\nPress Enter to continue...")
 
 
 
@@ -191,7 +297,8 @@ def restore_backup():
 
         return
 
-    backups = list_directory(BACKUPS_DIR)
+    catalog.refresh_stale()
+    backups = [entry["name"] for entry in catalog.entries("backups", order="created")]
     if not backups:
         console.print("[info]No backups available.[/info]")
         return
@@ -205,11 +312,18 @@ def restore_backup():
     if not confirm_action("This will completely overwrite your current installation!"):
         return
 
-    backup_path = os.path.join(BACKUPS_DIR, selected)
+    entry = catalog.verify("backups", selected)
+    if entry is None:
+        console.print(f"[error]Backup {selected} no longer exists.[/error]")
+        input("\nPress Enter to continue...")
+        return
+    backup_path = entry["path"]
+    if not check_before_copy("backups", selected):
+        return
 
     try:
-        shutil.rmtree(path)
-        copy_with_progress(backup_path, path, action="Restoring backup")
+        copy_with_progress(backup_path, path, action="Restoring backup", mode=get_link_mode(), delete=True)
+        quota.mark_used("backups", selected, path)
         console.print(f"[success]Restored backup: {selected}[/success]")
         input("\nPress Enter to continue...")
     except Exception as e:
@@ -226,7 +340,8 @@ def downgrade_version():
         input("\nPress Enter to continue...")
         return
 
-    platforms = list_directory(VERSIONS_DIR)
+    catalog.refresh_stale()
+    platforms = catalog.platforms()
     if not platforms:
         console.print("[info]No platforms available.[/info]")
         input("\nPress Enter to continue...")
@@ -238,26 +353,43 @@ def downgrade_version():
     plat_choice = IntPrompt.ask("Enter number", choices=[str(i) for i in range(1, len(platforms)+1)])
     platform = platforms[plat_choice - 1]
 
-    versions = list_directory(os.path.join(VERSIONS_DIR, platform))
-    if not versions:
+    entries = catalog.entries("versions", platform, order="-date")
+    if not entries:
         console.print("[info]No versions for this platform.[/info]")
         input("\nPress Enter to continue...")
         return
 
     console.print("Choose version:")
-    for i, v in enumerate(versions, start=1):
-        console.print(f"{i}. {v}")
+    versions = [entry["manifest_id"] for entry in entries]
+    profiles = {entry["manifest_id"]: entry["profile"] for entry in entries}
+    for i, entry in enumerate(entries, start=1):
+        console.print(f"{i}. {entry['manifest_id']}" + (f" ({entry['manifest_date']})" if entry["manifest_date"] else "")
+                      + (f" (partial: {entry['profile']})" if entry["profile"] else ""))
     ver_choice = IntPrompt.ask("Enter number", choices=[str(i) for i in range(1, len(versions)+1)])
     version = versions[ver_choice - 1]
 
-    if not confirm_action(f"This will overwrite your current installation with version '{version}'!"):
+    # A partial version only has some of the files, so it is laid over the
+    # install instead of replacing it
+    partial = profiles[version] is not None
+    if partial:
+        warning = f"This will overwrite the {profiles[version]} files of your installation with version '{version}'!"
+    else:
+        warning = f"This will overwrite your current installation with version '{version}'!"
+    if not confirm_action(warning):
         return
 
-    source = os.path.join(VERSIONS_DIR, platform, version)
+    entry = catalog.verify("versions", f"{platform}/{version}")
+    if entry is None:
+        console.print(f"[error]Version {version} no longer exists.[/error]")
+        input("\nPress Enter to continue...")
+        return
+    source = entry["path"]
+    if not check_before_copy("versions", f"{platform}/{version}"):
+        return
 
     try:
-        shutil.rmtree(path)
-        copy_with_progress(source, path, action="Downgrading")
+        copy_with_progress(source, path, action="Downgrading", mode=get_link_mode(), delete=not partial)
+        quota.mark_used("versions", f"{platform}/{version}", path)
         console.print(f"[success]Downgraded to {version} on {platform}[/success]")
         input("\nPress Enter to continue...")
     except Exception as e:
@@ -266,29 +398,101 @@ def downgrade_version():
 
 
 
+def verify_all():
+    clear_terminal()
+    console.print(Panel.fit("[title]Verify Backups and Versions[/title]", border_style="blue"))
+    catalog.refresh_stale()
+    entries = catalog.entries("backups", order="created") + catalog.entries("versions", order="name")
+    if not entries:
+        console.print("[info]Nothing stored yet.[/info]")
+        input("\nPress Enter to continue...")
+        return
+
+    results = []
+    for entry in entries:
+        results.append((entry, verify_with_progress(entry["kind"], entry["name"])))
+
+    table = Table(show_header=True, header_style="bold magenta", box=None, pad_edge=False)
+    table.add_column("Backup / Version")
+    table.add_column("Result")
+    damaged = 0
+    for entry, report in results:
+        if report is None:
+            result = "[info]not in the object store, nothing to check against[/info]"
+        elif report["ok"]:
+            result = f"[success]{verify.summary(report)}[/success]"
+        else:
+            damaged += 1
+            result = f"[error]{verify.summary(report)}[/error]"
+        table.add_row(entry["name"], result)
+    console.print(table)
+    hashed = sum(report["bytes"] for _, report in results if report)
+    console.print(f"\n[info]{damaged} damaged, {format_size(hashed)} read; unchanged files are taken from the "
+                  f"digest cache.[/info]")
+    input("\nPress Enter to continue...")
+
+
+def toggle_pin():
+    clear_terminal()
+    console.print(Panel.fit("[title]Pin or Unpin a Backup or Version[/title]", border_style="blue"))
+    console.print("[info]Pinned backups and versions are never removed by the storage quota.[/info]")
+    catalog.refresh_stale()
+    entries = catalog.entries("backups", order="created") + catalog.entries("versions", order="name")
+    if not entries:
+        console.print("[info]Nothing stored yet.[/info]")
+        input("\nPress Enter to continue...")
+        return
+
+    for i, entry in enumerate(entries, start=1):
+        console.print(f"{i}. {entry['name']}" + (" [highlight](pinned)[/highlight]" if entry["pinned"] else ""))
+    choice = IntPrompt.ask("Enter number", choices=[str(i) for i in range(1, len(entries)+1)])
+    entry = entries[choice - 1]
+
+    if quota.set_pinned(entry["kind"], entry["name"], not entry["pinned"]):
+        console.print(f"[success]{'Unpinned' if entry['pinned'] else 'Pinned'} {entry['name']}[/success]")
+    else:
+        console.print(f"[error]{entry['name']} isn't in the object store and can't be pinned.[/error]")
+    input("\nPress Enter to continue...")
+
+
 # === Entry Point ===
 
 @app.command()
-def main(debug: bool = typer.Option(False, help="Enable debug logging")):
-    global DEBUG_MODE
+def main(debug: bool = typer.Option(False, help="Enable debug logging"),
+         link_mode: str = typer.Option(None, help="How to place files on restore/downgrade: auto, reflink, hardlink or copy"),
+         hash_compare: bool = typer.Option(False, help="Compare file contents instead of size/mtime when restoring or downgrading"),
+         workers: int = typer.Option(None, help="Number of files copied in parallel"),
+         copy_backend: str = typer.Option(None, help="How file data is copied: auto, copy_file_range, sendfile or shutil")):
+    global DEBUG_MODE, LINK_MODE, HASH_COMPARE, WORKERS, COPY_BACKEND
     DEBUG_MODE = debug
+    LINK_MODE = link_mode
+    HASH_COMPARE = hash_compare
+    WORKERS = workers
+    COPY_BACKEND = copy_backend
     debug_log("Application started")
 
-    while True:
-        show_menu()
-        choice = IntPrompt.ask("Select an option", choices=["1", "2", "3", "4", "5", "6"])
-        match choice:
-            case 1: set_path()
-            case 2: backup()
-            case 3: list_versions()
-            case 4: restore_backup()
-            case 5: downgrade_version()
-            case 6:
-                console.print("[info]Goodbye![/info]")
-                break
-
-    debug_log("Application exited")
+    try:
+        while True:
+            show_menu()
+            choice = IntPrompt.ask("Select an option", choices=["1", "2", "3", "4", "5", "6", "7", "8"])
+            match choice:
+                case 1: set_path()
+                case 2: backup()
+                case 3: list_versions()
+                case 4: restore_backup()
+                case 5: downgrade_version()
+                case 6: verify_all()
+                case 7: toggle_pin()
+                case 8:
+                    console.print("[info]Goodbye![/info]")
+                    break
+    finally:
+        debug_log("Application exited")
+        debuglog.close_all()
 
 
 if __name__ == "__main__":
+    # Verification hashes in worker processes, which a frozen build has to hand off here
+    from multiprocessing import freeze_support
+    freeze_support()
     app()
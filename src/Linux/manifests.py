@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import threading
+from typing import Callable, Optional
+
+# Cache for the manifest list. The data itself stays in manifests_cache.json
+# (same format as before), validators and the fetch time live next to it.
+# Fresh entries are served as-is, stale ones are served immediately while a
+# conditional request (If-None-Match / If-Modified-Since) revalidates them in
+# the background, and a missing network just means the cache is used as is.
+
+MANIFESTS_URL = "https://gmblahaj.xyz/pages/manifests.json"
+CACHE_PATH = os.path.join("storage", "manifests_cache.json")
+META_PATH = os.path.join("storage", "manifests_cache.meta.json")
+DEFAULT_TTL = 6 * 60 * 60
+TIMEOUT = (5, 20)  # connect, read
+
+_refresh_lock = threading.Lock()
+_refresh_thread: Optional[threading.Thread] = None
+
+
+def _read_json(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{threading.get_ident()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def load_cached() -> tuple:
+    return _read_json(CACHE_PATH) or {}, _read_json(META_PATH) or {}
+
+
+def cache_age() -> Optional[float]:
+    meta = _read_json(META_PATH) or {}
+    if "fetched_at" not in meta:
+        return None
+    return time.time() - meta["fetched_at"]
+
+
+def refresh(log: Optional[Callable[[str], None]] = None) -> dict:
+    """Revalidate the cache against the server. Returns the current data.
+
+    Network errors are raised to the caller; the cache is left untouched.
+    """
+    import requests
+
+    data, meta = load_cached()
+    headers = {"Accept-Encoding": "gzip"}
+    if data and meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if data and meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    response = requests.get(MANIFESTS_URL, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304:
+        if log:
+            log("Manifests not modified on the server")
+        meta["fetched_at"] = time.time()
+        _write_json(META_PATH, meta)
+        return data
+
+    response.raise_for_status()
+    data = response.json()
+    _write_json(CACHE_PATH, data)
+    _write_json(META_PATH, {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    })
+    if log:
+        log(f"Fetched manifests from {MANIFESTS_URL} ({len(response.content)} bytes)")
+    return data
+
+
+def refresh_in_background(log: Optional[Callable[[str], None]] = None) -> threading.Thread:
+    global _refresh_thread
+
+    def run():
+        try:
+            refresh(log)
+        except Exception as e:
+            if log:
+                log(f"Background manifest refresh failed: {e}")
+
+    with _refresh_lock:
+        if _refresh_thread is None or not _refresh_thread.is_alive():
+            _refresh_thread = threading.Thread(target=run, daemon=True)
+            _refresh_thread.start()
+        return _refresh_thread
+
+
+def get_manifest_data(ttl: float = DEFAULT_TTL, offline: bool = False, force: bool = False,
+                      log: Optional[Callable[[str], None]] = None) -> dict:
+    """Return the manifest list, going to the network only when needed.
+
+    - offline: only ever use the cache
+    - force: revalidate now and wait for the answer
+    - otherwise: fresh cache is returned directly, stale cache is returned and
+      revalidated in the background, no cache means a blocking fetch
+    """
+    data, meta = load_cached()
+    if offline:
+        if log:
+            log("Offline mode: using cached manifests")
+        return data
+
+    age = time.time() - meta.get("fetched_at", 0)
+    if data and not force:
+        if age < ttl:
+            if log:
+                log(f"Loaded manifests from cache ({int(age)}s old)")
+            return data
+        if log:
+            log(f"Cached manifests are {int(age)}s old, revalidating in the background")
+        refresh_in_background(log)
+        return data
+
+    try:
+        return refresh(log)
+    except Exception as e:
+        if log:
+            log(f"Manifest fetch failed, using cache: {e}")
+        if data:
+            return data
+        raise
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import threading
+from typing import Optional
+
+import store
+import catalog
+
+# Storage budget for versions/ and backups/, set in storage/config.json:
+#
+#     "quota": {"count": 10, "bytes": 20000000000, "Windows": {"count": 3}, "backups": {"count": 5}}
+#
+# count and bytes apply to the versions of each platform and to the backups,
+# each on their own; a platform name or "backups" overrides them for that
+# group. bytes is what the group takes on disk, files its entries share
+# counted once. enforce() runs after every download and backup and removes the
+# entries that were restored or downgraded to least recently (never used ones
+# by when they were stored) until every group fits. Pinned entries, the one
+# last put on the install at installation_path and folders the object store
+# doesn't know are never removed.
+
+CONFIG_PATH = os.path.join("storage", "config.json")
+
+_lock = threading.Lock()
+
+
+def load_config() -> dict:
+    try:
+        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def limits(quota: dict, group: str) -> tuple:
+    """(count, bytes) allowed for a platform's versions or for "backups"; None is no limit."""
+    own = quota.get(group) if isinstance(quota.get(group), dict) else {}
+    return own.get("count", quota.get("count")), own.get("bytes", quota.get("bytes"))
+
+
+def mark_used(kind: str, name: str, installation_path: str) -> bool:
+    """Remember that kind/name was just restored or downgraded to at installation_path."""
+    return store.update_tree(kind, name, used=time.time(),
+                             installed_at=os.path.abspath(installation_path)) is not None
+
+
+def set_pinned(kind: str, name: str, pinned: bool) -> bool:
+    """Pin or unpin kind/name; False if it isn't in the object store."""
+    return store.update_tree(kind, name, pinned=pinned) is not None
+
+
+def _over(usage: dict, count: Optional[int], size: Optional[int]) -> bool:
+    return (count is not None and usage["count"] > count) or (size is not None and usage["stored"] > size)
+
+
+def enforce(config: Optional[dict] = None, keep: Optional[tuple] = None) -> list:
+    """Remove versions/backups until every group is within its quota. Returns the removed catalog entries.
+
+    config defaults to storage/config.json; keep is a (kind, name) that stays
+    whatever it costs, normally what was just stored. A group that is still
+    over once only protected entries are left is left as it is.
+    """
+    config = load_config() if config is None else config
+    quota = config.get("quota") or {}
+    if not quota:
+        return []
+
+    removed = []
+    with _lock:
+        catalog.refresh_stale()
+        protected = {keep} if keep else set()
+        if config.get("installation_path"):
+            current = catalog.installed(config["installation_path"])
+            if current:
+                protected.add((current["kind"], current["name"]))
+
+        groups = [("versions", platform, platform) for platform in catalog.platforms()]
+        groups.append(("backups", None, "backups"))
+        for kind, platform, group in groups:
+            count, size = limits(quota, group)
+            if count is None and size is None:
+                continue
+            candidates = [entry for entry in catalog.entries(kind, platform, order="used")
+                          if not entry["pinned"] and entry["content_hash"] is not None
+                          and (kind, entry["name"]) not in protected]
+            while candidates and _over(catalog.usage(kind, platform), count, size):
+                entry = candidates.pop(0)
+                store.remove_tree(kind, entry["name"], entry["path"], collect=False)
+                removed.append(entry)
+        if removed:
+            store.gc()
+    return removed
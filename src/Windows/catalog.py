@@ -0,0 +1,421 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+# Catalog of every stored version and backup in storage/catalog.sqlite3, so
+# menus can list, sort and total them with one query instead of walking
+# versions/ and backups/. Rows are written when store.py saves or removes a
+# tree and checked against the disk lazily: refresh_stale() stats each row's
+# folder and picks up folders the catalog doesn't know (versions copied in by
+# hand, or from before the object store) at most once per VERIFY_AGE, and
+# verify() checks a single entry right before it is used.
+# used, installed_at and pinned come from the tree (see quota.py); folders
+# without one are never used or pinned.
+
+CATALOG_PATH = os.path.join("storage", "catalog.sqlite3")
+ROOTS = {"versions": "versions", "backups": "backups"}
+VERIFY_AGE = 60 * 60
+SCHEMA_VERSION = 4
+# Release dates come as whatever the manifest list has; they are sorted by
+# released, the date parsed with these, and entries without one come last
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%m/%d/%Y", "%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%d %b %Y")
+ORDERS = {
+    "name": "name",
+    "created": "created",
+    "-created": "created DESC",
+    "date": "released IS NULL, released, name",
+    "-date": "released IS NULL, released DESC, name DESC",
+    "bytes": "bytes DESC, name",
+    # Least recently restored/downgraded to first; never used counts from when it was stored
+    "used": "COALESCE(used, created), name",
+}
+
+_db = None
+_lock = threading.RLock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _db
+    if _db is not None:
+        return _db
+    os.makedirs(os.path.dirname(CATALOG_PATH), exist_ok=True)
+    db = sqlite3.connect(CATALOG_PATH, timeout=30, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    try:
+        # Lets rewind.py, manager.py and the GUIs read while one of them writes
+        db.execute("PRAGMA journal_mode=WAL")
+    except sqlite3.Error:
+        pass
+    if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        db.executescript("""
+            DROP TABLE IF EXISTS entries;
+            DROP TABLE IF EXISTS contents;
+            DROP TABLE IF EXISTS info;
+            DROP TABLE IF EXISTS digests;
+            CREATE TABLE entries (
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                platform TEXT,
+                manifest_id TEXT,
+                manifest_date TEXT,
+                released REAL,
+                profile TEXT,
+                path TEXT NOT NULL,
+                source TEXT,
+                files INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                content_hash TEXT,
+                created REAL NOT NULL,
+                dir_mtime REAL,
+                checked REAL NOT NULL,
+                used REAL,
+                installed_at TEXT,
+                pinned INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (kind, name)
+            );
+            CREATE TABLE contents (
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (kind, name, digest)
+            );
+            CREATE INDEX contents_digest ON contents (digest);
+            CREATE TABLE info (key TEXT PRIMARY KEY, value);
+            CREATE TABLE digests (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                algo TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (device, inode, algo)
+            );
+        """)
+        db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        db.commit()
+    _db = db
+    return db
+
+
+def _info(db: sqlite3.Connection, key: str, default=None):
+    row = db.execute("SELECT value FROM info WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_info(db: sqlite3.Connection, key: str, value):
+    db.execute("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", (key, value))
+
+
+def content_hash(files: dict) -> str:
+    """One digest for a whole tree: two trees with the same files have the same hash."""
+    h = hashlib.sha1()
+    for rel in sorted(files):
+        entry = files[rel]
+        h.update(f"{rel}\0{entry.get('digest') or '->' + entry.get('link', '')}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def parse_date(text: Optional[str]) -> Optional[datetime]:
+    """A release date from the manifest list as a naive UTC datetime, None if it can't be read."""
+    text = (text or "").strip()
+    try:
+        date = datetime.fromisoformat(text)
+    except ValueError:
+        date = None
+        for fmt in DATE_FORMATS:
+            try:
+                date = datetime.strptime(text, fmt)
+                break
+            except ValueError:
+                continue
+    if date is not None and date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def _released(text: Optional[str]) -> Optional[float]:
+    date = parse_date(text)
+    return (date - datetime(1970, 1, 1)).total_seconds() if date else None
+
+
+def _split_name(kind: str, name: str) -> tuple:
+    if kind == "versions" and "/" in name:
+        platform, manifest_id = name.split("/", 1)
+        return platform, manifest_id
+    return None, None
+
+
+def _dir_mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _listed_dates() -> dict:
+    """{(platform, manifest id): date} from the cached manifest list"""
+    import manifests
+    return {(platform, version.get("id")): version.get("date")
+            for platform, versions in manifests.load_cached()[0].items() if isinstance(versions, list)
+            for version in versions if isinstance(version, dict)}
+
+
+def _record(db: sqlite3.Connection, tree: dict, dates: Optional[dict] = None):
+    kind, name = tree["kind"], tree["name"]
+    platform, manifest_id = _split_name(kind, name)
+    date = tree.get("date")
+    if date is None and platform and dates is not None:
+        date = dates.get((platform, manifest_id))
+    files = tree["files"]
+    digests = {}
+    for entry in files.values():
+        if "digest" in entry:
+            digests[entry["digest"]] = entry.get("size", 0)
+    db.execute("DELETE FROM contents WHERE kind = ? AND name = ?", (kind, name))
+    db.executemany("INSERT INTO contents (kind, name, digest, size) VALUES (?, ?, ?, ?)",
+                   [(kind, name, digest, size) for digest, size in digests.items()])
+    db.execute(
+        "INSERT OR REPLACE INTO entries (kind, name, platform, manifest_id, manifest_date, released, profile, path, "
+        "source, files, bytes, content_hash, created, dir_mtime, checked, used, installed_at, pinned) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (kind, name, platform, manifest_id, date, _released(date), tree.get("profile"), tree["path"],
+         tree.get("source"), len(files), sum(entry.get("size", 0) for entry in files.values()), content_hash(files),
+         tree["created"], _dir_mtime(tree["path"]), time.time(), tree.get("used"), tree.get("installed_at"),
+         int(bool(tree.get("pinned")))))
+
+
+def _folder_stats(path: str) -> tuple:
+    """(files, bytes, mtime) of a folder the object store doesn't know, counted from disk"""
+    import store
+    count = size = 0
+    for _, full in store.walk_files(path):
+        count += 1
+        try:
+            size += os.lstat(full).st_size
+        except OSError:
+            pass
+    return count, size, _dir_mtime(path)
+
+
+def _record_folder(db: sqlite3.Connection, kind: str, name: str, path: str, stats: tuple,
+                   dates: Optional[dict] = None):
+    platform, manifest_id = _split_name(kind, name)
+    count, size, mtime = stats
+    date = (dates or {}).get((platform, manifest_id))
+    db.execute("DELETE FROM contents WHERE kind = ? AND name = ?", (kind, name))
+    db.execute(
+        "INSERT OR REPLACE INTO entries (kind, name, platform, manifest_id, manifest_date, released, profile, path, "
+        "source, files, bytes, content_hash, created, dir_mtime, checked) VALUES (?, ?, ?, ?, ?, ?, NULL, ?, NULL, "
+        "?, ?, NULL, ?, ?, ?)",
+        (kind, name, platform, manifest_id, date, _released(date), path, count, size, mtime or time.time(), mtime,
+         time.time()))
+
+
+def _forget(db: sqlite3.Connection, kind: str, name: str):
+    db.execute("DELETE FROM entries WHERE kind = ? AND name = ?", (kind, name))
+    db.execute("DELETE FROM contents WHERE kind = ? AND name = ?", (kind, name))
+
+
+def record(tree: dict):
+    """Add or update the entry of a tree store.py just saved."""
+    with _lock:
+        try:
+            db = _connect()
+            _record(db, tree)
+            db.commit()
+        except sqlite3.Error:
+            # The store is what matters; the next refresh_stale() rescans
+            _mark_stale()
+
+
+def forget(kind: str, name: str):
+    with _lock:
+        try:
+            db = _connect()
+            _forget(db, kind, name)
+            db.commit()
+        except sqlite3.Error:
+            _mark_stale()
+
+
+def _mark_stale():
+    try:
+        db = _connect()
+        db.rollback()
+        _set_info(db, "scanned", 0)
+        db.commit()
+    except sqlite3.Error:
+        pass
+
+
+def rescan():
+    """Rebuild the catalog from the saved trees and the folders in ROOTS.
+
+    The disk is read before the catalog is locked, so listings from other
+    threads keep working while this runs.
+    """
+    import store
+    dates = _listed_dates()
+    trees = [tree for tree in store.iter_trees()
+             if tree.get("kind") in ROOTS and os.path.isdir(tree.get("path", ""))]
+    known = {(tree["kind"], tree["name"]) for tree in trees}
+
+    folders = []
+    for kind, root in ROOTS.items():
+        if not os.path.isdir(root):
+            continue
+        # versions/<platform>/<manifest>, backups/<name>
+        parents = [(p, f"{p}/") for p in sorted(os.listdir(root))] if kind == "versions" else [("", "")]
+        for folder, prefix in parents:
+            parent = os.path.join(root, folder) if folder else root
+            if not os.path.isdir(parent):
+                continue
+            for entry in sorted(os.listdir(parent)):
+                path = os.path.join(parent, entry)
+                if os.path.isdir(path) and (kind, prefix + entry) not in known:
+                    folders.append((kind, prefix + entry, path, _folder_stats(path)))
+                    known.add((kind, prefix + entry))
+
+    with _lock:
+        db = _connect()
+        for tree in trees:
+            _record(db, tree, dates)
+        for kind, name, path, stats in folders:
+            _record_folder(db, kind, name, path, stats, dates)
+        for row in db.execute("SELECT kind, name FROM entries").fetchall():
+            if (row["kind"], row["name"]) not in known:
+                _forget(db, row["kind"], row["name"])
+        _set_info(db, "scanned", time.time())
+        db.commit()
+
+
+def refresh_stale(max_age: float = VERIFY_AGE) -> bool:
+    """Rescan if the catalog is new or wasn't checked against the disk for max_age seconds."""
+    try:
+        with _lock:
+            if time.time() - float(_info(_connect(), "scanned", 0)) < max_age:
+                return False
+        rescan()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def verify(kind: str, name: str) -> Optional[dict]:
+    """The entry of kind/name after checking its folder still exists and is unchanged.
+
+    A folder that is gone is dropped from the catalog (None is returned); one
+    whose modification time changed is recorded again from its tree.
+    """
+    import store
+    with _lock:
+        db = _connect()
+        row = db.execute("SELECT * FROM entries WHERE kind = ? AND name = ?", (kind, name)).fetchone()
+        if row is None:
+            return None
+        mtime = _dir_mtime(row["path"])
+        if mtime is None or not os.path.isdir(row["path"]):
+            _forget(db, kind, name)
+        elif mtime != row["dir_mtime"]:
+            tree = store.load_tree(kind, name)
+            if tree and os.path.abspath(tree["path"]) == os.path.abspath(row["path"]):
+                _record(db, tree, _listed_dates())
+            else:
+                _record_folder(db, kind, name, row["path"], _folder_stats(row["path"]), _listed_dates())
+        else:
+            db.execute("UPDATE entries SET checked = ? WHERE kind = ? AND name = ?", (time.time(), kind, name))
+        db.commit()
+        return get(kind, name)
+
+
+def get(kind: str, name: str) -> Optional[dict]:
+    with _lock:
+        row = _connect().execute("SELECT * FROM entries WHERE kind = ? AND name = ?", (kind, name)).fetchone()
+    return dict(row) if row else None
+
+
+def entries(kind: str, platform: Optional[str] = None, source: Optional[str] = None,
+            order: str = "name") -> list:
+    """Catalog rows of kind as dicts, optionally of one platform or source, sorted by one of ORDERS."""
+    query = "SELECT * FROM entries WHERE kind = ?"
+    args = [kind]
+    if platform is not None:
+        query += " AND platform = ?"
+        args.append(platform)
+    if source is not None:
+        query += " AND source = ?"
+        args.append(source)
+    query += f" ORDER BY {ORDERS[order]}"
+    with _lock:
+        return [dict(row) for row in _connect().execute(query, args).fetchall()]
+
+
+def platforms() -> list:
+    with _lock:
+        rows = _connect().execute(
+            "SELECT DISTINCT platform FROM entries WHERE kind = 'versions' AND platform IS NOT NULL ORDER BY platform"
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def usage(kind: Optional[str] = None, platform: Optional[str] = None) -> dict:
+    """Logical size of the versions and backups vs. bytes actually held on disk.
+
+    Files in the object store count once however many trees use them;
+    folders the store doesn't know count in full. kind and platform limit
+    the totals to some of the entries.
+    """
+    where, args = "1", []
+    if kind is not None:
+        where += " AND kind = ?"
+        args.append(kind)
+    if platform is not None:
+        where += " AND platform = ?"
+        args.append(platform)
+    with _lock:
+        db = _connect()
+        logical, count = db.execute(f"SELECT COALESCE(SUM(bytes), 0), COUNT(*) FROM entries WHERE {where}",
+                                    args).fetchone()
+        stored = db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM contents "
+            f"WHERE (kind, name) IN (SELECT kind, name FROM entries WHERE {where}) GROUP BY digest)", args
+        ).fetchone()[0]
+        untracked = db.execute(
+            f"SELECT COALESCE(SUM(bytes), 0) FROM entries WHERE content_hash IS NULL AND {where}", args
+        ).fetchone()[0]
+    return {"logical": logical, "stored": stored + untracked, "count": count}
+
+
+def installed(path: str) -> Optional[dict]:
+    """The entry last restored or downgraded to the install at path, if any."""
+    with _lock:
+        row = _connect().execute("SELECT * FROM entries WHERE installed_at = ? ORDER BY used DESC LIMIT 1",
+                                 (os.path.abspath(path),)).fetchone()
+    return dict(row) if row else None
+
+
+def cached_digests(algo: str) -> dict:
+    """{(device, inode): (size, mtime_ns, digest)} of files hashed with algo before."""
+    with _lock:
+        rows = _connect().execute("SELECT device, inode, size, mtime_ns, digest FROM digests WHERE algo = ?",
+                                  (algo,)).fetchall()
+    return {(row[0], row[1]): (row[2], row[3], row[4]) for row in rows}
+
+
+def save_digests(algo: str, digests: list):
+    """Remember (device, inode, size, mtime_ns, digest) tuples for cached_digests()."""
+    with _lock:
+        db = _connect()
+        try:
+            db.executemany("INSERT OR REPLACE INTO digests (device, inode, algo, size, mtime_ns, digest) "
+                           "VALUES (?, ?, ?, ?, ?, ?)",
+                           [(device, inode, algo, size, mtime_ns, digest)
+                            for device, inode, size, mtime_ns, digest in digests])
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
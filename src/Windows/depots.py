@@ -0,0 +1,33 @@
+from typing import Optional
+
+import store
+
+# WorldBox's depots and the file profiles a version can be downloaded with.
+# steam.py re-exports all of this; it lives here so the CLIs can build their
+# menus and options without importing asyncio and the SteamCMD machinery.
+
+APP_ID = "1206560"
+PLATFORM_DEPOTS = {
+    "Windows": "1206561",
+    "Linux": "1206562",
+    "Mac": "1206563"
+}
+DEPOT_PLATFORMS = {v: k for k, v in PLATFORM_DEPOTS.items()}
+
+# Named subsets of the depot, for when only the game's assemblies are needed
+# (mod work). Lines are exact depot paths or "regex:" patterns; steam.py
+# matches them against the depot's file list and hands SteamCMD the plain
+# paths in download_depot's filelist. Separators are matched both ways because the
+# Windows depot lists its paths with backslashes, and the Mac build keeps
+# its data in worldbox.app/Contents/Resources/Data.
+FILE_PROFILES = {
+    "managed-only": (
+        r"regex:(^|[\\/])(worldbox_Data|Data)[\\/]Managed[\\/][^\\/]+\.dll$",
+        r"regex:(^|[\\/])(worldbox_Data|Data)[\\/](boot\.config|RuntimeInitializeOnLoads\.json|ScriptingAssemblies\.json)$",
+    ),
+}
+
+
+def version_profile(platform: str, manifest_id: str) -> Optional[str]:
+    """The file profile a stored version was downloaded with, None for a full version."""
+    return (store.load_tree("versions", f"{platform}/{manifest_id}") or {}).get("profile")
@@ -1,5 +1,4 @@
 import os
-import subprocess
 import time
 from typing import Optional
 import typer
@@ -9,33 +8,24 @@ from rich.panel import Panel
 from rich.console import Console
 from rich.table import Table
 from rich.theme import Theme
+from rich.filesize import decimal
 import shutil
-import re
 import json
 import getpass
-import threading
-import requests
+import manifests
+import catalog
+import depots
+import downloads
+import debuglog
 
 
 DEBUG_MODE = True
 DEBUG_FOLDER = "steamdb_debug"
 VERSIONS_DIR = "versions"
 CONFIG_PATH = os.path.join("storage", "config.json")
-MANIFESTS_URL = "https://gmblahaj.xyz/pages/manifests.json"  
-MANIFESTS_CACHE = os.path.join("storage", "manifests_cache.json")
 
-PLATFORM_DEPOTS = {
-    "Windows": "1206561",
-    "Linux": "1206562",
-    "Mac": "1206563"
-}
-DEPOT_PLATFORMS = {v: k for k, v in PLATFORM_DEPOTS.items()}
-APP_ID = "1206560"
-
-os.makedirs(DEBUG_FOLDER, exist_ok=True)
-os.makedirs("storage", exist_ok=True)
-for folder in PLATFORM_DEPOTS.keys():
-    os.makedirs(os.path.join(VERSIONS_DIR, folder), exist_ok=True)
+PLATFORM_DEPOTS = depots.PLATFORM_DEPOTS
+DEPOT_PLATFORMS = depots.DEPOT_PLATFORMS
 
 
 custom_theme = Theme({
@@ -57,28 +47,11 @@ app = typer.Typer()
 console = Console(theme=custom_theme)
 
 
-def get_manifest_data() -> dict:
-    """Fetch manifest data from URL or cache"""
+def get_manifest_data(offline: bool = False, force: bool = False) -> dict:
+    """Fetch manifest data from cache, revalidating it when it's older than the configured TTL"""
+    ttl = load_config().get("manifests_ttl", manifests.DEFAULT_TTL)
     try:
-        
-        if os.path.exists(MANIFESTS_CACHE):
-            with open(MANIFESTS_CACHE, "r", encoding="utf-8") as f:
-                cached_data = json.load(f)
-                if cached_data:
-                    debug_log("Loaded manifests from cache")
-                    return cached_data
-        
-        
-        debug_log("Fetching manifests from remote URL")
-        response = requests.get(MANIFESTS_URL)
-        response.raise_for_status()
-        data = response.json()
-        
-        
-        with open(MANIFESTS_CACHE, "w", encoding="utf-8") as f:
-            json.dump(data, f)
-        
-        return data
+        return manifests.get_manifest_data(ttl=ttl, offline=offline, force=force, log=debug_log)
     except Exception as e:
         debug_log(f"Error fetching manifest data: {e}")
         console.print(f"[error]Failed to fetch manifest data: {e}[/error]")
@@ -115,14 +88,85 @@ def show_version_menu(platform: str, manifest_data: dict) -> Optional[str]:
         except (ValueError, IndexError):
             console.print("[error]Invalid selection. Please try again.[/error]")
 
-def debug_log(message: str, save_to_file: bool = True):
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    full_msg = f"{timestamp} - {message}"
+def parse_selection(text: str, count: int) -> list:
+    """Turn '1,3,5-8' or 'all' into a sorted list of 1-based indexes"""
+    text = text.strip().lower()
+    if text == "all":
+        return list(range(1, count + 1))
+    selected = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            selected.update(range(int(start), int(end) + 1))
+        else:
+            selected.add(int(part))
+    if not selected or min(selected) < 1 or max(selected) > count:
+        raise ValueError(f"Selection out of range: {text}")
+    return sorted(selected)
+
+
+def stored_state(platform: str, manifest_id: str, verify: bool = False) -> str:
+    """'' if a version isn't stored, 'yes' if it is, 'partial (profile)' if only part of it is.
+
+    Answered from the catalog; verify=True checks the version's folder first.
+    """
+    name = f"{platform}/{manifest_id}"
+    entry = catalog.verify("versions", name) if verify else catalog.get("versions", name)
+    if not entry or not entry["files"]:
+        return ""
+    return f"partial ({entry['profile']})" if entry["profile"] else "yes"
+
+
+def show_batch_menu(manifest_data: dict, profile: Optional[str] = None) -> list:
+    """Pick several versions, possibly across platforms, for a batch download"""
+    catalog.refresh_stale()
+    jobs = []
+    while True:
+        platform = DEPOT_PLATFORMS[show_platform_menu()]
+        versions = manifest_data.get(platform, [])
+        if not versions:
+            console.print(f"[error]No versions found for {platform}[/error]")
+        else:
+            console.print(Panel.fit(f"[title]Available {platform} Versions[/title]", border_style="blue"))
+            table = Table(show_header=True, header_style="bold magenta")
+            table.add_column("Option", style="dim", width=8)
+            table.add_column("Date", width=25)
+            table.add_column("Manifest ID", style="highlight")
+            table.add_column("Stored", width=22)
+            for i, version in enumerate(versions, start=1):
+                table.add_row(str(i), version["date"], version["id"], stored_state(platform, version["id"]))
+            console.print(table)
+
+            while True:
+                try:
+                    choice = Prompt.ask("Select versions (e.g. 1,3,5-8 or all)")
+                    indexes = parse_selection(choice, len(versions))
+                    break
+                except ValueError:
+                    console.print("[error]Invalid selection. Please try again.[/error]")
+
+            for i in indexes:
+                manifest_id = versions[i - 1]["id"]
+                stored = stored_state(platform, manifest_id, verify=True)
+                # A partial version is still worth queueing when the full one is wanted
+                if stored == "yes" or (stored and profile):
+                    debug_log(f"Skipping stored version {platform} {manifest_id}")
+                    continue
+                if (platform, manifest_id) not in [job[:2] for job in jobs]:
+                    jobs.append((platform, manifest_id, profile))
+
+        if not Confirm.ask("Queue versions from another platform?", default=False):
+            return jobs
+
+
+def debug_log(message: str, save_to_file: bool = True, **fields):
     if DEBUG_MODE:
-        console.print(f"[debug]{full_msg}[/debug]")
+        console.print(f"[debug]{time.strftime('%Y-%m-%d %H:%M:%S')} - {message}[/debug]")
         if save_to_file:
-            with open(os.path.join(DEBUG_FOLDER, f"debug_log_{time.strftime('%Y%m%d')}.txt"), "a", encoding="utf-8") as f:
-                f.write(full_msg + "\n")
+            debuglog.open_log(DEBUG_FOLDER, "rewind").write(message, **fields)
 
 def load_config() -> dict:
     if os.path.exists(CONFIG_PATH):
@@ -131,6 +175,7 @@ def load_config() -> dict:
     return {}
 
 def save_config(config: dict):
+    os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
     with open(CONFIG_PATH, "w", encoding="utf-8") as f:
         json.dump(config, f, indent=4)
 
@@ -165,131 +210,207 @@ def show_platform_menu() -> str:
             debug_log(f"User selected: {selected} (Depot: {PLATFORM_DEPOTS[selected]})")
             return PLATFORM_DEPOTS[selected]
 
-def enableoutput(line: str) -> bool:
-    skip_patterns = [
-        r"\[\s*\d%\]", r"\(\d.*(?:von|of).*\)",
-        r"Redirecting stderr to", r"Logging directory:",
-        r"UpdateUI: skip show logo", r"^\s*$",
-        r"KeyValues Error", r"src/tier1/KeyValues.cpp"
-    ]
-    return not any(re.search(pattern, line) for pattern in skip_patterns)
-
-def safe_move(src_dir: str, dest_dir: str):
-    for item in os.listdir(src_dir):
-        s, d = os.path.join(src_dir, item), os.path.join(dest_dir, item)
-        if os.path.exists(d):
-            if os.path.isdir(d):
-                shutil.rmtree(d)
-            else:
-                os.remove(d)
-        shutil.move(s, d)
-
 def abort(message: str = "Aborted."):
     console.print(f"[warning]{message}[/warning]")
     raise typer.Exit(1)
 
-def steamcmd(username: str, password: Optional[str], manifest_id: str, depot_id: str):
-    debug_log(f"Preparing SteamCMD for manifest {manifest_id} (depot {depot_id})")
-    platform_folder = DEPOT_PLATFORMS.get(depot_id, "Unknown")
-    version_path = os.path.join(VERSIONS_DIR, platform_folder, manifest_id)
-    os.makedirs(version_path, exist_ok=True)
-
-    steamcmd_path = "utils/steamcmd.exe" if os.path.exists("utils/steamcmd.exe") else "steamcmd"
-    command = [steamcmd_path, "+login", username]
-    if password:
-        command.append(password)
-    command.extend([
-        "+download_depot", APP_ID, depot_id, manifest_id,
-        "+quit"
-    ])
-    debug_log(f"Executing: {' '.join(command)}")
-    console.print("[info]Running SteamCMD...[/info]")
-
-    depot_download_path = None
-    steam_guard_sent = False
-
-    def send_flush_after_timeout(proc):
-        nonlocal steam_guard_sent
-        time.sleep(10)
-        if proc.poll() is None and proc.stdin:
-            try:
-                proc.stdin.write("\n")
-                proc.stdin.flush()
-                steam_guard_sent = True
-                debug_log("Sent empty line to SteamCMD to flush potential Steam Guard prompt.")
-            except Exception as e:
-                debug_log(f"Failed to flush input to SteamCMD: {e}")
-
+class SteamDisplay:
+    """One Rich progress display for every SteamCMD job of a download.
+
+    Events only update the tasks; Rich redraws a few times per second, so a
+    chatty SteamCMD costs a handful of renders instead of one print per line.
+    """
+
+    def __init__(self):
+        self._progress = None
+        self.tasks = {}
+        self.totals = {}
+        self.current = None
+        self.running = False
+
+    @property
+    def progress(self):
+        # Built on first use so starting Rewind doesn't pay for rich.progress
+        if self._progress is None:
+            from rich.progress import Progress, BarColumn, TextColumn, DownloadColumn, TransferSpeedColumn
+            self._progress = Progress(
+                TextColumn("[highlight]{task.description}"),
+                BarColumn(),
+                "[progress.percentage]{task.percentage:>3.0f}%",
+                DownloadColumn(),
+                TransferSpeedColumn(),
+                TextColumn("[steamcmd]{task.fields[status]}"),
+                console=console,
+                refresh_per_second=4
+            )
+        return self._progress
+
+    def add_job(self, job: tuple):
+        if job not in self.tasks:
+            self.tasks[job] = self.progress.add_task(f"{job[0]} {job[1]}", total=None, status="queued")
+
+    def __enter__(self):
+        self.progress.start()
+        self.running = True
+        return self
+
+    def __exit__(self, *exc):
+        self.progress.stop()
+        self.running = False
+        for task in self.tasks.values():
+            self.progress.remove_task(task)
+        self.tasks.clear()
+        self.totals.clear()
+        self.current = None
+        return False
+
+    def ask(self, prompt: str) -> str:
+        """Prompt.ask with the live display out of the way"""
+        if self.running:
+            self.progress.stop()
+        try:
+            return Prompt.ask(prompt)
+        finally:
+            if self.running:
+                self.progress.start()
+
+    def set_status(self, job, status: str, **fields):
+        task = self.tasks.get(job or self.current or next(iter(self.tasks), None))
+        if task is not None:
+            self.progress.update(task, status=status[:60], **fields)
+
+    def handle(self, event: dict):
+        kind = event["type"]
+        job = event.get("job")
+        if kind == "progress":
+            self.totals[job] = event["total"]
+            self.set_status(job, "downloading", completed=event["current"], total=event["total"])
+        elif kind == "line":
+            self.set_status(job, event["line"])
+        elif kind == "login":
+            console.print("[info]Logged in to Steam.[/info]")
+        elif kind == "started":
+            self.current = job
+            self.set_status(job, "downloading")
+        elif kind == "downloaded":
+            total = self.totals.get(job)
+            self.set_status(job, "storing files", **({"completed": total} if total else {}))
+        elif kind == "done":
+            self.set_status(job, "saved")
+            fetched = event["downloaded_bytes"]
+            rate = decimal(int(fetched / max(event["seconds"], 0.001)))
+            reused = f", {decimal(event['bytes'] - fetched)} reused" if fetched < event["bytes"] else ""
+            console.print(f"[success]Saved version to: {event['path']}[/success] "
+                          f"[info]({decimal(event['bytes'])}: {decimal(fetched)} downloaded in "
+                          f"{event['seconds']:.0f}s, {rate}/s{reused})[/info]")
+        elif kind == "resumed":
+            console.print(f"[info]Resuming {job[0]} {job[1]} from the files already downloaded.[/info]")
+        elif kind == "seeded":
+            self.set_status(job, f"seeded from {event['seed']}")
+            console.print(f"[info]Starting {job[0]} {job[1]} from stored version {event['seed']} "
+                          f"({event['files']} files, {decimal(event['bytes'])}).[/info]")
+        elif kind == "unseeded":
+            self.set_status(job, "validating")
+            console.print(f"[warning]{job[0]} {job[1]}: SteamCMD left no depot manifest to sort out the stored "
+                          f"version's files by; validating the download without them ({event['files']} removed)."
+                          f"[/warning]")
+        elif kind == "retry":
+            self.set_status(job, f"{event['kind']} error, retrying in {event['delay']}s")
+            console.print(f"[warning]{job[0]} {job[1]}: {event['error']} - retry {event['attempt']} "
+                          f"in {event['delay']}s[/warning]")
+        elif kind == "failed":
+            platform, manifest_id = job
+            self.set_status(job, "failed")
+            console.print(f"[error]{platform} {manifest_id} failed: {event['error']}[/error]")
+        elif kind == "evicted":
+            console.print(f"[info]Storage quota: removed {', '.join(event['names'])}.[/info]")
+        elif kind == "idle":
+            console.print("[info]SteamCMD was idle, logged out.[/info]")
+        elif kind == "reconnect":
+            console.print("[warning]Reconnecting to Steam...[/warning]")
+
+
+display = SteamDisplay()
+
+
+def on_steam_event(event: dict):
+    if event["type"] == "line":
+        debug_log(f"SteamCMD: {event['line']}", job=event.get("job"))
+    elif event["type"] != "progress":
+        debug_log(f"SteamCMD event: {event['type']}", event=event)
+    display.handle(event)
+
+
+def ask_guard() -> str:
+    return display.ask("Enter Steam Guard code (even if already approved)")
+
+
+def get_concurrency(parallel: Optional[int] = None) -> int:
+    if parallel is not None:
+        return max(1, parallel)
+    return max(1, int(load_config().get("download_concurrency", len(PLATFORM_DEPOTS))))
+
+
+def start_worker(username: str, password: Optional[str], concurrency: int = 1) -> "steam.SteamPool":
+    """Start the SteamCMD sessions that stay logged in for every download of this run"""
+    # asyncio and the session code are only loaded once there is something to download
+    import steam
+    debug_log(f"Starting up to {concurrency} SteamCMD sessions for {username}")
     console.print(Panel.fit(
         "[bold yellow]If Steam Guard is enabled, approve the login on your Steam Mobile App or email.[/bold yellow]\n\n"
         "This process may take a few minutes. Output will be shown below:",
         border_style="cyan"
     ))
-
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        stdin=subprocess.PIPE,
-        text=True,
-        encoding="utf-8",
-        errors="replace"
-    )
-
-    threading.Thread(target=send_flush_after_timeout, args=(process,), daemon=True).start()
-
-    while True:
-        if process.stdout is None:
-            break
-        output = process.stdout.readline()
-        if output == "" and process.poll() is not None:
-            break
-        if output:
-            line = output.strip()
-            debug_log(f"SteamCMD: {line}")
-            if "Steam Guard code" in line or "Steam Guard" in line:
-                try:
-                    steamguard_code = Prompt.ask("Enter Steam Guard code (even if already approved)")
-                    if steamguard_code and process.stdin:
-                        process.stdin.write(steamguard_code + "\n")
-                        process.stdin.flush()
-                except Exception as e:
-                    debug_log(f"Steam Guard input failed: {e}")
-            elif "Depot download complete" in line:
-                match = re.search(r'Depot download complete : "([^"]+)"', line)
-                if match:
-                    depot_download_path = re.sub(r'\\', '/', match.group(1))
-                    debug_log(f"Download path: {depot_download_path}")
-            elif enableoutput(line):
-                console.print(f"[steamcmd]{line}[/steamcmd]")
-
-    return_code = process.poll()
-    debug_log(f"SteamCMD exited with code {return_code}")
-
-    if return_code != 0:
-        console.print("[error]SteamCMD failed.[/error]")
-        raise typer.Exit(1)
-
-    if depot_download_path and os.path.exists(depot_download_path):
-        debug_log(f"Moving files to {version_path}")
-        try:
-            safe_move(depot_download_path, version_path)
-            console.print(f"[success]Saved version to: {version_path}[/success]")
-            input("\nPress Enter to continue...")
-            try:
-                shutil.rmtree(os.path.dirname(depot_download_path))
-                debug_log(f"Cleaned up: {os.path.dirname(depot_download_path)}")
-            except Exception as e:
-                debug_log(f"Cleanup failed: {e}")
-        except Exception as e:
-            console.print(f"[error]Failed to move files: {e}[/error]")
-            debug_log(f"Move error: {e}")
+    return steam.SteamPool(username, password, ask_guard, on_steam_event, concurrency)
+
+
+def steamcmd(worker: "steam.SteamPool", platform: str, manifest_id: str, profile: Optional[str] = None) -> dict:
+    debug_log(f"Queueing manifest {manifest_id} ({platform}, {profile or 'full'})")
+    display.add_job((platform, manifest_id))
+    with display:
+        result = worker.submit(platform, manifest_id, profile).result()
+    debug_log(f"Result {platform} {manifest_id}: {result}")
+    return result
+
+
+def steamcmd_batch(worker: "steam.SteamPool", jobs: list) -> dict:
+    import steam
+    debug_log(f"Batch download of {len(jobs)} versions: {jobs}")
+    sessions = min(len(jobs), len(worker.workers))
+    console.print(f"[info]Downloading {len(jobs)} versions, {sessions} at a time.[/info]")
+    for job in jobs:
+        display.add_job(tuple(job[:2]))
+    with display:
+        results = steam.run_batch(worker.username, worker.password, jobs, on_steam_event, ask_guard, worker=worker)
+    done = [r for r in results.values() if r["status"] == "done"]
+    total = sum(r["bytes"] for r in done)
+    fetched = sum(r["downloaded_bytes"] for r in done)
+    console.print(f"[info]{len(done)}/{len(jobs)} versions downloaded ({decimal(total)}, "
+                  f"{decimal(fetched)} of it from Steam).[/info]")
+    return results
+
+
+def resume_unfinished(worker: "steam.SteamPool"):
+    """Offer to finish the downloads an earlier run was interrupted in or gave up on"""
+    jobs = downloads.unfinished()
+    if not jobs:
+        return
+    names = ", ".join(f"{platform} {manifest_id}" + (f" ({profile})" if profile else "")
+                      for platform, manifest_id, profile in jobs)
+    if Confirm.ask(f"[warning]{len(jobs)} unfinished download(s) from an earlier run: {names}. Resume them?[/warning]",
+                   default=True):
+        steamcmd_batch(worker, jobs)
     else:
-        console.print(f"[error]Download path not found: {depot_download_path}[/error]")
+        for job in jobs:
+            downloads.forget(job)
 
 
 @app.command()
-def main():
+def main(offline: bool = typer.Option(False, help="Don't touch the network, use the cached manifest list"),
+         refresh: bool = typer.Option(False, help="Revalidate the cached manifest list before showing it"),
+         batch: bool = typer.Option(False, help="Queue several versions and download them with a single login"),
+         parallel: Optional[int] = typer.Option(None, help="SteamCMD sessions downloading at once in batch mode (default: download_concurrency in the config, 3)"),
+         profile: Optional[str] = typer.Option(None, help=f"Only download a named set of files as a partial version ({', '.join(depots.FILE_PROFILES)})")):
     debug_log("Script started")
     console.print(Panel.fit("[success]WorldBox Rewind[/success]", border_style="green"))
 
@@ -297,8 +418,12 @@ def main():
         console.print("[error]steamcmd not found. Ensure it exists at utils/steamcmd.exe or in your PATH.[/error]")
         raise typer.Exit(1)
 
+    if profile is not None and profile not in depots.FILE_PROFILES:
+        console.print(f"[error]Unknown profile {profile}. Choose from: {', '.join(depots.FILE_PROFILES)}[/error]")
+        raise typer.Exit(1)
+
     try:
-        manifest_data = get_manifest_data()
+        manifest_data = get_manifest_data(offline=offline, force=refresh)
         if not manifest_data:
             abort("No manifest data available. Please check your connection or the manifest source.")
 
@@ -307,24 +432,49 @@ def main():
         if not password:
             console.print("[warning]No password entered. Attempting login without it...[/warning]")
 
-        depot_id = show_platform_menu()
-        platform_name = DEPOT_PLATFORMS.get(depot_id, "Unknown")
-        
-        manifest_id = show_version_menu(platform_name, manifest_data)
-        if not manifest_id:
-            abort("No version selected.")
-
-        version_path = os.path.join(VERSIONS_DIR, platform_name, manifest_id) # type: ignore
+        worker = start_worker(username, password or None, get_concurrency(parallel) if batch else 1)
 
-        if os.path.exists(version_path) and os.listdir(version_path):
-            overwrite = Confirm.ask(
-                f"[warning]Version {manifest_id} already exists. Redownload?[/warning]",
-                default=False
-            )
-            if not overwrite:
-                abort("Skipped existing version.")
-
-        steamcmd(username, password, manifest_id, depot_id)  # type: ignore
+        try:
+            resume_unfinished(worker)
+            if batch:
+                jobs = show_batch_menu(manifest_data, profile)
+                if not jobs:
+                    abort("Nothing to download.")
+                steamcmd_batch(worker, jobs)
+                return
+
+            while True:
+                depot_id = show_platform_menu()
+                platform_name = DEPOT_PLATFORMS.get(depot_id, "Unknown")
+
+                manifest_id = show_version_menu(platform_name, manifest_data)
+                if not manifest_id:
+                    abort("No version selected.")
+
+                stored = stored_state(platform_name, manifest_id, verify=True)  # type: ignore
+                if stored.startswith("partial") and not profile:
+                    # Upgrading only fetches what the partial version doesn't have
+                    wanted = Confirm.ask(f"[warning]Version {manifest_id} is stored as {stored}. "
+                                         f"Download the rest of it?[/warning]", default=True)
+                else:
+                    wanted = not stored or Confirm.ask(
+                        f"[warning]Version {manifest_id} already exists. Redownload?[/warning]",
+                        default=False
+                    )
+                if not wanted:
+                    console.print("[warning]Skipped existing version.[/warning]")
+                else:
+                    steamcmd(worker, platform_name, manifest_id, profile)  # type: ignore
+
+                # The session stays logged in, so the next download starts right away
+                if not Confirm.ask("Download another version?", default=False):
+                    break
+        except KeyboardInterrupt:
+            worker.cancel()
+            raise
+        finally:
+            with console.status("[info]Logging out of Steam...[/info]"):
+                worker.close()
     except KeyboardInterrupt:
         abort("Interrupted by user.")
     except Exception as e:
@@ -333,6 +483,8 @@ def main():
         raise typer.Exit(1)
     finally:
         debug_log("Script finished")
+        # typer.Exit and Ctrl+C end up here too; don't lose the last lines
+        debuglog.close_all()
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
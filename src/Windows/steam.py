@@ -0,0 +1,994 @@
+import os
+import re
+import codecs
+import shutil
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+import store
+import transfer
+import manifests
+import downloads
+import depotcache
+import quota
+import catalog
+from depots import APP_ID, PLATFORM_DEPOTS, DEPOT_PLATFORMS, FILE_PROFILES, version_profile
+
+VERSIONS_DIR = "versions"
+STAGING_DIR = os.path.join("storage", "staging")
+IDLE_TIMEOUT = 10 * 60
+STALL_TIMEOUT = 5 * 60
+DEFAULT_CONCURRENCY = len(PLATFORM_DEPOTS)
+# Waits before each retry of a download that failed for a reason that may go away
+RETRY_DELAYS = (5, 15, 45)
+RETRY_KINDS = ("network", "timeout")
+# download_depot <appid> <depotid> [<target manifestid>] [<delta manifestid>] [<depot flist>]:
+# a filelist only lands in its slot after a delta manifest, and there is none to diff against
+NO_DELTA_MANIFEST = "0"
+
+# Every SteamCMD line is classified by one precompiled pattern. Each branch is
+# a lookahead anchored at the start of the line, so the first branch that
+# matches anywhere in the line wins (a lost connection beats a failed
+# download, which beats plain output), and only one regex runs per line.
+OUTPUT_KINDS = (
+    ("lost", r"No Connection|Connection to Steam servers lost|Not logged on|Logged off"),
+    ("done", r'Depot download complete : "(?P<path>[^"]+)"'),
+    ("failed", r"ERROR! Download depot|Depot download failed"),
+    ("login_failed", r"FAILED \(|Login Failure|Invalid Password"),
+    ("guard", r"Steam Guard|Two-factor code"),
+    ("login", r"Waiting for user info\.\.\.OK|Logged in OK"),
+    ("progress", r"progress: (?P<percent>[\d.]+) \((?P<current>\d+) / (?P<total>\d+)\)"),
+    # SteamCMD's self-update progress and start-up chatter
+    ("noise", r"\[\s*\d+%\]|\(\d.*(?:von|of).*\)|Redirecting stderr to|Logging directory:|"
+              r"UpdateUI: skip show logo|KeyValues Error|src/tier1/KeyValues\.cpp|^\s*$"),
+)
+LINE_BREAK = re.compile(r"\r\n|\r|\n")
+OUTPUT_PATTERN = re.compile("|".join(f"^(?=.*?(?P<{kind}>{pattern}))" for kind, pattern in OUTPUT_KINDS))
+# Why a download or login failed, judged from SteamCMD's error line the same way
+FAILURE_KINDS = (
+    ("auth", r"Invalid Password|Access Denied|Account Logon Denied|Rate Limit|No subscription|"
+             r"Invalid Login|Two-factor|Expired"),
+    ("manifest", r"Invalid manifest|Manifest not available|Manifest .*not found|No match|Invalid depot|"
+                 r"File Not Found"),
+    ("network", r"No Connection|Timeout|Timed out|Service Unavailable|Connection|Network|Busy|Try Another CM|"
+                r"\(Failure\)"),
+)
+FAILURE_PATTERN = re.compile("|".join(f"^(?=.*?(?P<{kind}>{pattern}))" for kind, pattern in FAILURE_KINDS),
+                             re.IGNORECASE)
+
+
+def parse_line(line: str) -> dict:
+    """Turn one line of SteamCMD output into a typed event.
+
+    The "type" is one of the OUTPUT_KINDS or "line" for anything else;
+    "done" carries the depot "path", "progress" the "percent" and the
+    "current"/"total" byte counts. Every event keeps the raw "line".
+    """
+    match = OUTPUT_PATTERN.match(line)
+    if not match:
+        return {"type": "line", "line": line}
+    # The kind's group encloses the others, so it is the last one to close
+    kind = match.lastgroup
+    event = {"type": kind, "line": line}
+    if kind == "done":
+        event["path"] = match.group("path").replace("\\", "/")
+    elif kind == "progress":
+        event["percent"] = float(match.group("percent"))
+        event["current"] = int(match.group("current"))
+        event["total"] = int(match.group("total"))
+    return event
+
+
+def classify_failure(line: str) -> str:
+    """"auth", "manifest", "network" or "unknown" for a SteamCMD error line."""
+    match = FAILURE_PATTERN.match(line)
+    return match.lastgroup if match else "unknown"
+
+
+class DownloadError(Exception):
+    """A download that didn't finish. kind is one of FAILURE_KINDS, "timeout" or "unknown"."""
+
+    def __init__(self, message: str, kind: str = "unknown"):
+        super().__init__(message)
+        self.kind = kind
+
+
+class SessionError(DownloadError):
+    """The SteamCMD process died, lost its connection to Steam or stalled."""
+
+    def __init__(self, message: str, kind: str = "network"):
+        super().__init__(message, kind)
+
+
+class LoginError(DownloadError):
+    """Steam refused the login; retrying won't help."""
+
+    def __init__(self, message: str):
+        super().__init__(message, "auth")
+
+
+def steamcmd_executable() -> str:
+    return "utils/steamcmd.exe" if os.path.exists("utils/steamcmd.exe") else "steamcmd"
+
+
+def version_path(platform: str, manifest_id: str) -> str:
+    return os.path.join(VERSIONS_DIR, platform, manifest_id)
+
+
+def tree_size(path: str) -> int:
+    return sum(os.path.getsize(full) for _, full in store.walk_files(path))
+
+
+def stage_download(depot_path: str, platform: str, manifest_id: str) -> str:
+    """Move a finished depot out of SteamCMD's content folder so the next download can't touch it."""
+    staged = os.path.join(STAGING_DIR, f"{platform}-{manifest_id}")
+    if os.path.exists(staged):
+        shutil.rmtree(staged)
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    shutil.move(depot_path, staged)
+    return staged
+
+
+def depot_manifest(platform: str, manifest_id: str, install_dir: Optional[str] = None) -> Optional[dict]:
+    """The depotcache manifest SteamCMD kept for a download, parsed; None if there's none or it can't be read."""
+    path = depotcache.find(PLATFORM_DEPOTS[platform], manifest_id,
+                           depotcache.search_dirs(install_dir, steamcmd_executable()))
+    if path is None:
+        return None
+    try:
+        manifest = depotcache.load(path)
+    except (OSError, ValueError):
+        return None
+    if manifest["manifest_id"] not in (None, manifest_id):
+        return None
+    return manifest
+
+
+def profile_matcher(profile: str) -> Callable[[str], bool]:
+    """A test for whether a depot path (with / separators) belongs to a file profile."""
+    exact = set()
+    patterns = []
+    for line in FILE_PROFILES[profile]:
+        if line.startswith("regex:"):
+            patterns.append(re.compile(line[len("regex:"):]))
+        else:
+            exact.add(line.replace("\\", "/"))
+    return lambda rel: rel in exact or any(pattern.search(rel) for pattern in patterns)
+
+
+def download_command(platform: str, manifest_id: str, filelist: Optional[str] = None) -> str:
+    """The download_depot line for a manifest, fetching only the files listed in filelist if given."""
+    command = f"download_depot {APP_ID} {PLATFORM_DEPOTS[platform]} {manifest_id}"
+    if filelist:
+        command += f' {NO_DELTA_MANIFEST} "{filelist}"'
+    return command
+
+
+def known_paths(platform: str, manifest_id: str, install_dir: Optional[str] = None) -> list:
+    """Depot paths manifest_id probably has: from its own manifest if SteamCMD has it already, else the nearest version's."""
+    manifest = depot_manifest(platform, manifest_id, install_dir)
+    if manifest and not manifest["encrypted"]:
+        return [name for name, entry in manifest["files"].items() if not entry["flags"] & depotcache.FLAG_DIRECTORY]
+    tree = nearest_version(platform, manifest_id)
+    return list(tree["files"]) if tree else []
+
+
+def write_filelist(profile: str, paths: list, path: str, platform: str) -> Optional[str]:
+    """Write the paths that belong to profile to a download_depot filelist. None if there are none.
+
+    SteamCMD takes plain depot paths, one per line; the "regex:" lines of
+    FILE_PROFILES are DepotDownloader's, so they are matched here instead.
+    """
+    matches = profile_matcher(profile)
+    wanted = sorted(rel for rel in paths if matches(rel))
+    if not wanted:
+        return None
+    # Written the way the depot lists them
+    separator = "\\" if platform == "Windows" else "/"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(rel.replace("/", separator) + "\n" for rel in wanted))
+    return path
+
+
+def missing_files(depot_dir: str, profile: str, manifest: Optional[dict]) -> list:
+    """Depot paths of profile that manifest lists and depot_dir doesn't have; empty without a readable manifest."""
+    if not manifest or manifest["encrypted"]:
+        return []
+    matches = profile_matcher(profile)
+    return [name for name, entry in manifest["files"].items()
+            if matches(name) and not entry["flags"] & depotcache.FLAG_DIRECTORY
+            and not os.path.lexists(os.path.join(depot_dir, *name.split("/")))]
+
+
+def nearest_version(platform: str, manifest_id: str, manifest_data: Optional[dict] = None,
+                    full_only: bool = False) -> Optional[dict]:
+    """The tree of the stored version of platform released closest to manifest_id.
+
+    Distance is the difference between the dates in the manifest list (the
+    cached one unless manifest_data is given), or the distance in the list
+    when a date can't be read. A manifest that isn't listed (typed into the
+    GUI) gets the version of platform that was stored last. full_only skips
+    partial versions.
+    """
+
+    def usable(tree):
+        return tree and not (full_only and tree.get("profile"))
+
+    if manifest_data is None:
+        manifest_data = manifests.load_cached()[0]
+    versions = manifest_data.get(platform, [])
+    index = next((i for i, version in enumerate(versions) if version["id"] == manifest_id), None)
+    if index is None:
+        stored = [tree for tree in store.iter_trees()
+                  if tree["kind"] == "versions" and tree["name"].startswith(f"{platform}/") and usable(tree)]
+        return max(stored, key=lambda tree: tree["created"], default=None)
+    date = catalog.parse_date(versions[index].get("date"))
+
+    def distance(i):
+        other = catalog.parse_date(versions[i].get("date"))
+        if date and other:
+            return 0, abs((date - other).total_seconds())
+        return 1, abs(index - i)
+
+    # A redownload of a stored version is seeded from itself
+    for i in sorted(range(len(versions)), key=distance):
+        tree = store.load_tree("versions", f"{platform}/{versions[i]['id']}")
+        if usable(tree):
+            return tree
+    return None
+
+
+def layer_trees(trees: list) -> Optional[dict]:
+    """Trees stacked file by file, later ones winning; "seeds" lists their names."""
+    trees = [tree for tree in trees if tree]
+    if not trees:
+        return None
+    files = {}
+    for tree in trees:
+        files.update(tree["files"])
+    return dict(trees[-1], files=files, dirs=trees[0].get("dirs", []), seeds=[tree["name"] for tree in trees])
+
+
+def seed_tree(platform: str, manifest_id: str, profile: Optional[str] = None) -> Optional[dict]:
+    """What to put in SteamCMD's depot folder before downloading manifest_id.
+
+    Usually nearest_version(). Upgrading a partial version to the full one
+    starts from the closest full version with the partial one on top, so
+    nothing that is already stored is fetched again; a partial download
+    only gets the files of its profile.
+    """
+    tree = layer_trees([nearest_version(platform, manifest_id)])
+    if tree and tree.get("profile") and not profile:
+        tree = layer_trees([nearest_version(platform, manifest_id, full_only=True),
+                            store.load_tree("versions", tree["seeds"][-1])])
+    if tree and profile:
+        matches = profile_matcher(profile)
+        tree["files"] = {rel: entry for rel, entry in tree["files"].items() if matches(rel)}
+        tree["dirs"] = []
+    return tree
+
+
+def seed_depot(tree: dict, depot_dir: str) -> tuple:
+    """Fill depot_dir with a stored version so SteamCMD only fetches the files that differ.
+
+    Files are reflinked or copied, never hardlinked: SteamCMD rewrites
+    changed files in place, which would corrupt the shared objects.
+    Returns (files, bytes) placed.
+    """
+    if os.path.exists(depot_dir):
+        shutil.rmtree(depot_dir)
+    os.makedirs(depot_dir)
+    placed = [0, 0]
+    lock = threading.Lock()
+
+    def place(digest, dst, size):
+        try:
+            transfer.clone_file(store.object_path(digest), dst, "auto")
+        except OSError:
+            # A missing object just means SteamCMD downloads that file
+            return
+        with lock:
+            placed[0] += 1
+            placed[1] += size
+
+    with transfer.WorkQueue() as queue:
+        for rel in tree.get("dirs", []):
+            os.makedirs(os.path.join(depot_dir, rel), exist_ok=True)
+        for rel, entry in tree["files"].items():
+            dst = os.path.join(depot_dir, *rel.split("/"))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if "link" in entry:
+                os.symlink(entry["link"], dst)
+            else:
+                queue.submit(place, entry["digest"], dst, entry["size"])
+    return tuple(placed)
+
+
+def _prune(depot_dir: str, keep: Callable[[str], bool]) -> int:
+    removed = 0
+    for foldername, subfolders, filenames in os.walk(depot_dir, topdown=False):
+        rel_dir = os.path.relpath(foldername, depot_dir)
+        # os.walk lists symlinks to directories as folders without entering them
+        for name in filenames + [d for d in subfolders if os.path.islink(os.path.join(foldername, d))]:
+            rel = name if rel_dir == "." else os.path.join(rel_dir, name)
+            if not keep(rel.replace(os.sep, "/")):
+                os.remove(os.path.join(foldername, name))
+                removed += 1
+        if rel_dir != "." and not keep(rel_dir.replace(os.sep, "/")) and not os.listdir(foldername):
+            os.rmdir(foldername)
+            removed += 1
+    return removed
+
+
+def prune_seeded(depot_dir: str, manifest: dict) -> int:
+    """Remove whatever a seed put in depot_dir that isn't in the depot manifest. Returns how many entries went.
+
+    SteamCMD only writes the files of the depot it downloads, so files the
+    seeding version has and this one doesn't would otherwise be stored as
+    part of it. Raises ValueError if the manifest's file names are encrypted.
+    """
+    if manifest["encrypted"]:
+        raise ValueError("The depot manifest's file names are encrypted")
+    listed = {os.path.normcase(name) for name in manifest["files"]}
+    return _prune(depot_dir, lambda rel: os.path.normcase(rel) in listed)
+
+
+def prune_profile(depot_dir: str, profile: str) -> int:
+    """Remove the files of depot_dir that aren't part of profile, e.g. after a download without a filelist."""
+    return _prune(depot_dir, profile_matcher(profile))
+
+
+def unseed(depot_dir: str, tree: dict) -> int:
+    """Remove the files seed_depot() placed from tree that SteamCMD didn't rewrite. Returns how many went.
+
+    What is left is what SteamCMD downloaded; validating the depot again
+    fetches back whichever of the removed files belong to it.
+    """
+    removed = 0
+    for rel, entry in tree["files"].items():
+        path = os.path.join(depot_dir, *rel.split("/"))
+        try:
+            st = os.lstat(path)
+            if "link" in entry:
+                untouched = os.path.islink(path) and os.readlink(path) == entry["link"]
+            else:
+                placed = os.stat(store.object_path(entry["digest"]))
+                # Seeded files carry their object's mtime, anything SteamCMD wrote has a new one
+                untouched = st.st_size == entry["size"] and st.st_mtime_ns == placed.st_mtime_ns
+        except OSError:
+            continue
+        if untouched:
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def seedable(tree: dict) -> bool:
+    """Whether a download seeded from a stored version can be told apart from it afterwards.
+
+    That takes the depot manifest SteamCMD leaves behind, with readable file
+    names; the seed's own download shows whether this depot gets one.
+    Versions stored before this was recorded are given the benefit of the doubt.
+    """
+    if "depot_manifest" not in tree:
+        return True
+    return bool(tree["depot_manifest"]) and not tree["depot_manifest"].get("encrypted")
+
+
+def reused_bytes(tree: dict, seed: Optional[dict]) -> int:
+    """How much of tree came unchanged from seed."""
+    if not seed:
+        return 0
+    known = seed["files"]
+    return sum(entry["size"] for rel, entry in tree["files"].items()
+               if "digest" in entry and known.get(rel, {}).get("digest") == entry["digest"])
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+async def _make(cls):
+    # asyncio primitives have to be created on the loop they're used from
+    return cls()
+
+
+def _drain(jobs: asyncio.Queue):
+    while not jobs.empty():
+        item = jobs.get_nowait()
+        if item is not None:
+            item[1].cancel()
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    """The asyncio loop all SteamCMD sessions run on, started on first use.
+
+    It lives in a daemon thread, so the CLI and the GTK/Tk main loops can
+    keep their own threads and talk to it through submit()/Futures.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+        return _loop
+
+
+class SteamWorker:
+    """A SteamCMD session that logs in once and downloads submitted jobs one by one.
+
+    SteamCMD is started lazily on the first job and kept at its prompt;
+    download_depot commands are written to its stdin. After idle_timeout
+    seconds without work it is told to quit and gets restarted (with a new
+    login) on the next job. If the process dies, loses its connection or
+    prints nothing for stall_timeout seconds in the middle of a download,
+    the session is restarted. Downloads that fail for network reasons or
+    stall are retried after each of retry_delays; the partly downloaded depot
+    stays in place, so SteamCMD only fetches what is still missing. Login and
+    manifest errors fail right away.
+
+    A job with nothing to resume starts from the stored version closest to
+    it in date (nearest_version(), seed=False turns this off), so SteamCMD
+    only downloads the files that changed between the two. Whatever of the
+    seed isn't in the depot manifest SteamCMD leaves in depotcache/ is removed
+    before the version is stored. Versions whose own download left no usable
+    manifest aren't used as seeds; if a seeded download still ends up without
+    one, the seeded files SteamCMD didn't rewrite are removed and the depot is
+    validated again, which fetches back the ones that belong to it.
+
+    Every job is recorded in downloads (queued, running, failed), so one
+    that was interrupted or ran out of retries can be submitted again later
+    and continue from the files it already has.
+
+    The session is driven by coroutines on event_loop(): output is read in
+    chunks as it arrives (so prompts that don't end their line are seen),
+    storing a finished download runs in the loop's executor while the next
+    one starts, and any number of workers can share the loop.
+
+    Everything that happens is reported to on_event as a dict with a "type"
+    key. SteamCMD output arrives as parsed by parse_line() ("line", "login",
+    "guard", "progress"; noise is dropped), tagged with the "job" while a
+    download runs. The worker adds "started", "downloaded" (depot complete,
+    about to be stored, with the download "seconds"), "done" (with "bytes",
+    "downloaded_bytes" and "seconds"), "resumed" (earlier partial content put
+    back), "seeded" (with the "seed" version, "files" and "bytes"), "unseeded"
+    (with the "files" of the seed dropped for want of a manifest), "retry"
+    (with "attempt", "delay", "kind" and "error"), "failed" (with "error" and
+    "kind"), "evicted" (the "names" the storage quota removed to make room,
+    see quota.py), "idle" and "reconnect".
+    on_event is called on the loop's thread and should return quickly;
+    ask_guard may block, it runs in the loop's executor.
+    submit() returns a Future that resolves to
+    {"status": "done", "path": ..., "bytes": ..., "downloaded_bytes": ..., "seconds": ...} or
+    {"status": "failed", "error": ..., "kind": ...} once the version has been stored in
+    versions/.
+    """
+
+    def __init__(self, username: str, password: Optional[str], ask_guard: Callable[[], str],
+                 on_event: Optional[Callable[[dict], None]] = None,
+                 idle_timeout: Optional[float] = IDLE_TIMEOUT, stall_timeout: Optional[float] = STALL_TIMEOUT,
+                 install_dir: Optional[str] = None, login_lock: Optional[asyncio.Lock] = None,
+                 idle_event: Optional[asyncio.Event] = None, retry_delays: tuple = RETRY_DELAYS,
+                 seed: bool = True):
+        self.username = username
+        self.password = password
+        self.ask_guard = ask_guard
+        self.on_event = on_event or (lambda event: None)
+        self.idle_timeout = idle_timeout
+        self.stall_timeout = stall_timeout
+        self.retry_delays = tuple(retry_delays)
+        self.seed = seed
+        self.process = None
+        self.events = None
+        self.current = None
+        self.post_tasks = set()
+        self.content_dirs = set()
+        self.sessions = 0
+        self.started_at = 0.0
+        self.cancelled = False
+        # SteamCMD puts downloads below steamapps/content of its install dir;
+        # separate dirs keep sessions that run side by side out of each other's way
+        self.install_dir = os.path.abspath(install_dir or os.path.join(STAGING_DIR, "session"))
+        self.loop = event_loop()
+        self.jobs = asyncio.run_coroutine_threadsafe(_make(asyncio.Queue), self.loop).result()
+        # A SteamPool shares one login lock between its workers and wants to
+        # hear (idle_event) when one of them is free for the next job
+        self.login_lock = login_lock or asyncio.run_coroutine_threadsafe(_make(asyncio.Lock), self.loop).result()
+        self.idle_event = idle_event
+        self.busy = False
+        self.task = asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+
+    def submit(self, platform: str, manifest_id: str, profile: Optional[str] = None) -> Future:
+        """Queue a download; profile (see FILE_PROFILES) fetches only part of the depot."""
+        if profile is not None and profile not in FILE_PROFILES:
+            raise ValueError(f"Unknown file profile: {profile}")
+        future = Future()
+        downloads.update((platform, manifest_id), status="queued", profile=profile)
+        self.loop.call_soon_threadsafe(self.jobs.put_nowait, ((platform, manifest_id), future))
+        return future
+
+    async def download(self, platform: str, manifest_id: str, profile: Optional[str] = None) -> dict:
+        """submit() for code that already runs on event_loop()."""
+        return await asyncio.wrap_future(self.submit(platform, manifest_id, profile))
+
+    def close(self):
+        """Finish queued jobs, then log out and stop SteamCMD."""
+        self.loop.call_soon_threadsafe(self.jobs.put_nowait, None)
+        self.task.result()
+        self._cleanup()
+
+    def _cleanup(self):
+        for content_dir in self.content_dirs:
+            shutil.rmtree(content_dir, ignore_errors=True)
+        shutil.rmtree(self.install_dir, ignore_errors=True)
+
+    def cancel(self):
+        """Drop queued jobs and kill SteamCMD mid-download."""
+        self.loop.call_soon_threadsafe(self._cancel)
+
+    def _cancel(self):
+        self._abort()
+        _drain(self.jobs)
+        self.jobs.put_nowait(None)
+
+    def _abort(self):
+        self.cancelled = True
+        if self.current is not None:
+            self.current.cancel()
+
+    async def _call(self, fn, *args):
+        return await self.loop.run_in_executor(None, fn, *args)
+
+    def _emit(self, event_type: str, **data):
+        data["type"] = event_type
+        self.on_event(data)
+
+    async def _send(self, line: str, process=None):
+        process = process or self.process
+        process.stdin.write((line + "\n").encode("utf-8"))
+        await process.stdin.drain()
+
+    def _alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def _read_output(self, process, events: asyncio.Queue):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buffer = ""
+        while True:
+            chunk = await process.stdout.read(4096)
+            if not chunk:
+                break
+            buffer += decoder.decode(chunk)
+            *lines, buffer = LINE_BREAK.split(buffer)
+            for line in lines:
+                event = parse_line(line.strip())
+                if event["type"] != "noise":
+                    events.put_nowait(event)
+            # Prompts like "Steam Guard code:" wait for input without ending the line
+            if buffer:
+                event = parse_line(buffer.strip())
+                if event["type"] == "guard":
+                    events.put_nowait(event)
+                    buffer = ""
+        if buffer.strip():
+            events.put_nowait(parse_line(buffer.strip()))
+        events.put_nowait(None)
+
+    async def _next_event(self, what: str) -> dict:
+        try:
+            event = await asyncio.wait_for(self.events.get(), self.stall_timeout)
+        except asyncio.TimeoutError:
+            raise SessionError(f"No output from SteamCMD for {int(self.stall_timeout)}s during {what}", "timeout")
+        if event is None:
+            raise SessionError(f"SteamCMD exited during {what}")
+        if event["type"] == "lost":
+            raise SessionError(event["line"])
+        return event
+
+    async def _start(self):
+        os.makedirs(self.install_dir, exist_ok=True)
+        command = [steamcmd_executable(), "+force_install_dir", self.install_dir, "+login", self.username]
+        if self.password:
+            command.append(self.password)
+        # One login at a time: the first one answers Steam Guard, the others
+        # reuse the credentials it leaves behind
+        async with self.login_lock:
+            await self._login(command)
+
+    async def _login(self, command: list):
+        self.process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            stdin=asyncio.subprocess.PIPE
+        )
+        self.events = asyncio.Queue()
+        self.sessions += 1
+        asyncio.ensure_future(self._read_output(self.process, self.events))
+
+        while True:
+            event = await self._next_event("login")
+            if event["type"] == "login_failed":
+                await self._stop()
+                if classify_failure(event["line"]) == "network":
+                    raise SessionError(event["line"])
+                raise LoginError(event["line"])
+            self.on_event(event)
+            if event["type"] == "guard":
+                await self._send(await self._call(self.ask_guard))
+            elif event["type"] == "login":
+                return
+
+    async def _stop(self):
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        if process.returncode is None:
+            try:
+                await self._send("quit", process)
+                await asyncio.wait_for(process.wait(), 30)
+            except (OSError, asyncio.TimeoutError):
+                await self._kill(process)
+
+    async def _kill(self, process=None):
+        process = process or self.process
+        if process is self.process:
+            self.process = None
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    async def _download(self, job: tuple) -> str:
+        platform, manifest_id = job
+        # Whatever SteamCMD printed while idle at the prompt isn't about this job
+        while not self.events.empty():
+            if self.events.get_nowait() is None:
+                raise SessionError("SteamCMD exited while idle")
+        profile = downloads.get(job).get("profile")
+        filelist = None
+        if profile:
+            filelist_path = os.path.join(self.install_dir, f"filelist-{profile}.txt")
+            paths = await self._call(known_paths, platform, manifest_id, self.install_dir)
+            # Nothing known to pick from means the whole depot; _store() keeps the profile's files
+            filelist = await self._call(write_filelist, profile, paths, filelist_path, platform)
+        self.started_at = self.loop.time()
+        self._emit("started", job=job)
+        depot_path = await self._depot_command(job, download_command(platform, manifest_id, filelist))
+        if filelist:
+            # A list taken from another version misses files this one added; SteamCMD
+            # has this one's manifest now, so they are fetched by their exact names
+            manifest = await self._call(depot_manifest, platform, manifest_id, self.install_dir)
+            missing = await self._call(missing_files, depot_path, profile, manifest)
+            if missing:
+                paths = [name for name, entry in manifest["files"].items()
+                         if not entry["flags"] & depotcache.FLAG_DIRECTORY]
+                filelist = await self._call(write_filelist, profile, paths, filelist_path, platform)
+                depot_path = await self._depot_command(job, download_command(platform, manifest_id, filelist))
+        self._emit("downloaded", job=job, path=depot_path, seconds=self.loop.time() - self.started_at)
+        return depot_path
+
+    async def _depot_command(self, job: tuple, command: str) -> str:
+        await self._send(command)
+        while True:
+            event = await self._next_event("download")
+            kind = event["type"]
+            if kind == "failed":
+                raise DownloadError(event["line"], classify_failure(event["line"]))
+            if kind == "done":
+                return event["path"]
+            event["job"] = job
+            self.on_event(event)
+
+    def _depot_dir(self, platform: str) -> str:
+        return os.path.join(self.install_dir, "steamapps", "content", f"app_{APP_ID}",
+                            f"depot_{PLATFORM_DEPOTS[platform]}")
+
+    async def _download_with_retry(self, job: tuple) -> str:
+        attempt = 0
+        while True:
+            try:
+                if not self._alive():
+                    if self.sessions:
+                        self._emit("reconnect")
+                    await self._start()
+                return await self._download(job)
+            except SessionError as e:
+                # Dead, disconnected or stalled: the next attempt starts a fresh SteamCMD
+                await self._kill()
+                error = e
+            except DownloadError as e:
+                # A failed download leaves SteamCMD at its prompt, ready for the next one
+                error = e
+            except BaseException:
+                # Cancelled, or the Steam Guard callback failed: SteamCMD is stuck somewhere
+                await self._kill()
+                raise
+            if error.kind not in RETRY_KINDS or attempt >= len(self.retry_delays):
+                raise error
+            delay = self.retry_delays[attempt]
+            attempt += 1
+            self._emit("retry", job=job, attempt=attempt, delay=delay, kind=error.kind, error=str(error))
+            await asyncio.sleep(delay)
+
+    def _fail(self, job: tuple, future: Future, error: str, kind: str = "unknown"):
+        self._emit("failed", job=job, error=error, kind=kind)
+        future.set_result({"status": "failed", "error": error, "kind": kind})
+
+    async def _give_up(self, job: tuple, future: Future, error: DownloadError, message: str):
+        # Keep what was downloaded if trying again later could finish it
+        depot_dir = self._depot_dir(job[0])
+        if error.kind in downloads.RESUMABLE:
+            partial = await self._call(downloads.park, job, depot_dir)
+            downloads.update(job, status="failed", kind=error.kind, error=message, partial=partial)
+        else:
+            await self._call(shutil.rmtree, depot_dir, True)
+            downloads.forget(job)
+        self._fail(job, future, message, error.kind)
+
+    async def _next_job(self):
+        if self._alive() and self.idle_timeout:
+            return await asyncio.wait_for(self.jobs.get(), self.idle_timeout)
+        return await self.jobs.get()
+
+    async def _run(self):
+        while True:
+            try:
+                item = await self._next_job()
+            except asyncio.TimeoutError:
+                self._emit("idle")
+                await self._stop()
+                continue
+            if item is None:
+                break
+            job, future = item
+            try:
+                if self.cancelled:
+                    future.cancel()
+                elif future.set_running_or_notify_cancel():
+                    await self._handle(job, future)
+            finally:
+                self.busy = False
+                if self.idle_event is not None:
+                    self.idle_event.set()
+
+        # Jobs handed over after close()/cancel() won't run
+        _drain(self.jobs)
+        await self._stop()
+        if self.post_tasks:
+            await asyncio.gather(*self.post_tasks)
+
+    async def _handle(self, job: tuple, future: Future):
+        # Put back what an earlier, interrupted attempt already downloaded
+        depot_dir = self._depot_dir(job[0])
+        try:
+            await self._call(downloads.claim, job, depot_dir)
+            resumed = await self._call(downloads.unpark, job, depot_dir)
+        except OSError:
+            resumed = False
+        if resumed:
+            self._emit("resumed", job=job)
+        elif self.seed and not downloads.get(job).get("unseeded"):
+            await self._seed(job, depot_dir)
+        downloads.update(job, status="running", partial=depot_dir)
+
+        self.current = asyncio.ensure_future(self._fetch(job))
+        try:
+            depot_path = await self.current
+        except asyncio.CancelledError:
+            await self._kill()
+            await self._give_up(job, future, DownloadError("Cancelled", "cancelled"), "Cancelled")
+            return
+        except LoginError as e:
+            await self._give_up(job, future, e, f"Login failed: {e}")
+            return
+        except SessionError as e:
+            await self._give_up(job, future, e, f"SteamCMD session lost: {e}")
+            return
+        except DownloadError as e:
+            await self._give_up(job, future, e, str(e))
+            return
+        except Exception as e:
+            await self._give_up(job, future, DownloadError(str(e)), str(e))
+            return
+        finally:
+            self.current = None
+        seconds = self.loop.time() - self.started_at
+
+        # Move the depot out of the way of the next download, then store it
+        # while SteamCMD gets on with the next job
+        self.content_dirs.add(os.path.dirname(depot_path))
+        try:
+            staged = await self._call(stage_download, depot_path, *job)
+        except Exception as e:
+            downloads.forget(job)
+            self._fail(job, future, f"Failed to stage download: {e}", "storage")
+            return
+        task = asyncio.ensure_future(self._store(job, future, staged, seconds))
+        self.post_tasks.add(task)
+        task.add_done_callback(self.post_tasks.discard)
+
+    async def _fetch(self, job: tuple) -> str:
+        depot_path = await self._download_with_retry(job)
+        seeds = downloads.get(job).get("seed")
+        if not seeds:
+            return depot_path
+        manifest = await self._call(depot_manifest, *job, self.install_dir)
+        if manifest and not manifest["encrypted"]:
+            await self._call(prune_seeded, depot_path, manifest)
+            return depot_path
+        # Without the depot's file list the seed's leftovers can't be told apart
+        # from the download: drop what SteamCMD didn't rewrite and have it
+        # validate the depot again, which fetches back what belongs to it
+        seed = layer_trees([store.load_tree("versions", name) for name in seeds])
+        removed = await self._call(unseed, depot_path, seed) if seed else 0
+        downloads.update(job, seed=[], unseeded=True)
+        self._emit("unseeded", job=job, files=removed)
+        return await self._download_with_retry(job)
+
+    async def _seed(self, job: tuple, depot_dir: str):
+        platform, manifest_id = job
+        try:
+            tree = await self._call(seed_tree, platform, manifest_id, downloads.get(job).get("profile"))
+            if tree is None or not seedable(tree):
+                return
+            files, size = await self._call(seed_depot, tree, depot_dir)
+        except OSError:
+            # Seeding only saves time; SteamCMD downloads whatever isn't there
+            await self._call(shutil.rmtree, depot_dir, True)
+            return
+        downloads.update(job, seed=tree["seeds"])
+        self._emit("seeded", job=job, seed=tree["name"].split("/", 1)[1], files=files, bytes=size)
+
+    async def _store(self, job: tuple, future: Future, staged: str, seconds: float):
+        platform, manifest_id = job
+        dest = version_path(platform, manifest_id)
+        state = downloads.get(job)
+        seed = layer_trees([store.load_tree("versions", name) for name in state.get("seed", [])])
+        # A partial version remembers its profile, so it can be listed as such and upgraded later
+        meta = {"profile": state["profile"]} if state.get("profile") else {}
+        listed = next((version for version in manifests.load_cached()[0].get(platform, [])
+                       if version.get("id") == manifest_id), {})
+        if listed.get("date"):
+            meta["date"] = listed["date"]
+        manifest = await self._call(depot_manifest, platform, manifest_id, self.install_dir)
+        # None tells seedable() that this depot leaves no manifest to prune a seed by
+        meta["depot_manifest"] = None
+        if manifest:
+            meta["depot_manifest"] = {"created": manifest["created"], "files": len(manifest["files"]),
+                                      "size": manifest["size"], "encrypted": manifest["encrypted"]}
+        if state.get("profile"):
+            await self._call(prune_profile, staged, state["profile"])
+        try:
+            size = await self._call(tree_size, staged)
+            # Seeded files SteamCMD left alone still match the seed's size and
+            # mtime, so they are linked to its objects without being hashed
+            # again; the rest take their SHA-1 from the depot manifest
+            tree = await self._call(store.ingest_tree, staged, dest, "versions", f"{platform}/{manifest_id}", True,
+                                    None, None, transfer.DEFAULT_WORKERS, seed, meta,
+                                    depotcache.digests(manifest) if manifest else None)
+            await self._call(shutil.rmtree, staged, True)
+        except Exception as e:
+            # Don't leave a half-filled version behind that looks installed
+            await self._call(shutil.rmtree, dest, True)
+            downloads.forget(job)
+            self._fail(job, future, f"Failed to store files: {e}", "storage")
+            return
+        downloads.forget(job)
+        try:
+            evicted = await self._call(quota.enforce, None, ("versions", f"{platform}/{manifest_id}"))
+        except Exception:
+            # The version is stored; the quota is enforced again after the next one
+            evicted = []
+        if evicted:
+            self._emit("evicted", job=job, names=[entry["name"] for entry in evicted])
+        fetched = size - reused_bytes(tree, seed)
+        self._emit("done", job=job, path=dest, bytes=size, downloaded_bytes=fetched, seconds=seconds)
+        future.set_result({"status": "done", "path": dest, "bytes": size, "downloaded_bytes": fetched,
+                           "seconds": seconds})
+
+
+class SteamPool:
+    """Up to concurrency SteamWorkers downloading side by side.
+
+    Each worker runs its own SteamCMD with its own install dir below
+    STAGING_DIR, so depots downloading at the same time never share a
+    steamapps/content folder. Jobs go to an idle worker that is already
+    logged in if there is one, so a second session is only started when the
+    first one is busy; logins happen one at a time. Every finished depot is
+    stored by the worker that downloaded it while the others keep going.
+    submit(), cancel() and close() work like on a single SteamWorker.
+    """
+
+    def __init__(self, username: str, password: Optional[str], ask_guard: Callable[[], str],
+                 on_event: Optional[Callable[[dict], None]] = None,
+                 concurrency: int = DEFAULT_CONCURRENCY, **options):
+        self.username = username
+        self.password = password
+        self.loop = event_loop()
+        self.jobs = asyncio.run_coroutine_threadsafe(_make(asyncio.Queue), self.loop).result()
+        self.idle = asyncio.run_coroutine_threadsafe(_make(asyncio.Event), self.loop).result()
+        login_lock = asyncio.run_coroutine_threadsafe(_make(asyncio.Lock), self.loop).result()
+        self.workers = [
+            SteamWorker(username, password, ask_guard, on_event,
+                        install_dir=os.path.join(STAGING_DIR, f"session-{i}"),
+                        login_lock=login_lock, idle_event=self.idle, **options)
+            for i in range(1, max(1, int(concurrency)) + 1)
+        ]
+        self.cancelled = False
+        self.task = asyncio.run_coroutine_threadsafe(self._dispatch(), self.loop)
+
+    def submit(self, platform: str, manifest_id: str, profile: Optional[str] = None) -> Future:
+        if profile is not None and profile not in FILE_PROFILES:
+            raise ValueError(f"Unknown file profile: {profile}")
+        future = Future()
+        downloads.update((platform, manifest_id), status="queued", profile=profile)
+        self.loop.call_soon_threadsafe(self.jobs.put_nowait, ((platform, manifest_id), future))
+        return future
+
+    async def download(self, platform: str, manifest_id: str, profile: Optional[str] = None) -> dict:
+        return await asyncio.wrap_future(self.submit(platform, manifest_id, profile))
+
+    def close(self):
+        """Finish queued jobs, then stop every session."""
+        self.loop.call_soon_threadsafe(self.jobs.put_nowait, None)
+        self.task.result()
+        for worker in self.workers:
+            worker.task.result()
+            worker._cleanup()
+
+    def cancel(self):
+        """Drop queued jobs and kill every running download."""
+        self.loop.call_soon_threadsafe(self._cancel)
+
+    def _cancel(self):
+        self.cancelled = True
+        _drain(self.jobs)
+        self.jobs.put_nowait(None)
+        for worker in self.workers:
+            worker._cancel()
+
+    async def _idle_worker(self) -> SteamWorker:
+        while True:
+            idle = [worker for worker in self.workers if not worker.busy]
+            if idle:
+                return next((worker for worker in idle if worker._alive()), idle[0])
+            self.idle.clear()
+            await self.idle.wait()
+
+    async def _dispatch(self):
+        while True:
+            item = await self.jobs.get()
+            if item is None:
+                break
+            worker = await self._idle_worker()
+            if self.cancelled:
+                item[1].cancel()
+                continue
+            worker.busy = True
+            worker.jobs.put_nowait(item)
+        for worker in self.workers:
+            worker.jobs.put_nowait(None)
+
+
+def run_batch(username: str, password: Optional[str], jobs: list,
+              on_event: Callable[[dict], None], ask_guard: Callable[[], str],
+              worker=None, concurrency: int = 1) -> dict:
+    """Download many (platform, manifest_id[, profile]) jobs, logging in once per session.
+
+    Finished depots are ingested into versions/ while the next one downloads.
+    Uses the given SteamWorker/SteamPool (left running) or a temporary pool
+    of concurrency sessions.
+    Returns {(platform, manifest_id): result}.
+    """
+    own_worker = worker is None
+    if own_worker:
+        worker = SteamPool(username, password, ask_guard, on_event, concurrency, idle_timeout=None)
+    futures = {tuple(job[:2]): worker.submit(*job) for job in jobs}
+    try:
+        return {job: future.result() for job, future in futures.items()}
+    finally:
+        if own_worker:
+            worker.close()
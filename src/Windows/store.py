@@ -0,0 +1,375 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from typing import Callable, Optional
+
+import transfer
+import catalog
+
+# Content-addressed object store shared by versions/ and backups/.
+# Every file is stored once under storage/objects/<xx>/<digest> and the
+# version/backup directories are made of hardlinks into it, so the usual
+# directory listings keep working while identical files take no extra space.
+
+STORAGE_DIR = "storage"
+OBJECTS_DIR = os.path.join(STORAGE_DIR, "objects")
+TREES_DIR = os.path.join(STORAGE_DIR, "trees")
+HASH_ALGO = "sha1"
+CHUNK_SIZE = 1024 * 1024
+
+_objects_lock = threading.Lock()
+# Objects an ingest that is still running links to; its tree isn't saved yet,
+# so gc() (e.g. a quota eviction) has to leave them alone. They are released
+# under _gc_lock, so a gc() that started before the tree was saved still sees
+# them held.
+_held = Counter()
+_gc_lock = threading.Lock()
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.new(HASH_ALGO)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def object_path(digest: str) -> str:
+    return os.path.join(OBJECTS_DIR, digest[:2], digest[2:])
+
+
+def has_object(digest: str) -> bool:
+    return os.path.exists(object_path(digest))
+
+
+def put_object(src: str, digest: str, move: bool = False) -> bool:
+    """Store src under its digest. Returns True if a new object was written."""
+    dst = object_path(digest)
+    if os.path.exists(dst):
+        if move:
+            os.remove(src)
+        return False
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f"{dst}.tmp-{os.getpid()}-{threading.get_ident()}"
+    if move:
+        shutil.move(src, tmp)
+    else:
+        transfer.kernel_copy(src, tmp)
+    with _objects_lock:
+        # Another worker may have stored the same content in the meantime
+        if os.path.exists(dst):
+            os.remove(tmp)
+            return False
+        os.replace(tmp, dst)
+    return True
+
+
+def hold_objects(digests: list):
+    with _objects_lock:
+        _held.update(digests)
+
+
+def release_objects(digests: list):
+    with _gc_lock, _objects_lock:
+        _held.subtract(digests)
+        for digest in set(digests):
+            if _held[digest] <= 0:
+                del _held[digest]
+
+
+def link_object(digest: str, dst: str) -> bool:
+    """Place an object at dst. Hardlinks when possible, copies otherwise."""
+    src = object_path(digest)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        # Different filesystem, FAT/exFAT, link count limit...
+        transfer.kernel_copy(src, dst)
+        return False
+
+
+def tree_path(kind: str, name: str) -> str:
+    return os.path.join(TREES_DIR, kind, *name.split("/")) + ".json"
+
+
+def load_tree(kind: str, name: str) -> Optional[dict]:
+    path = tree_path(kind, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_tree(tree: dict):
+    path = tree_path(tree["kind"], tree["name"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(tree, f)
+    os.replace(tmp, path)
+    catalog.record(tree)
+
+
+def update_tree(kind: str, name: str, **fields) -> Optional[dict]:
+    """Set fields of a saved tree (when it was last used, whether it's pinned...); None if there is no tree."""
+    tree = load_tree(kind, name)
+    if tree is None:
+        return None
+    tree.update(fields)
+    save_tree(tree)
+    return tree
+
+
+def iter_trees():
+    if not os.path.isdir(TREES_DIR):
+        return
+    for foldername, _, filenames in os.walk(TREES_DIR):
+        for filename in filenames:
+            if not filename.endswith(".json"):
+                continue
+            with open(os.path.join(foldername, filename), "r", encoding="utf-8") as f:
+                try:
+                    yield json.load(f)
+                except ValueError:
+                    continue
+
+
+def walk_files(root: str):
+    """Yield (relative posix path, absolute path) for every file below root.
+
+    Symlinks to folders count as files, as they are stored as links.
+    """
+    for foldername, subfolders, filenames in os.walk(root):
+        # os.walk lists symlinks to directories as folders without entering them
+        linked = [d for d in subfolders if os.path.islink(os.path.join(foldername, d))]
+        for filename in filenames + linked:
+            full = os.path.join(foldername, filename)
+            rel = os.path.relpath(full, root).replace(os.sep, "/")
+            yield rel, full
+
+
+def latest_tree(kind: str, source: str) -> Optional[dict]:
+    """Most recent tree of a kind that was ingested from source."""
+    catalog.refresh_stale()
+    for entry in catalog.entries(kind, source=os.path.abspath(source), order="-created"):
+        tree = load_tree(kind, entry["name"])
+        if tree and os.path.isdir(tree.get("path", "")):
+            return tree
+    return None
+
+
+def ingest_tree(src: str, dest: str, kind: str, name: str, move: bool = False,
+                progress: Optional[Callable[[int], None]] = None,
+                on_total: Optional[Callable[[int], None]] = None,
+                workers: int = transfer.DEFAULT_WORKERS,
+                previous: Optional[dict] = None, meta: Optional[dict] = None,
+                listed: Optional[dict] = None, cancel: Optional[threading.Event] = None) -> dict:
+    """Store every file of src in the object store and rebuild it at dest.
+
+    With move=True the source files are consumed (used for fresh SteamCMD
+    downloads), otherwise they are copied (used for backups of a live install).
+    Files are hashed and stored by a pool of workers; progress and on_total
+    work like in transfer.sync_tree().
+
+    previous is an earlier tree of the same source (see latest_tree()). Files
+    whose size and mtime still match it are linked to the known object without
+    being read again, which makes repeated backups a metadata scan.
+    meta is saved with the tree (e.g. the file profile of a partial version).
+    listed is {rel: (size, digest)} known from elsewhere, i.e. the depot
+    manifest of a download (see depotcache.digests()): files of that size are
+    stored under the listed digest without being hashed.
+    Setting cancel stops after the files being stored right now, removes dest
+    and raises transfer.Cancelled; nothing is saved for it.
+    """
+    if os.path.isdir(dest):
+        shutil.rmtree(dest)
+    os.makedirs(dest, exist_ok=True)
+
+    files = {}
+    dirs = []
+    lock = threading.Lock()
+    total = [0]
+    stats = {"reused": 0, "stored": 0, "listed": 0}
+    known = previous["files"] if previous else {}
+    listed = listed or {}
+    held = []
+
+    def hold(digest):
+        hold_objects([digest])
+        held.append(digest)
+
+    def store_job(src_file, dst_file, rel, st, digest=None):
+        if cancel is not None and cancel.is_set():
+            return
+        if digest is None:
+            digest = hash_file(src_file)
+        hold(digest)
+        put_object(src_file, digest, move=move)
+        link_object(digest, dst_file)
+        with lock:
+            files[rel] = {"digest": digest, "size": st.st_size, "mtime": st.st_mtime}
+            stats["stored"] += 1
+        if progress:
+            progress(st.st_size)
+
+    try:
+        with transfer.WorkQueue(workers, cancel) as queue:
+            for foldername, subfolders, filenames in os.walk(src):
+                if cancel is not None and cancel.is_set():
+                    raise transfer.Cancelled()
+                rel_dir = os.path.relpath(foldername, src)
+                target_folder = os.path.join(dest, rel_dir) if rel_dir != "." else dest
+                os.makedirs(target_folder, exist_ok=True)
+                if not subfolders and not filenames and rel_dir != ".":
+                    dirs.append(rel_dir.replace(os.sep, "/"))
+
+                # os.walk lists symlinks to directories as folders without entering them
+                names = filenames + [d for d in subfolders if os.path.islink(os.path.join(foldername, d))]
+                for filename in names:
+                    src_file = os.path.join(foldername, filename)
+                    rel = os.path.join(rel_dir, filename) if rel_dir != "." else filename
+                    rel = rel.replace(os.sep, "/")
+                    if os.path.islink(src_file):
+                        target = os.readlink(src_file)
+                        dst_file = os.path.join(target_folder, filename)
+                        if os.path.lexists(dst_file):
+                            os.remove(dst_file)
+                        os.symlink(target, dst_file)
+                        with lock:
+                            files[rel] = {"link": target}
+                        if move:
+                            os.remove(src_file)
+                        continue
+
+                    st = os.stat(src_file)
+                    dst_file = os.path.join(target_folder, filename)
+                    entry = known.get(rel)
+                    reusable = entry and "digest" in entry and entry["size"] == st.st_size \
+                        and entry["mtime"] == st.st_mtime
+                    if reusable:
+                        hold(entry["digest"])
+                    if reusable and has_object(entry["digest"]):
+                        link_object(entry["digest"], dst_file)
+                        with lock:
+                            files[rel] = dict(entry)
+                            stats["reused"] += 1
+                        if move:
+                            os.remove(src_file)
+                        continue
+
+                    digest = None
+                    if rel in listed and listed[rel][0] == st.st_size:
+                        digest = listed[rel][1]
+                        with lock:
+                            stats["listed"] += 1
+
+                    total[0] += st.st_size
+                    if on_total:
+                        on_total(total[0])
+                    queue.submit(store_job, src_file, dst_file, rel, st, digest)
+        if cancel is not None and cancel.is_set():
+            raise transfer.Cancelled()
+
+        tree = {
+            "kind": kind,
+            "name": name,
+            "path": dest,
+            "source": os.path.abspath(src),
+            "previous": previous["name"] if previous else None,
+            "algo": HASH_ALGO,
+            "created": time.time(),
+            "files": files,
+            "dirs": dirs,
+        }
+        tree.update(meta or {})
+        save_tree(tree)
+    except transfer.Cancelled:
+        # The objects it stored are collected by the next gc()
+        shutil.rmtree(dest, ignore_errors=True)
+        raise
+    finally:
+        release_objects(held)
+    tree["stats"] = stats
+    return tree
+
+
+def remove_tree(kind: str, name: str, path: Optional[str] = None, collect: bool = True,
+                progress: Optional[Callable[[int], None]] = None,
+                on_total: Optional[Callable[[int], None]] = None):
+    """Delete a stored version/backup directory and its manifest, then collect garbage.
+
+    Pass collect=False when removing several, and call gc() once at the end.
+    progress and on_total count the bytes of the files removed.
+    """
+    tree = load_tree(kind, name)
+    path = path or (tree or {}).get("path")
+    if path and os.path.isdir(path) and (progress or on_total):
+        files = [(full, os.lstat(full).st_size) for _, full in walk_files(path)]
+        if on_total:
+            on_total(sum(size for _, size in files))
+        for full, size in files:
+            os.remove(full)
+            if progress:
+                progress(size)
+        # Only the empty folders are left
+        shutil.rmtree(path)
+    elif path and os.path.isdir(path):
+        shutil.rmtree(path)
+    elif path and os.path.exists(path):
+        os.remove(path)
+    manifest = tree_path(kind, name)
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    catalog.forget(kind, name)
+    if collect:
+        gc()
+
+
+def gc() -> int:
+    """Drop manifests whose directory is gone and objects nothing refers to."""
+    with _gc_lock:
+        return _gc()
+
+
+def _gc() -> int:
+    referenced = set()
+    for tree in list(iter_trees()):
+        if not os.path.isdir(tree.get("path", "")):
+            try:
+                os.remove(tree_path(tree["kind"], tree["name"]))
+            except OSError:
+                pass
+            catalog.forget(tree["kind"], tree["name"])
+            continue
+        for entry in tree["files"].values():
+            if "digest" in entry:
+                referenced.add(entry["digest"])
+
+    removed = 0
+    if not os.path.isdir(OBJECTS_DIR):
+        return removed
+    for shard in os.listdir(OBJECTS_DIR):
+        shard_path = os.path.join(OBJECTS_DIR, shard)
+        if not os.path.isdir(shard_path):
+            continue
+        for rest in os.listdir(shard_path):
+            # .tmp- files are objects put_object() is still writing
+            if shard + rest in referenced or ".tmp-" in rest:
+                continue
+            with _objects_lock:
+                if shard + rest in _held:
+                    continue
+                os.remove(os.path.join(shard_path, rest))
+            removed += 1
+    return removed
+
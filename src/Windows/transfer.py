@@ -0,0 +1,457 @@
+import os
+import re
+import json
+import errno
+import stat
+import filecmp
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# How files are placed into an installation:
+#   auto     - reflink (copy-on-write clone) where the filesystem supports it, else copy
+#   reflink  - same as auto, kept as an explicit name
+#   hardlink - share the inode with the stored version (instant, but edits to the
+#              installed file also change the stored copy), else copy
+#   copy     - always a plain copy
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+
+# How file data is copied when a file can't be linked or cloned:
+#   auto            - copy_file_range, then sendfile, then shutil
+#   copy_file_range - in-kernel copy; server-side/reflink copy on NFS, btrfs, xfs
+#   sendfile        - in-kernel copy through the page cache
+#   shutil          - shutil.copy2 (CopyFileEx on Windows)
+COPY_BACKENDS = ("auto", "copy_file_range", "sendfile", "shutil")
+
+DEFAULT_WORKERS = min(8, os.cpu_count() or 4)
+
+FICLONE = 0x40049409
+
+COPY_CHUNK = 64 * 1024 * 1024
+
+# Where a transactional sync_tree() keeps what it replaced, inside the target
+JOURNAL_DIR = ".rewind-undo"
+
+_reflink_unsupported = set()
+# What FICLONE fails with when the filesystem (or the pair of them) can't clone at all;
+# anything else (ENOSPC, EIO...) is about the one file and is left to the plain copy
+REFLINK_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTSUP, errno.EXDEV, errno.EINVAL, errno.ENOTTY}
+
+# How coarse modification times are on filesystems that don't keep nanoseconds, in ns
+# (FAT and exFAT as most drivers write them: 2 s; NTFS: 100 ns). Anything else is compared exactly.
+MTIME_RESOLUTION = {
+    "vfat": 2_000_000_000, "msdos": 2_000_000_000, "fat": 2_000_000_000, "fat32": 2_000_000_000,
+    "exfat": 2_000_000_000, "ntfs": 100, "ntfs3": 100, "refs": 100, "cifs": 100, "smb3": 100,
+}
+
+_mtime_resolution = {}
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """Lower-case name of the filesystem path is on ("ext4", "vfat", "ntfs"...), None if unknown."""
+    if os.name == "nt":
+        import ctypes
+        root = os.path.splitdrive(os.path.abspath(path))[0] + "\\"
+        name = ctypes.create_unicode_buffer(64)
+        if not ctypes.windll.kernel32.GetVolumeInformationW(root, None, 0, None, None, None, name, len(name)):
+            return None
+        return name.value.lower()
+    try:
+        with open("/proc/self/mounts", "r", encoding="utf-8") as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    best, fs_type = "", None
+    for mount_point, kind in mounts:
+        # Spaces and the like are octal escapes in /proc/self/mounts
+        mount_point = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), mount_point)
+        inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+        if inside and len(mount_point) >= len(best):
+            best, fs_type = mount_point, kind
+    return fs_type
+
+
+def mtime_resolution(path: str, dev: int) -> int:
+    """Granularity in ns of the modification times on the filesystem of path (device dev), 1 if exact."""
+    if dev not in _mtime_resolution:
+        _mtime_resolution[dev] = MTIME_RESOLUTION.get(filesystem_type(path), 1)
+    return _mtime_resolution[dev]
+
+
+def same_mtime(src: str, src_st: os.stat_result, dst: str, dst_st: os.stat_result) -> bool:
+    """True if both files were last modified at the same time, as far as their filesystems can tell."""
+    resolution = max(mtime_resolution(src, src_st.st_dev), mtime_resolution(dst, dst_st.st_dev))
+    return abs(src_st.st_mtime_ns - dst_st.st_mtime_ns) < resolution
+
+
+def reflink_file(src: str, dst: str) -> bool:
+    """Clone src to dst with the FICLONE ioctl (btrfs, xfs, bcachefs...)."""
+    if fcntl is None:
+        return False
+    dev = os.stat(os.path.dirname(os.path.abspath(dst))).st_dev
+    if dev in _reflink_unsupported:
+        return False
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except OSError as e:
+        if e.errno in REFLINK_UNSUPPORTED:
+            _reflink_unsupported.add(dev)
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def _copy_file_range(fsrc: int, fdst: int) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+    try:
+        while os.copy_file_range(fsrc, fdst, COPY_CHUNK):
+            pass
+    except OSError:
+        # EXDEV on kernels before 5.3, EINVAL/ENOSYS on some filesystems
+        return False
+    return True
+
+
+def _sendfile(fsrc: int, fdst: int) -> bool:
+    if not hasattr(os, "sendfile"):
+        return False
+    try:
+        while os.sendfile(fdst, fsrc, None, COPY_CHUNK):
+            pass
+    except OSError:
+        return False
+    return True
+
+
+def kernel_copy(src: str, dst: str, backend: str = "auto") -> str:
+    """Copy file data without going through userspace buffers where possible.
+
+    Falls through the backends in order when one isn't available; a backend
+    that fails halfway hands over at the current offset, so nothing is copied
+    twice. Metadata is copied like shutil.copy2. Returns the backend used.
+    """
+    if backend == "shutil" or not (hasattr(os, "copy_file_range") or hasattr(os, "sendfile")):
+        shutil.copy2(src, dst)
+        return "shutil"
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        used = None
+        if backend in ("auto", "copy_file_range") and _copy_file_range(fsrc.fileno(), fdst.fileno()):
+            used = "copy_file_range"
+        elif backend in ("auto", "copy_file_range", "sendfile") and _sendfile(fsrc.fileno(), fdst.fileno()):
+            used = "sendfile"
+        else:
+            fsrc.seek(os.lseek(fsrc.fileno(), 0, os.SEEK_CUR))
+            fdst.seek(os.lseek(fdst.fileno(), 0, os.SEEK_CUR))
+            shutil.copyfileobj(fsrc, fdst, COPY_CHUNK)
+            used = "shutil"
+    shutil.copystat(src, dst)
+    return used
+
+
+def clone_file(src: str, dst: str, mode: str = "auto", backend: str = "auto") -> str:
+    """Place src at dst using the cheapest method the mode allows. Returns the method used."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return "symlink"
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    elif mode in ("auto", "reflink"):
+        if reflink_file(src, dst):
+            return "reflink"
+    return kernel_copy(src, dst, backend)
+
+
+class Cancelled(Exception):
+    """Raised by sync_tree() and store.ingest_tree() once their cancel event is set."""
+
+
+class WorkQueue:
+    """Bounded thread pool fed by a single producer.
+
+    submit() blocks once workers * 4 jobs are pending, so a directory scan
+    can feed it directly without queueing the whole tree in memory. The first
+    exception raised by a job is re-raised on submit() or when leaving the
+    with block, and submit() raises Cancelled once cancel is set.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, cancel: Optional[threading.Event] = None):
+        self.workers = max(1, int(workers))
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.slots = threading.BoundedSemaphore(self.workers * 4)
+        self.errors = []
+        self.cancel = cancel
+
+    def submit(self, fn, *args):
+        if self.errors:
+            raise self.errors[0]
+        if self.cancel is not None and self.cancel.is_set():
+            raise Cancelled()
+        self.slots.acquire()
+        future = self.pool.submit(fn, *args)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.pool.shutdown(wait=True, cancel_futures=exc_type is not None)
+        if exc_type is None and self.errors:
+            raise self.errors[0]
+        return False
+
+
+def _clear_path(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+class JournalError(Exception):
+    """A leftover JOURNAL_DIR that can't be replayed; it is left for the user to sort out."""
+
+
+class Journal:
+    """Undo log of a transactional sync_tree().
+
+    Whatever would be overwritten or deleted below root is moved into
+    root/JOURNAL_DIR/files instead (a rename, as it's the same filesystem).
+    Every move and every path about to be written is appended to
+    root/JOURNAL_DIR/log before it happens, so rollback() can put root back
+    the way it was, also after the process was killed halfway (see
+    recover()). commit() drops the moved-aside files.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.dir = os.path.join(root, JOURNAL_DIR)
+        self.files = os.path.join(self.dir, "files")
+        self.log = os.path.join(self.dir, "log")
+        self.lock = threading.Lock()
+
+    def _append(self, action: str, rel: str):
+        # Flushed on close, not fsynced: this covers the process being killed, not the power going out
+        with self.lock:
+            os.makedirs(self.dir, exist_ok=True)
+            with open(self.log, "a", encoding="utf-8") as f:
+                f.write(json.dumps([action, rel]) + "\n")
+
+    def save(self, path: str):
+        """Move path (file, link or folder) aside before it is replaced or deleted."""
+        if not os.path.lexists(path):
+            return
+        rel = os.path.relpath(path, self.root)
+        self._append("saved", rel)
+        target = os.path.join(self.files, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+
+    def wrote(self, path: str):
+        self._append("wrote", os.path.relpath(path, self.root))
+
+    def rollback(self):
+        """Undo what the log records, newest first. Safe to run again if it is interrupted itself."""
+        records = []
+        if os.path.isfile(self.log):
+            with open(self.log, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Only the last line can be cut short, and what it announced never happened
+                        pass
+        # Every step undone is logged too, so a second run skips the ones already done
+        undone = sum(1 for action, _ in records if action == "undone")
+        steps = [record for record in records if record[0] != "undone"]
+        for action, rel in reversed(steps[:len(steps) - undone]):
+            target = os.path.join(self.root, rel)
+            if action == "wrote":
+                _clear_path(target)
+            else:
+                kept = os.path.join(self.files, rel)
+                if os.path.lexists(kept):
+                    _clear_path(target)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(kept, target)
+            self._append("undone", rel)
+        self.commit()
+
+    def commit(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def recover(root: str) -> bool:
+    """Roll back a transactional sync_tree() into root that was killed halfway. Returns True if there was one.
+
+    Raises JournalError if root has moved-aside files without the log that
+    says where they go.
+    """
+    journal = Journal(root)
+    if not os.path.isdir(journal.dir):
+        return False
+    if not os.path.isfile(journal.log) and os.listdir(journal.dir):
+        raise JournalError(f"{journal.dir} holds files an interrupted restore moved aside, but not the list of "
+                           "where they came from. Move them back into the installation by hand, then delete it.")
+    journal.rollback()
+    return True
+
+
+def sync_tree(src: str, dst: str, mode: str = "copy", delete: bool = False, compare_content: bool = False,
+              workers: int = DEFAULT_WORKERS, backend: str = "auto", progress: Optional[Callable[[int], None]] = None,
+              on_total: Optional[Callable[[int], None]] = None, cancel: Optional[threading.Event] = None,
+              transactional: bool = False) -> dict:
+    """Make dst match src, writing only the files that differ.
+
+    src is walked once; each file is compared with its counterpart in dst
+    (same inode, or same size and mtime; with compare_content, same content) and
+    differing files are handed to a pool of workers. Modification times must
+    match to the nanosecond, unless a filesystem stores them more coarsely
+    (see MTIME_RESOLUTION). With delete, entries in
+    dst that don't exist in src are removed along the way.
+
+    progress receives bytes as they are written, on_total the running total
+    of bytes that need writing, which grows while the scan is in progress.
+
+    Setting cancel stops the sync after the files being written right now
+    and raises Cancelled. With transactional, everything replaced or deleted
+    in dst is kept aside (see Journal) until the sync is done, and put back
+    if it is cancelled or fails, so dst is never left half-synced. A journal
+    left in dst by a sync that was killed is rolled back before anything
+    else; JournalError is raised if that isn't possible.
+    """
+    stats = {"written": 0, "unchanged": 0, "deleted": 0, "bytes": 0, "methods": {}}
+    lock = threading.Lock()
+    # An earlier sync that was killed is undone first; its journal is the only copy of what it moved aside
+    recover(dst)
+    journal = None
+    if transactional:
+        # Made up front, so rolling back never has to remove dst itself (and the journal in it)
+        os.makedirs(dst, exist_ok=True)
+        journal = Journal(dst)
+
+    def remove(path):
+        if journal:
+            journal.save(path)
+        else:
+            _clear_path(path)
+
+    def add_total(size):
+        with lock:
+            stats["bytes"] += size
+            total = stats["bytes"]
+        if on_total:
+            on_total(total)
+
+    def copy_job(src_file, dst_file, size):
+        if cancel is not None and cancel.is_set():
+            return
+        if journal:
+            journal.save(dst_file)
+            journal.wrote(dst_file)
+        method = clone_file(src_file, dst_file, mode, backend)
+        with lock:
+            stats["written"] += 1
+            stats["methods"][method] = stats["methods"].get(method, 0) + 1
+        if progress:
+            progress(size)
+
+    def compare_job(src_file, dst_file, size):
+        if filecmp.cmp(src_file, dst_file, shallow=False):
+            with lock:
+                stats["unchanged"] += 1
+            return
+        add_total(size)
+        copy_job(src_file, dst_file, size)
+
+    try:
+        with WorkQueue(workers, cancel) as queue:
+            for foldername, subfolders, filenames in os.walk(src):
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled()
+                relative_path = os.path.relpath(foldername, src)
+                target_folder = os.path.join(dst, relative_path) if relative_path != "." else dst
+                if os.path.islink(target_folder) or \
+                        (os.path.lexists(target_folder) and not os.path.isdir(target_folder)):
+                    remove(target_folder)
+                if not os.path.isdir(target_folder):
+                    if journal:
+                        journal.wrote(target_folder)
+                    os.makedirs(target_folder)
+
+                if delete:
+                    wanted = set(subfolders) | set(filenames)
+                    if journal and relative_path == ".":
+                        wanted.add(JOURNAL_DIR)
+                    for name in os.listdir(target_folder):
+                        if name not in wanted:
+                            remove(os.path.join(target_folder, name))
+                            with lock:
+                                stats["deleted"] += 1
+
+                # os.walk lists symlinks to directories as folders without entering them
+                names = filenames + [d for d in subfolders if os.path.islink(os.path.join(foldername, d))]
+                for name in names:
+                    src_file = os.path.join(foldername, name)
+                    dst_file = os.path.join(target_folder, name)
+                    src_st = os.lstat(src_file)
+                    try:
+                        dst_st = os.lstat(dst_file)
+                    except FileNotFoundError:
+                        dst_st = None
+                    if dst_st is not None and stat.S_ISDIR(dst_st.st_mode):
+                        remove(dst_file)
+                        dst_st = None
+
+                    if stat.S_ISLNK(src_st.st_mode):
+                        unchanged = dst_st is not None and stat.S_ISLNK(dst_st.st_mode) and \
+                            os.readlink(src_file) == os.readlink(dst_file)
+                    elif dst_st is None or stat.S_ISLNK(dst_st.st_mode) or src_st.st_size != dst_st.st_size:
+                        unchanged = False
+                    elif (src_st.st_dev, src_st.st_ino) == (dst_st.st_dev, dst_st.st_ino):
+                        unchanged = True
+                    elif compare_content:
+                        queue.submit(compare_job, src_file, dst_file, src_st.st_size)
+                        continue
+                    else:
+                        unchanged = same_mtime(src_file, src_st, dst_file, dst_st)
+
+                    if unchanged:
+                        with lock:
+                            stats["unchanged"] += 1
+                        continue
+                    add_total(src_st.st_size)
+                    queue.submit(copy_job, src_file, dst_file, src_st.st_size)
+        # Jobs still queued when cancel was set skipped their file
+        if cancel is not None and cancel.is_set():
+            raise Cancelled()
+    except BaseException:
+        if journal:
+            journal.rollback()
+        raise
+    if journal:
+        journal.commit()
+    return stats
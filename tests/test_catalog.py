@@ -0,0 +1,70 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "Linux"))
+
+import store  # noqa: E402
+import catalog  # noqa: E402
+
+
+class CatalogTest(unittest.TestCase):
+    """Release date order and picking up folders that changed behind the catalog's back."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        # The object store and the catalog live relative to the working directory
+        os.chdir(self.tmp)
+        catalog._db = None
+
+    def tearDown(self):
+        catalog._db.close()
+        catalog._db = None
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def version(self, name, date=None):
+        source = os.path.join("downloads", name)
+        os.makedirs(source)
+        with open(os.path.join(source, "worldbox.exe"), "w") as f:
+            f.write(name)
+        store.ingest_tree(source, os.path.join("versions", "Windows", name), "versions", f"Windows/{name}",
+                          meta={"date": date} if date else None)
+
+    def names(self, order):
+        return [entry["manifest_id"] for entry in catalog.entries("versions", "Windows", order=order)]
+
+    def test_dates_sort_by_the_day_they_stand_for(self):
+        self.version("march", "2024-03-01")
+        self.version("january", "05.01.2024")
+        self.version("february", "February 10, 2024")
+        self.version("undated")
+        self.version("noon", "2024-03-01T12:00:00+02:00")
+        self.assertEqual(self.names("-date"), ["noon", "march", "february", "january", "undated"])
+        self.assertEqual(self.names("date"), ["january", "february", "march", "noon", "undated"])
+
+    def test_refresh_stale_picks_up_added_and_removed_folders(self):
+        self.version("1")
+        self.version("2")
+        catalog.rescan()
+        shutil.rmtree(os.path.join("versions", "Windows", "1"))
+        os.makedirs(os.path.join("versions", "Mac", "7"))
+        with open(os.path.join("versions", "Mac", "7", "worldbox"), "w") as f:
+            f.write("copied in by hand")
+
+        # Checked against the disk a moment ago, so nothing is rescanned yet
+        self.assertFalse(catalog.refresh_stale())
+        self.assertEqual(self.names("name"), ["1", "2"])
+
+        self.assertTrue(catalog.refresh_stale(max_age=0))
+        self.assertEqual(self.names("name"), ["2"])
+        added = catalog.get("versions", "Mac/7")
+        self.assertEqual((added["files"], added["bytes"], added["content_hash"]), (1, 17, None))
+        self.assertEqual(catalog.platforms(), ["Mac", "Windows"])
+
+
+if __name__ == "__main__":
+    unittest.main()
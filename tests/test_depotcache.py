@@ -0,0 +1,106 @@
+import io
+import os
+import sys
+import struct
+import hashlib
+import zipfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "Linux"))
+
+import depotcache  # noqa: E402
+
+
+def varint(value):
+    out = b""
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        if not value:
+            return out + bytes([byte])
+        out += bytes([byte | 0x80])
+
+
+def field(number, value):
+    """A protobuf field: ints as varints, bytes length-delimited."""
+    if isinstance(value, int):
+        return varint(number << 3) + varint(value)
+    return varint(number << 3 | 2) + varint(len(value)) + value
+
+
+def mapping(name, size=0, flags=0, content=None, link=None):
+    data = field(depotcache.FILE_NAME, name.encode() + b"\0") + field(depotcache.FILE_SIZE, size)
+    data += field(depotcache.FILE_FLAGS, flags) + field(depotcache.FILE_SHA_FILENAME, b"\x01" * 20)
+    if content is not None:
+        data += field(depotcache.FILE_SHA_CONTENT, hashlib.sha1(content).digest())
+    if link is not None:
+        data += field(depotcache.FILE_LINK, link.encode())
+    return field(1, data)
+
+
+def section(magic, data):
+    return struct.pack("<II", magic, len(data)) + data
+
+
+def manifest(files, encrypted=False):
+    payload = b"".join(files)
+    metadata = (field(depotcache.META_DEPOT, 1206561) + field(depotcache.META_MANIFEST, 5634587210598745123)
+                + field(depotcache.META_CREATED, 1700000000) + field(depotcache.META_ENCRYPTED, int(encrypted))
+                + field(depotcache.META_SIZE, 9))
+    return (section(depotcache.PAYLOAD_MAGIC, payload) + section(depotcache.METADATA_MAGIC, metadata)
+            + section(depotcache.SIGNATURE_MAGIC, b"") + struct.pack("<I", depotcache.END_MAGIC))
+
+
+FILES = [
+    mapping("worldbox.exe", 3, content=b"exe"),
+    mapping("worldbox_Data", flags=depotcache.FLAG_DIRECTORY),
+    mapping("worldbox_Data\\Managed\\Assembly-CSharp.dll", 6, content=b"csharp"),
+    mapping("worldbox_Data\\empty.txt", 0, content=b""),
+    mapping("worldbox_Data\\current", flags=depotcache.FLAG_SYMLINK, link="Managed"),
+]
+
+
+class ParseTest(unittest.TestCase):
+    """depotcache.parse() on a small manifest built field by field."""
+
+    def test_file_list(self):
+        parsed = depotcache.parse(manifest(FILES))
+        self.assertEqual(parsed["depot_id"], "1206561")
+        self.assertEqual(parsed["manifest_id"], "5634587210598745123")
+        self.assertEqual(parsed["created"], 1700000000)
+        self.assertEqual(parsed["size"], 9)
+        self.assertFalse(parsed["encrypted"])
+        # Backslashes of the Windows depot become slashes
+        self.assertEqual(sorted(parsed["files"]), ["worldbox.exe", "worldbox_Data",
+                                                   "worldbox_Data/Managed/Assembly-CSharp.dll",
+                                                   "worldbox_Data/current", "worldbox_Data/empty.txt"])
+        self.assertEqual(parsed["files"]["worldbox_Data/current"]["link"], "Managed")
+        self.assertEqual(parsed["files"]["worldbox_Data"]["flags"], depotcache.FLAG_DIRECTORY)
+
+    def test_digests_skip_folders_links_and_empty_files(self):
+        digests = depotcache.digests(depotcache.parse(manifest(FILES)))
+        self.assertEqual(digests, {
+            "worldbox.exe": (3, hashlib.sha1(b"exe").hexdigest()),
+            "worldbox_Data/Managed/Assembly-CSharp.dll": (6, hashlib.sha1(b"csharp").hexdigest()),
+        })
+
+    def test_zipped_manifest(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("z", manifest(FILES))
+        self.assertEqual(depotcache.parse(buffer.getvalue())["files"].keys(),
+                         depotcache.parse(manifest(FILES))["files"].keys())
+
+    def test_encrypted_names_give_no_digests(self):
+        parsed = depotcache.parse(manifest(FILES, encrypted=True))
+        self.assertTrue(parsed["encrypted"])
+        self.assertEqual(depotcache.digests(parsed), {})
+
+    def test_not_a_manifest(self):
+        with self.assertRaises(ValueError):
+            depotcache.parse(b"not a manifest at all")
+        with self.assertRaises(ValueError):
+            depotcache.parse(manifest(FILES)[:40])
+
+
+if __name__ == "__main__":
+    unittest.main()
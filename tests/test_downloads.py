@@ -0,0 +1,56 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "Linux"))
+
+import downloads  # noqa: E402
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+class KilledDownloadTest(unittest.TestCase):
+    """A download killed mid-way still points at the session's depot folder; its files aren't thrown away."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        # downloads.json and the parked depots live relative to the working directory
+        os.chdir(self.tmp)
+        self.depot_dir = os.path.join("storage", "staging", "session", "depot_1206562")
+        write(os.path.join(self.depot_dir, "worldbox_Data", "level0"), "half")
+        downloads.update(("Linux", "100"), status="running", profile=None, partial=self.depot_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_same_job_resumes_in_place(self):
+        self.assertEqual(downloads.claim(("Linux", "100"), self.depot_dir), [])
+        self.assertTrue(downloads.unpark(("Linux", "100"), self.depot_dir))
+        self.assertTrue(os.path.isfile(os.path.join(self.depot_dir, "worldbox_Data", "level0")))
+
+    def test_empty_depot_folder_is_not_a_resume(self):
+        shutil.rmtree(self.depot_dir)
+        os.makedirs(self.depot_dir)
+        self.assertFalse(downloads.unpark(("Linux", "100"), self.depot_dir))
+
+    def test_other_job_parks_it_first(self):
+        self.assertEqual(downloads.claim(("Linux", "200"), self.depot_dir), [("Linux", "100")])
+        self.assertFalse(os.path.exists(self.depot_dir))
+        partial = downloads.get(("Linux", "100"))["partial"]
+        self.assertTrue(os.path.isfile(os.path.join(partial, "worldbox_Data", "level0")))
+
+        other_dir = os.path.join("storage", "staging", "session-2", "depot_1206562")
+        self.assertTrue(downloads.unpark(("Linux", "100"), other_dir))
+        self.assertTrue(os.path.isfile(os.path.join(other_dir, "worldbox_Data", "level0")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "Linux"))
+
+import manifests  # noqa: E402
+
+OLD = {"Windows": [{"id": "111", "date": "2024-01-01"}]}
+NEW = {"Windows": [{"id": "222", "date": "2024-02-01"}, {"id": "111", "date": "2024-01-01"}]}
+
+
+class Response:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+        self.content = json.dumps(data).encode() if data is not None else b""
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+class ManifestCacheTest(unittest.TestCase):
+    """Fresh cache, revalidation (304 and 200) and the fallback when the server can't be reached."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        # The cache lives relative to the working directory
+        os.chdir(self.tmp)
+        self.log = []
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def cache(self, data, age, **validators):
+        manifests._write_json(manifests.CACHE_PATH, data)
+        manifests._write_json(manifests.META_PATH, dict(validators, fetched_at=time.time() - age))
+
+    def get_in_background(self, **kwargs):
+        data = manifests.get_manifest_data(log=self.log.append, **kwargs)
+        manifests._refresh_thread.join()
+        return data
+
+    def test_fresh_cache_is_served_without_asking(self):
+        self.cache(OLD, 60, etag='"v1"')
+        with mock.patch("requests.get") as get:
+            self.assertEqual(manifests.get_manifest_data(ttl=3600), OLD)
+        get.assert_not_called()
+
+    def test_stale_cache_revalidated_not_modified(self):
+        self.cache(OLD, 7200, etag='"v1"', last_modified="Mon, 01 Jan 2024 00:00:00 GMT")
+        with mock.patch("requests.get", return_value=Response(304)) as get:
+            self.assertEqual(self.get_in_background(ttl=3600), OLD)
+        get.assert_called_once()
+        headers = get.call_args.kwargs["headers"]
+        self.assertEqual(headers["If-None-Match"], '"v1"')
+        self.assertEqual(headers["If-Modified-Since"], "Mon, 01 Jan 2024 00:00:00 GMT")
+        data, meta = manifests.load_cached()
+        self.assertEqual(data, OLD)
+        self.assertEqual(meta["etag"], '"v1"')
+        self.assertLess(manifests.cache_age(), 60)
+
+    def test_stale_cache_revalidated_modified(self):
+        self.cache(OLD, 7200, etag='"v1"')
+        response = Response(200, NEW, {"ETag": '"v2"', "Last-Modified": "Thu, 01 Feb 2024 00:00:00 GMT"})
+        with mock.patch("requests.get", return_value=response):
+            # The stale list is served right away, the new one is there for the next call
+            self.assertEqual(self.get_in_background(ttl=3600), OLD)
+        data, meta = manifests.load_cached()
+        self.assertEqual(data, NEW)
+        self.assertEqual(meta["etag"], '"v2"')
+        self.assertEqual(meta["last_modified"], "Thu, 01 Feb 2024 00:00:00 GMT")
+        self.assertEqual(manifests.get_manifest_data(ttl=3600), NEW)
+
+    def test_background_network_error_keeps_cache(self):
+        self.cache(OLD, 7200, etag='"v1"')
+        with mock.patch("requests.get", side_effect=requests.ConnectionError("no route")):
+            self.assertEqual(self.get_in_background(ttl=3600), OLD)
+        self.assertEqual(manifests.load_cached()[0], OLD)
+        self.assertGreater(manifests.cache_age(), 7000)
+        self.assertTrue(any("no route" in line for line in self.log))
+
+    def test_forced_refresh_falls_back_to_cache(self):
+        self.cache(OLD, 60)
+        with mock.patch("requests.get", side_effect=requests.ConnectionError("no route")):
+            self.assertEqual(manifests.get_manifest_data(force=True), OLD)
+
+    def test_no_cache_and_no_network_raises(self):
+        with mock.patch("requests.get", side_effect=requests.ConnectionError("no route")):
+            with self.assertRaises(requests.ConnectionError):
+                manifests.get_manifest_data()
+
+    def test_offline_never_asks(self):
+        self.cache(OLD, 7200)
+        with mock.patch("requests.get") as get:
+            self.assertEqual(manifests.get_manifest_data(offline=True), OLD)
+        get.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
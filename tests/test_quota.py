@@ -0,0 +1,78 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "Linux"))
+
+import store  # noqa: E402
+import quota  # noqa: E402
+import catalog  # noqa: E402
+
+
+class EnforceTest(unittest.TestCase):
+    """quota.enforce() removes the least recently used versions and never the protected ones."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        # The object store and the catalog live relative to the working directory
+        os.chdir(self.tmp)
+        catalog._db = None
+        for number in range(1, 6):
+            self.version(str(number), created=1000 + number)
+
+    def tearDown(self):
+        catalog._db.close()
+        catalog._db = None
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def version(self, name, created):
+        source = os.path.join("downloads", name)
+        os.makedirs(source)
+        with open(os.path.join(source, "worldbox.exe"), "w") as f:
+            f.write(f"build {name}" * 100)
+        store.ingest_tree(source, os.path.join("versions", "Windows", name), "versions", f"Windows/{name}")
+        store.update_tree("versions", f"Windows/{name}", created=created)
+
+    def enforce(self, keep=None, **config):
+        return [entry["name"] for entry in quota.enforce(dict(config, quota={"Windows": {"count": 2}}), keep)]
+
+    def remaining(self):
+        return sorted(entry["name"] for entry in catalog.entries("versions", "Windows"))
+
+    def test_least_recently_used_go_first(self):
+        # 1 was downgraded to after 2 and 3 were stored, so it counts as newer than them
+        store.update_tree("versions", "Windows/1", used=1004.5)
+        self.assertEqual(self.enforce(), ["Windows/2", "Windows/3", "Windows/4"])
+        self.assertEqual(self.remaining(), ["Windows/1", "Windows/5"])
+        self.assertFalse(os.path.exists(os.path.join("versions", "Windows", "2")))
+        # The objects only the removed versions used are collected
+        self.assertEqual(catalog.usage("versions", "Windows")["stored"], 2 * len("build 1") * 100)
+
+    def test_pinned_installed_and_kept_stay(self):
+        quota.set_pinned("versions", "Windows/1", True)
+        quota.mark_used("versions", "Windows/2", "install")
+        store.update_tree("versions", "Windows/2", used=900)
+        self.assertEqual(self.enforce(keep=("versions", "Windows/3"), installation_path="install"),
+                         ["Windows/4", "Windows/5"])
+        self.assertEqual(self.remaining(), ["Windows/1", "Windows/2", "Windows/3"])
+
+    def test_untracked_folders_are_left_alone(self):
+        os.makedirs(os.path.join("versions", "Windows", "0"))
+        with open(os.path.join("versions", "Windows", "0", "worldbox.exe"), "w") as f:
+            f.write("copied in by hand")
+        catalog.rescan()
+        self.assertEqual(self.enforce(), ["Windows/1", "Windows/2", "Windows/3", "Windows/4"])
+        self.assertEqual(self.remaining(), ["Windows/0", "Windows/5"])
+        self.assertTrue(os.path.isdir(os.path.join("versions", "Windows", "0")))
+
+    def test_no_quota_removes_nothing(self):
+        self.assertEqual(quota.enforce({}), [])
+        self.assertEqual(len(self.remaining()), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "Linux"))
+
+import steam  # noqa: E402
+import store  # noqa: E402
+import downloads  # noqa: E402
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+class ProfileCommandTest(unittest.TestCase):
+    """A profile download sends SteamCMD a filelist of plain depot paths, in the filelist's argument slot."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        # The object store and downloads.json live relative to the working directory
+        os.chdir(self.tmp)
+        write(os.path.join("old", "worldbox_Data", "Managed", "Assembly-CSharp.dll"), "code")
+        write(os.path.join("old", "worldbox_Data", "boot.config"), "boot")
+        write(os.path.join("old", "worldbox_Data", "level0"), "level")
+        write(os.path.join("old", "worldbox"), "elf")
+        store.ingest_tree("old", steam.version_path("Linux", "100"), "versions", "Linux/100")
+        self.install_dir = os.path.join(self.tmp, "session")
+        self.worker = steam.SteamWorker("player", None, lambda: "", install_dir=self.install_dir, seed=False)
+
+    def tearDown(self):
+        self.worker.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_profile_job_command_line(self):
+        sent = []
+        depot_dir = self.worker._depot_dir("Linux")
+
+        async def fake_send(line, process=None):
+            sent.append(line)
+            self.worker.events.put_nowait(steam.parse_line(
+                f'Success! App \'1206560\' Depot download complete : "{depot_dir}" (2 files, manifest 200)'))
+
+        async def download():
+            self.worker.events = asyncio.Queue()
+            return await self.worker._download(("Linux", "200"))
+
+        self.worker._send = fake_send
+        downloads.update(("Linux", "200"), status="running", profile="managed-only")
+        path = asyncio.run_coroutine_threadsafe(download(), self.worker.loop).result()
+
+        filelist = os.path.join(self.install_dir, "filelist-managed-only.txt")
+        self.assertEqual(sent, [f'download_depot 1206560 1206562 200 0 "{filelist}"'])
+        self.assertEqual(path, depot_dir)
+        with open(filelist) as f:
+            self.assertEqual(f.read().splitlines(),
+                             ["worldbox_Data/Managed/Assembly-CSharp.dll", "worldbox_Data/boot.config"])
+
+    def test_full_download_has_no_filelist(self):
+        self.assertEqual(steam.download_command("Windows", "300"), "download_depot 1206560 1206561 300")
+
+    def test_windows_filelist_uses_backslashes(self):
+        path = steam.write_filelist("managed-only", ["worldbox_Data/Managed/UnityEngine.dll", "worldbox.exe"],
+                                    os.path.join(self.tmp, "list.txt"), "Windows")
+        with open(path) as f:
+            self.assertEqual(f.read(), "worldbox_Data\\Managed\\UnityEngine.dll\n")
+        self.assertIsNone(steam.write_filelist("managed-only", ["worldbox.exe"], path, "Windows"))
+
+
+class UnseedTest(unittest.TestCase):
+    """Without a depot manifest, only the seeded files SteamCMD rewrote are kept."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        write(os.path.join("old", "worldbox_Data", "level0"), "level")
+        write(os.path.join("old", "worldbox"), "elf")
+        self.tree = store.ingest_tree("old", steam.version_path("Linux", "100"), "versions", "Linux/100")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_rewritten_files_stay(self):
+        steam.seed_depot(self.tree, "depot")
+        write(os.path.join("depot", "worldbox"), "ELF")
+
+        self.assertEqual(steam.unseed("depot", self.tree), 1)
+        self.assertFalse(os.path.exists(os.path.join("depot", "worldbox_Data", "level0")))
+        with open(os.path.join("depot", "worldbox")) as f:
+            self.assertEqual(f.read(), "ELF")
+
+    def test_seedable(self):
+        self.assertTrue(steam.seedable({}))
+        self.assertFalse(steam.seedable({"depot_manifest": None}))
+        self.assertFalse(steam.seedable({"depot_manifest": {"encrypted": True}}))
+        self.assertTrue(steam.seedable({"depot_manifest": {"encrypted": False}}))
+
+
+if __name__ == "__main__":
+    unittest.main()
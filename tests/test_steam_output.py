@@ -0,0 +1,129 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "Linux"))
+
+import steam  # noqa: E402
+
+# (SteamCMD output line, event type, fields parse_line() adds)
+LINES = [
+    ("Redirecting stderr to '/home/u/Steam/logs/stderr.txt'", "noise", {}),
+    ("[  0%] Checking for available updates...", "noise", {}),
+    ("[ 42%] Downloading update (17,523 of 41,322 KB)...", "noise", {}),
+    ("", "noise", {}),
+    ("Loading Steam API...OK", "line", {}),
+    ("Logging in user 'player' to Steam Public...", "line", {}),
+    ("Waiting for user info...OK", "login", {}),
+    ("Logged in OK", "login", {}),
+    ("This computer has not been authenticated for your account using Steam Guard.", "guard", {}),
+    ("Steam Guard code:", "guard", {}),
+    ("Two-factor code:", "guard", {}),
+    ("FAILED (Invalid Password)", "login_failed", {}),
+    ("Logging in user 'player' to Steam Public...FAILED (Rate Limit Exceeded)", "login_failed", {}),
+    (" Update state (0x61) downloading, progress: 45.32 (123456789 / 272394511)", "progress",
+     {"percent": 45.32, "current": 123456789, "total": 272394511}),
+    (" Update state (0x81) verifying update, progress: 0.00 (0 / 0)", "progress",
+     {"percent": 0.0, "current": 0, "total": 0}),
+    ('Depot download complete : "/home/u/steamcmd/steamapps/content/app_1206560/depot_1206562" '
+     "(1234 files, manifest 5634587210598745123)", "done",
+     {"path": "/home/u/steamcmd/steamapps/content/app_1206560/depot_1206562"}),
+    ('Depot download complete : "C:\\steamcmd\\steamapps\\content\\app_1206560\\depot_1206561" '
+     "(1234 files, manifest 5634587210598745123)", "done",
+     {"path": "C:/steamcmd/steamapps/content/app_1206560/depot_1206561"}),
+    ("ERROR! Download depot 1206561 failed (Failure).", "failed", {}),
+    ("Depot download failed : Missing configuration", "failed", {}),
+    # A lost connection wins over the failed download it causes
+    ("ERROR! Download depot 1206561 failed (No Connection).", "lost", {}),
+    ("Connection to Steam servers lost.", "lost", {}),
+    ("ERROR (Not logged on)", "lost", {}),
+]
+
+# (SteamCMD error line, failure kind)
+FAILURES = [
+    ("FAILED (Invalid Password)", "auth"),
+    ("Logging in user 'player' to Steam Public...FAILED (Rate Limit Exceeded)", "auth"),
+    ("FAILED (Account Logon Denied)", "auth"),
+    ("ERROR! Download depot 1206561 failed (No subscription).", "auth"),
+    ("ERROR! Download depot 1206561 failed (Manifest not available).", "manifest"),
+    ("ERROR! Download depot 1206561 failed (Invalid manifest).", "manifest"),
+    ("ERROR! Download depot 1206561 failed (Failure).", "network"),
+    ("ERROR! Download depot 1206561 failed (Timeout).", "network"),
+    ("FAILED (Service Unavailable)", "network"),
+    ("FAILED (Try Another CM)", "network"),
+    ("Depot download failed : Missing configuration", "unknown"),
+]
+
+
+@pytest.mark.parametrize("line, kind, fields", LINES)
+def test_parse_line(line, kind, fields):
+    event = steam.parse_line(line)
+    assert event == dict(fields, type=kind, line=line)
+
+
+@pytest.mark.parametrize("line, kind", FAILURES)
+def test_classify_failure(line, kind):
+    assert steam.classify_failure(line) == kind
+
+
+class FakeStdout:
+    """SteamCMD's stdout as chunks; an asyncio.Event in the list holds back what follows until it is set."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    async def read(self, size):
+        while self.chunks:
+            chunk = self.chunks.pop(0)
+            if isinstance(chunk, asyncio.Event):
+                await chunk.wait()
+                continue
+            return chunk
+        return b""
+
+
+def read_output(chunks, until=None):
+    """Events _read_output() queues for chunks; with until, those queued before it is set."""
+
+    async def run():
+        events = asyncio.Queue()
+        gate = asyncio.Event()
+        process = type("Process", (), {"stdout": FakeStdout(c if c is not None else gate for c in chunks)})
+        task = asyncio.ensure_future(steam.SteamWorker._read_output(None, process, events))
+        seen = []
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), 1)
+            except asyncio.TimeoutError:
+                # Nothing more until the gate opens
+                seen.append("blocked")
+                gate.set()
+                continue
+            if event is None:
+                break
+            seen.append(event["type"])
+        await task
+        return seen
+
+    return asyncio.run(run())
+
+
+def test_guard_prompt_without_newline():
+    # SteamCMD waits for the code without ending the line; None stands for the wait
+    seen = read_output([b"Logging in user 'player' to Steam Public...\r\n", b"Steam Guard code:", None,
+                        b"\r\nWaiting for user info...OK\r\n"])
+    assert seen == ["line", "guard", "blocked", "login"]
+
+
+def test_progress_lines_separated_by_carriage_returns():
+    seen = read_output([b" Update state (0x61) downloading, progress: 10.00 (100 / 1000)\r"
+                        b" Update state (0x61) downloading, progress: 20.00 (200 / 1000)\r",
+                        b" Update state (0x61) downloading, progress: 30.00 (300 / 1000)\r\n"])
+    assert seen == ["progress", "progress", "progress"]
+
+
+def test_line_split_across_chunks():
+    seen = read_output([b"Depot download complete : \"/tmp/depot", b"_1206562\" (1 files, manifest 1)\n"])
+    assert seen == ["done"]
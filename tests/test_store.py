@@ -0,0 +1,61 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "Linux"))
+
+import store  # noqa: E402
+import verify  # noqa: E402
+
+
+@unittest.skipIf(os.name == "nt", "needs symlinks")
+class DirectorySymlinkTest(unittest.TestCase):
+    """Symlinks to folders (macOS framework layouts) survive ingest_tree() and are checked by verify_tree()."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.tmp = tempfile.mkdtemp()
+        # The object store and the catalog live relative to the working directory
+        os.chdir(cls.tmp)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def make_framework(self, root):
+        versions = os.path.join(root, "Fw.framework", "Versions")
+        os.makedirs(os.path.join(versions, "A"))
+        with open(os.path.join(versions, "A", "Fw"), "w") as f:
+            f.write("binary")
+        os.symlink("A", os.path.join(versions, "Current"))
+        os.symlink("Versions/Current/Fw", os.path.join(root, "Fw.framework", "Fw"))
+
+    def test_moved_download_keeps_directory_links(self):
+        self.make_framework("staged")
+        tree = store.ingest_tree("staged", "versions/Mac/1", "versions", "Mac/1", move=True)
+
+        self.assertEqual(tree["files"]["Fw.framework/Versions/Current"], {"link": "A"})
+        self.assertEqual(tree["files"]["Fw.framework/Fw"], {"link": "Versions/Current/Fw"})
+        stored = os.path.join("versions", "Mac", "1", "Fw.framework")
+        self.assertEqual(os.readlink(os.path.join(stored, "Versions", "Current")), "A")
+        with open(os.path.join(stored, "Fw")) as f:
+            self.assertEqual(f.read(), "binary")
+        self.assertFalse(os.path.lexists(os.path.join("staged", "Fw.framework", "Versions", "Current")))
+        self.assertTrue(verify.verify_tree("versions", "Mac/1", processes=1)["ok"])
+
+    def test_verify_reports_missing_directory_link(self):
+        self.make_framework("backup-src")
+        store.ingest_tree("backup-src", "backups/b1", "backups", "b1")
+        os.remove(os.path.join("backups", "b1", "Fw.framework", "Versions", "Current"))
+
+        report = verify.verify_tree("backups", "b1", processes=1)
+        self.assertFalse(report["ok"])
+        self.assertEqual(report["missing"], ["Fw.framework/Versions/Current"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import sys
+import errno
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "Linux"))
+
+import transfer  # noqa: E402
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class LeftoverJournalTest(unittest.TestCase):
+    """A transactional sync_tree() that was killed halfway is rolled back by the next sync, not thrown away."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "version")
+        self.dst = os.path.join(self.tmp, "install")
+        write(os.path.join(self.src, "game.dll"), "newer")
+        write(os.path.join(self.dst, "game.dll"), "old")
+        write(os.path.join(self.dst, "saves", "world.wbox"), "mine")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def kill_halfway(self):
+        # What a sync leaves behind when it dies after replacing game.dll and adding a folder
+        journal = transfer.Journal(self.dst)
+        journal.save(os.path.join(self.dst, "game.dll"))
+        journal.wrote(os.path.join(self.dst, "game.dll"))
+        write(os.path.join(self.dst, "game.dll"), "ha")
+        journal.save(os.path.join(self.dst, "saves", "world.wbox"))
+        journal.wrote(os.path.join(self.dst, "Mods"))
+        write(os.path.join(self.dst, "Mods", "mod.dll"), "mod")
+
+    def test_recover_puts_the_install_back(self):
+        self.kill_halfway()
+
+        self.assertTrue(transfer.recover(self.dst))
+        self.assertEqual(read(os.path.join(self.dst, "game.dll")), "old")
+        self.assertEqual(read(os.path.join(self.dst, "saves", "world.wbox")), "mine")
+        self.assertFalse(os.path.lexists(os.path.join(self.dst, "Mods")))
+        self.assertFalse(os.path.lexists(os.path.join(self.dst, transfer.JOURNAL_DIR)))
+        self.assertFalse(transfer.recover(self.dst))
+
+    def test_interrupted_rollback_is_finished(self):
+        self.kill_halfway()
+        journal = transfer.Journal(self.dst)
+        # The rollback itself dies after undoing the Mods folder
+        shutil.rmtree(os.path.join(self.dst, "Mods"))
+        journal._append("undone", "Mods")
+
+        transfer.sync_tree(self.src, self.dst, transactional=True)
+        self.assertEqual(read(os.path.join(self.dst, "game.dll")), "newer")
+        self.assertEqual(read(os.path.join(self.dst, "saves", "world.wbox")), "mine")
+        self.assertFalse(os.path.lexists(os.path.join(self.dst, transfer.JOURNAL_DIR)))
+
+    def test_journal_without_log_is_left_alone(self):
+        write(os.path.join(self.dst, transfer.JOURNAL_DIR, "game.dll"), "older")
+
+        with self.assertRaises(transfer.JournalError):
+            transfer.sync_tree(self.src, self.dst, delete=True)
+        self.assertEqual(read(os.path.join(self.dst, transfer.JOURNAL_DIR, "game.dll")), "older")
+        self.assertEqual(read(os.path.join(self.dst, "game.dll")), "old")
+
+
+class MtimeTest(unittest.TestCase):
+    """Same-size files are told apart by their mtime to the nanosecond, unless the filesystem is coarser."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "version")
+        self.dst = os.path.join(self.tmp, "install")
+        write(os.path.join(self.src, "game.dll"), "new")
+        write(os.path.join(self.dst, "game.dll"), "old")
+        mtime = os.stat(os.path.join(self.src, "game.dll")).st_mtime_ns
+        # Half a second apart, which the old one-second tolerance took for the same file
+        os.utime(os.path.join(self.dst, "game.dll"), ns=(mtime, mtime - 500_000_000))
+        self.dev = os.stat(self.dst).st_dev
+
+    def tearDown(self):
+        transfer._mtime_resolution.pop(self.dev, None)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_close_mtime_is_a_change(self):
+        stats = transfer.sync_tree(self.src, self.dst)
+        self.assertEqual(stats["written"], 1)
+        self.assertEqual(read(os.path.join(self.dst, "game.dll")), "new")
+        self.assertEqual(transfer.sync_tree(self.src, self.dst)["unchanged"], 1)
+
+    def test_fat_keeps_two_seconds(self):
+        transfer._mtime_resolution[self.dev] = transfer.MTIME_RESOLUTION["vfat"]
+        self.assertEqual(transfer.sync_tree(self.src, self.dst)["unchanged"], 1)
+
+
+@unittest.skipIf(transfer.fcntl is None, "FICLONE is Linux-only")
+class ReflinkFailureTest(unittest.TestCase):
+    """Only a filesystem that can't clone is given up on; a file that fails to clone is just copied."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "version", "game.dll")
+        self.dst = os.path.join(self.tmp, "install", "game.dll")
+        write(self.src, "game")
+        os.makedirs(os.path.dirname(self.dst))
+        self.dev = os.stat(os.path.dirname(self.dst)).st_dev
+        # Other tests may already have found out what the temp filesystem can do
+        transfer._reflink_unsupported.discard(self.dev)
+
+    def tearDown(self):
+        transfer._reflink_unsupported.discard(self.dev)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def place(self, code):
+        with mock.patch.object(transfer.fcntl, "ioctl", side_effect=OSError(code, os.strerror(code))):
+            return transfer.clone_file(self.src, self.dst, "auto")
+
+    def test_unsupported_filesystem_is_remembered(self):
+        for code in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY):
+            transfer._reflink_unsupported.discard(self.dev)
+            self.assertNotEqual(self.place(code), "reflink")
+            self.assertIn(self.dev, transfer._reflink_unsupported)
+            self.assertEqual(read(self.dst), "game")
+
+    def test_other_errors_fall_back_for_that_file_only(self):
+        for code in (errno.ENOSPC, errno.EIO):
+            self.assertNotEqual(self.place(code), "reflink")
+            self.assertNotIn(self.dev, transfer._reflink_unsupported)
+            self.assertEqual(read(self.dst), "game")
+
+
+if __name__ == "__main__":
+    unittest.main()